@@ -3,7 +3,13 @@ Base behavior dataset class.
 """
 import argparse
 import logging
+import mmap
+import multiprocessing
+import os
+import queue
 import time
+import traceback
+from collections import OrderedDict, deque
 
 import h5py
 import numpy as np
@@ -16,18 +22,42 @@ ACT_DIM = 28
 PROPRIOCEPTION_DIM = 20
 TASK_OBS_DIM = 456
 
+# Datasets of the processed episode files read by BHDataset, and the shape of a frame of each one
+DATASET_SHAPES = OrderedDict(
+    [
+        ("action", (ACT_DIM,)),
+        ("proprioception", (PROPRIOCEPTION_DIM,)),
+        ("rgb", (IMG_DIM, IMG_DIM, 3)),
+        ("task_obs", (TASK_OBS_DIM,)),
+    ]
+)
+DATASETS = list(DATASET_SHAPES.keys())
+
+# Defaults of LazyBHDataset: size of the cache of chunks in bytes, number of open files, and number of frames read at
+# once from datasets that are not chunked
+DEFAULT_CACHE_SIZE = 1024**3
+DEFAULT_MAX_OPEN_FILES = 256
+DEFAULT_CHUNK_LENGTH = 64
+# Default number of contiguous frames of the blocks shuffled by BatchPrefetcher
+DEFAULT_BLOCK_LENGTH = 8
+
 
 class BHDataset(object):
-    def __init__(self, spec_file):
+    def __init__(self, spec_file, num_workers=None):
+        """
+        :param spec_file: Spec file listing the processed episode files (see read_spec_file)
+        :param num_workers: Number of processes reading the files (see read_proc_parallel)
+        """
         self.files = read_spec_file(spec_file)
         t1 = time.time()
         log.info("Reading all training data into memory...")
+        arrays, self.scales = read_proc_parallel(self.files, num_workers=num_workers)
         (
             self.actions,
             self.proprioceptions,
             self.rgbs,
             self.task_obss,
-        ) = read_proc_parallel(self.files)
+        ) = arrays
         self.size = len(self.actions)
         log.debug("Time spent to read data: %.1fs" % (time.time() - t1))
 
@@ -35,14 +65,383 @@ class BHDataset(object):
         log.info("Sending data to gpu...")
         import torch
 
+        def to_tensor(key, array):
+            # The quantized observations (e.g. rgb in uint8) are normalised on the device
+            tensor = torch.as_tensor(array).to(self.device).to(torch.float32)
+            if self.scales[key] != 1.0:
+                tensor /= self.scales[key]
+            return tensor
+
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.actions = torch.tensor(self.actions, dtype=torch.float32).to(self.device)
-        self.proprioceptions = torch.tensor(self.proprioceptions, dtype=torch.float32).to(self.device)
-        self.rgbs = torch.tensor(self.rgbs, dtype=torch.float32).permute(0, 3, 1, 2).to(self.device)
-        self.task_obss = torch.tensor(self.task_obss, dtype=torch.float32).to(self.device)
+        self.actions = to_tensor("action", self.actions)
+        self.proprioceptions = to_tensor("proprioception", self.proprioceptions)
+        self.rgbs = to_tensor("rgb", self.rgbs).permute(0, 3, 1, 2)
+        self.task_obss = to_tensor("task_obs", self.task_obss)
         log.debug("Done.")
 
 
+class LazyBHDataset(object):
+    """
+    Dataset of processed episode files read on demand, for corpora larger than the memory
+    Only a global index of the frames (file and offset) is built at creation. The frames are read by chunks of the HDF5
+    datasets, kept in a least recently used cache of bounded size, from files kept open by each process using the
+    dataset. It can be used as a map-style torch Dataset (e.g. with a DataLoader with several workers): a sample is a
+    tuple (action, proprioception, rgb, task_obs) of float32 arrays, normalised and with the rgb channels first as in
+    BHDataset.to_device. The chunks are cached as stored, e.g. rgb in uint8. Slices of contiguous frames can also be
+    indexed (e.g. dataset[start:stop])
+    """
+
+    def __init__(self, spec_file, cache_size=DEFAULT_CACHE_SIZE, max_open_files=DEFAULT_MAX_OPEN_FILES, files=None):
+        """
+        :param spec_file: Spec file listing the processed episode files (see read_spec_file)
+        :param cache_size: Maximum size in bytes of the cached chunks, per process
+        :param max_open_files: Maximum number of files kept open, per process
+        :param files: List of processed episode files, read instead of the files of the spec file (e.g. a shard of
+            them, see shard_files)
+        """
+        self.files = read_spec_file(spec_file) if files is None else files
+        self.cache_size = cache_size
+        self.max_open_files = max_open_files
+        lengths, _, _ = read_dataset_info(self.files)
+        # Global index of the first frame of each file
+        self.offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(int)
+        self.size = int(self.offsets[-1])
+        self.reset_handles()
+
+    def reset_handles(self):
+        """
+        Forget the open files and the cached chunks (e.g. in a new process, where the handles of the parent can not be
+        used)
+        """
+        self.pid = os.getpid()
+        self.handles = OrderedDict()
+        self.dataset_info = {}
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+
+    def __getstate__(self):
+        # The open files and the cache are not sent to the loading processes
+        state = self.__dict__.copy()
+        for name in ["handles", "dataset_info", "cache", "cached_bytes"]:
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.reset_handles()
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(self.size)
+            assert step == 1, "Only slices of contiguous frames are supported"
+            return self.get_slice(start, stop)
+        if idx < 0:
+            idx += self.size
+        if not 0 <= idx < self.size:
+            raise IndexError("Frame %d out of a dataset of %d frames" % (idx, self.size))
+        file_idx = int(np.searchsorted(self.offsets, idx, side="right")) - 1
+        frame = idx - self.offsets[file_idx]
+        return tuple(self.get_frames(file_idx, key, frame, frame + 1)[0] for key in DATASETS)
+
+    def get_slice(self, start, stop, keys=DATASETS):
+        """
+        :param keys: Datasets to read
+        :return: Tuple of arrays of the datasets (by default actions, proprioceptions, rgbs and task observations) of
+            the frames from start to stop (excluded), possibly from several files
+        """
+        frames = {key: [] for key in keys}
+        first_file = int(np.searchsorted(self.offsets, start, side="right")) - 1
+        for file_idx in range(max(first_file, 0), len(self.files)):
+            if self.offsets[file_idx] >= stop:
+                break
+            file_start = max(start, self.offsets[file_idx]) - self.offsets[file_idx]
+            file_stop = min(stop, self.offsets[file_idx + 1]) - self.offsets[file_idx]
+            if file_stop > file_start:
+                for key in keys:
+                    frames[key].append(self.get_frames(file_idx, key, file_start, file_stop))
+        return tuple(
+            np.concatenate(frames[key]) if len(frames[key]) > 0 else np.empty((0,) + get_frame_shape(key), np.float32)
+            for key in keys
+        )
+
+    def get_file(self, file_idx):
+        """
+        :return: Open HDF5 file, opened by this process
+        """
+        if self.pid != os.getpid():
+            self.reset_handles()
+        if file_idx in self.handles:
+            self.handles.move_to_end(file_idx)
+        else:
+            if len(self.handles) >= self.max_open_files:
+                _, hf = self.handles.popitem(last=False)
+                hf.close()
+            self.handles[file_idx] = h5py.File(self.files[file_idx], "r")
+        return self.handles[file_idx]
+
+    def get_dataset_info(self, file_idx, key):
+        """
+        :return: Tuple of (number of frames of the chunks, scale of the stored values) of a dataset of a file
+        """
+        if (file_idx, key) not in self.dataset_info:
+            dataset = self.get_file(file_idx)[key]
+            chunk_length = dataset.chunks[0] if dataset.chunks is not None else DEFAULT_CHUNK_LENGTH
+            self.dataset_info[(file_idx, key)] = (chunk_length, get_scale(dataset))
+        return self.dataset_info[(file_idx, key)]
+
+    def get_chunk(self, file_idx, key, chunk_idx):
+        """
+        :return: Tuple of (chunk of frames of a dataset of a file, index of its first frame in the file), from the cache
+            if possible. The chunks are the HDF5 chunks of the dataset along the frames
+        """
+        hf = self.get_file(file_idx)
+        chunk_length, _ = self.get_dataset_info(file_idx, key)
+        cache_key = (file_idx, key, chunk_idx)
+        if cache_key in self.cache:
+            self.cache.move_to_end(cache_key)
+        else:
+            chunk = hf[key][chunk_idx * chunk_length : (chunk_idx + 1) * chunk_length]
+            self.cache[cache_key] = chunk
+            self.cached_bytes += chunk.nbytes
+            # The chunk just read is kept even if it is larger than the cache
+            while self.cached_bytes > self.cache_size and len(self.cache) > 1:
+                _, evicted = self.cache.popitem(last=False)
+                self.cached_bytes -= evicted.nbytes
+        return self.cache[cache_key], chunk_idx * chunk_length
+
+    def read_frames(self, file_idx, key, start, stop):
+        """
+        :return: Array of the frames from start to stop (excluded) of a dataset of a file, as stored in the file
+        """
+        chunk_length, _ = self.get_dataset_info(file_idx, key)
+        parts = []
+        for chunk_idx in range(start // chunk_length, (stop - 1) // chunk_length + 1):
+            chunk, chunk_start = self.get_chunk(file_idx, key, chunk_idx)
+            parts.append(chunk[max(start - chunk_start, 0) : stop - chunk_start])
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def get_frames(self, file_idx, key, start, stop):
+        """
+        :return: Array of the frames from start to stop (excluded) of a dataset of a file, converted with convert_frames
+        """
+        _, scale = self.get_dataset_info(file_idx, key)
+        return convert_frames(key, self.read_frames(file_idx, key, start, stop), scale=scale)
+
+    def close(self):
+        """
+        Close the files opened by this process
+        """
+        if self.pid == os.getpid():
+            for hf in self.handles.values():
+                hf.close()
+        self.reset_handles()
+
+
+def get_shuffled_batches(offsets, batch_size, block_length, rng):
+    """
+    Split the frames of the episodes into batches in random order: the frames of each episode are split into blocks of
+    contiguous frames, the blocks of all the episodes are shuffled, and the batches are cut from their concatenation
+    Reading blocks of frames decompresses each chunk of the files once per block instead of once per frame
+    :param offsets: Global index of the first frame of each episode, followed by the total number of frames
+    :param batch_size: Number of frames per batch (the last batch can be smaller)
+    :param block_length: Number of contiguous frames of the blocks. 1 shuffles the frames independently
+    :param rng: numpy random generator
+    :return: List of batches, each a list of (start, stop) ranges of global frame indices
+    """
+    blocks = [
+        (start, min(start + block_length, offsets[idx + 1]))
+        for idx in range(len(offsets) - 1)
+        for start in range(offsets[idx], offsets[idx + 1], block_length)
+    ]
+    batches = [[]]
+    num_frames = 0
+    for block_idx in rng.permutation(len(blocks)):
+        start, stop = blocks[block_idx]
+        while start < stop:
+            end = min(stop, start + batch_size - num_frames)
+            batches[-1].append((start, end))
+            num_frames += end - start
+            start = end
+            if num_frames == batch_size:
+                batches.append([])
+                num_frames = 0
+    if len(batches[-1]) == 0:
+        batches.pop()
+    return batches
+
+
+def _fill_buffer(dataset, buffer, ranges):
+    """
+    Read the frames of a batch into a batch buffer
+    :param dataset: LazyBHDataset
+    :param buffer: Dictionary of dataset name to array of the batch buffer
+    :param ranges: List of (start, stop) ranges of the frames of the batch
+    :return: Number of frames of the batch
+    """
+    position = 0
+    for start, stop in ranges:
+        for array, frames in zip(buffer.values(), dataset.get_slice(start, stop, keys=list(buffer.keys()))):
+            array[position : position + stop - start] = frames
+        position += stop - start
+    return position
+
+
+def _prefetch_worker(dataset, buffers, tasks, results):
+    """
+    Main loop of a loading process of BatchPrefetcher. The dataset and the batch buffers are inherited from the parent
+    when the process is forked
+    :param tasks: Queue of (index of the buffer, list of (start, stop) ranges of the frames of the batch), None to stop
+    :param results: Queue of (index of the buffer, number of frames of the batch, traceback of the error or None)
+    """
+    for buffer_idx, ranges in iter(tasks.get, None):
+        try:
+            results.put((buffer_idx, _fill_buffer(dataset, buffers[buffer_idx], ranges), None))
+        except Exception:
+            results.put((buffer_idx, 0, traceback.format_exc()))
+
+
+class BatchPrefetcher(object):
+    """
+    Iterator over shuffled minibatches of a LazyBHDataset, read in the background by loading processes
+    The batches are decoded into a fixed set of reusable buffers in shared memory: while a batch is used, the next ones
+    are read into the other buffers. A batch is a dictionary of dataset name to array of frames (converted with
+    convert_frames), valid until the next batch is requested. Each iteration is a new epoch
+    """
+
+    def __init__(
+        self,
+        dataset,
+        batch_size,
+        keys=DATASETS,
+        block_length=DEFAULT_BLOCK_LENGTH,
+        num_workers=2,
+        num_buffers=None,
+        seed=0,
+    ):
+        """
+        :param dataset: LazyBHDataset
+        :param batch_size: Number of frames per batch
+        :param keys: Datasets to read
+        :param block_length: Number of contiguous frames of the shuffled blocks (see get_shuffled_batches)
+        :param num_workers: Number of loading processes. If 0, the batches are read when requested, in this process
+        :param num_buffers: Number of batch buffers. If None, two more than the loading processes, so that they are all
+            busy while a batch is used
+        :param seed: Seed of the shuffling
+        """
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.block_length = block_length
+        self.rng = np.random.default_rng(seed)
+        if num_buffers is None:
+            num_buffers = num_workers + 2
+        allocate = allocate_shared_array if num_workers > 0 else np.empty
+        self.buffers = [
+            OrderedDict((key, allocate((batch_size,) + get_frame_shape(key), np.float32)) for key in keys)
+            for _ in range(num_buffers)
+        ]
+        context = multiprocessing.get_context("fork")
+        self.tasks = context.Queue() if num_workers > 0 else None
+        self.results = context.Queue() if num_workers > 0 else None
+        self.workers = [
+            context.Process(
+                target=_prefetch_worker, args=(dataset, self.buffers, self.tasks, self.results), daemon=True
+            )
+            for _ in range(num_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def get_result(self):
+        """
+        Wait for a batch read by the loading processes
+        :return: Tuple of (index of the buffer, number of frames of the batch)
+        """
+        while True:
+            try:
+                buffer_idx, num_frames, error = self.results.get(timeout=1.0)
+                break
+            except queue.Empty:
+                if not all(worker.is_alive() for worker in self.workers):
+                    raise RuntimeError("A loading process of the batch prefetcher died")
+        if error is not None:
+            raise RuntimeError("Failed to read a batch:\n{}".format(error))
+        return buffer_idx, num_frames
+
+    def __iter__(self):
+        batches = get_shuffled_batches(self.dataset.offsets, self.batch_size, self.block_length, self.rng)
+        free_buffers = list(range(len(self.buffers)))
+        # Buffers of the batches requested and not used yet, in the order of the batches, and the number of frames of
+        # the ones already read
+        pending = deque()
+        filled = {}
+        next_batch = 0
+        try:
+            for _ in range(len(batches)):
+                while len(free_buffers) > 0 and next_batch < len(batches):
+                    buffer_idx = free_buffers.pop()
+                    if len(self.workers) > 0:
+                        self.tasks.put((buffer_idx, batches[next_batch]))
+                    else:
+                        filled[buffer_idx] = _fill_buffer(self.dataset, self.buffers[buffer_idx], batches[next_batch])
+                    pending.append(buffer_idx)
+                    next_batch += 1
+                buffer_idx = pending.popleft()
+                while buffer_idx not in filled:
+                    result_idx, num_frames = self.get_result()
+                    filled[result_idx] = num_frames
+                num_frames = filled.pop(buffer_idx)
+                yield OrderedDict((key, array[:num_frames]) for key, array in self.buffers[buffer_idx].items())
+                free_buffers.append(buffer_idx)
+        finally:
+            # Batches still being read when the iteration stops must not be written into buffers used by the next one
+            while any(buffer_idx not in filled for buffer_idx in pending):
+                result_idx, num_frames = self.get_result()
+                filled[result_idx] = num_frames
+
+    def __len__(self):
+        return -(-self.dataset.size // self.batch_size)
+
+    def close(self):
+        """
+        Stop the loading processes
+        """
+        for worker in self.workers:
+            worker.terminate()
+            worker.join()
+        self.workers = []
+
+
+def get_scale(dataset):
+    """
+    :return: Scale of the values stored in a dataset of a processed episode file (see STORAGE_SCHEMA in
+        dataset_generation_il_example.py), 1 if they are not quantized
+    """
+    return float(dataset.attrs.get("scale", 1.0))
+
+
+def get_frame_shape(key):
+    """
+    :return: Shape of a frame of a dataset converted with convert_frames
+    """
+    return convert_frames(key, np.empty((0,) + DATASET_SHAPES[key])).shape[1:]
+
+
+def convert_frames(key, frames, scale=1.0):
+    """
+    Convert frames of a dataset read from the files to the inputs of the networks: float32, normalised by the scale of
+    the stored values, with the rgb channels first
+    """
+    frames = frames.astype(np.float32)
+    if scale != 1.0:
+        frames /= scale
+    if key == "rgb":
+        frames = np.moveaxis(frames, -1, -3)
+    return np.ascontiguousarray(frames)
+
+
 def read_spec_file(fname):
     files = []
     f = open(fname, "r")
@@ -57,23 +456,118 @@ def read_spec_file(fname):
     return files
 
 
-def read_proc_parallel(files):
-    # read action and state information from processed files
-    actions, proprioceptions, rgbs, task_obss = (
-        np.empty((0, ACT_DIM)),
-        np.empty((0, PROPRIOCEPTION_DIM)),
-        np.empty((0, IMG_DIM, IMG_DIM, 3)),
-        np.empty((0, TASK_OBS_DIM)),
-    )
+def read_dataset_info(files):
+    """
+    First pass of the loader: read the number of frames of each file and the type and scale of each dataset, without
+    reading the data
+    A dataset stored with the same scale in all the files is loaded as stored (e.g. rgb in uint8). Otherwise (e.g. files
+    written before and after the quantization of the images) it is loaded in float32, normalised
+    :param files: List of processed episode files
+    :return: Tuple of (list of number of frames per file, dictionary of dataset name to dtype of the loaded array,
+        dictionary of dataset name to scale of the loaded array)
+    """
+    lengths = []
+    dtypes = {}
+    file_scales = {key: set() for key in DATASETS}
     for f in files:
-        log.info("Processing file %s..." % f)
-        hf = h5py.File(f)
-        actions = np.append(actions, np.asarray(hf["action"]), axis=0)
-        proprioceptions = np.append(proprioceptions, np.asarray(hf["proprioception"]), axis=0)
-        rgbs = np.append(rgbs, np.asarray(hf["rgb"]), axis=0)
-        task_obss = np.append(task_obss, np.asarray(hf["task_obs"]), axis=0)
-        hf.close()
-    return actions, proprioceptions, rgbs, task_obss
+        with h5py.File(f, "r") as hf:
+            lengths.append(len(hf[DATASETS[0]]))
+            for key in DATASETS:
+                assert len(hf[key]) == lengths[-1], "The datasets of %s have different lengths" % f
+                dtypes[key] = np.promote_types(dtypes.get(key, hf[key].dtype), hf[key].dtype)
+                file_scales[key].add(get_scale(hf[key]))
+    scales = {}
+    for key in DATASETS:
+        if len(file_scales[key]) <= 1:
+            scales[key] = file_scales[key].pop() if len(file_scales[key]) == 1 else 1.0
+        else:
+            dtypes[key] = np.promote_types(np.float32, dtypes[key]) if dtypes[key].kind == "f" else np.float32
+            scales[key] = 1.0
+    return lengths, dtypes, scales
+
+
+def shard_files(files, lengths, num_shards):
+    """
+    Split processed episode files into shards with about the same number of frames: the longest files are assigned
+    first, each to the shard with the fewest frames so far
+    :param files: List of processed episode files
+    :param lengths: Number of frames of each file (see read_dataset_info)
+    :param num_shards: Number of shards
+    :return: List of shards, each a list of files in the order of the files
+    """
+    assert len(files) >= num_shards, "%d episode files can not be split into %d shards" % (len(files), num_shards)
+    shard_lengths = [0] * num_shards
+    shard_indices = [[] for _ in range(num_shards)]
+    for idx in np.argsort(lengths, kind="stable")[::-1]:
+        shard = int(np.argmin(shard_lengths))
+        shard_lengths[shard] += lengths[idx]
+        shard_indices[shard].append(idx)
+    return [[files[idx] for idx in sorted(indices)] for indices in shard_indices]
+
+
+def allocate_shared_array(shape, dtype):
+    """
+    Array in anonymous shared memory, written by the loading processes forked after its allocation
+    """
+    dtype = np.dtype(dtype)
+    size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+    return np.ndarray(shape, dtype=dtype, buffer=mmap.mmap(-1, size))
+
+
+def _read_file(task):
+    """
+    Second pass of the loader: read the datasets of a file directly into its frames of the preallocated arrays
+    :param task: Tuple of (file, index of its first frame in the arrays)
+    """
+    f, offset = task
+    log.info("Processing file %s..." % f)
+    with h5py.File(f, "r") as hf:
+        for key, (array, scale) in zip(DATASETS, _loading_arrays):
+            length = len(hf[key])
+            if length > 0:
+                hf[key].read_direct(array, dest_sel=np.s_[offset : offset + length])
+                file_scale = get_scale(hf[key])
+                if file_scale != scale:
+                    array[offset : offset + length] *= scale / file_scale
+
+
+# Arrays filled by _read_file and the scale of their values, inherited by the loading processes
+_loading_arrays = None
+
+
+def read_proc_parallel(files, num_workers=None):
+    """
+    Read the action and state information of processed episode files in two passes: the lengths of the files are read
+    first to allocate the final arrays once, and the files are then read directly into their slices of the arrays
+    The files are read by a pool of processes (h5py serializes the reads of the threads of a process) writing into
+    arrays in shared memory
+    :param files: List of processed episode files
+    :param num_workers: Number of loading processes. If None, one per core (at most one per file). If 0, the files are
+        read in this process
+    :return: Tuple of (tuple of arrays of actions, proprioceptions, rgbs and task observations of all the frames, as
+        stored in the files, dictionary of dataset name to scale of the values of its array). See read_dataset_info
+    """
+    global _loading_arrays
+    lengths, dtypes, scales = read_dataset_info(files)
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(int)
+    if num_workers is None:
+        num_workers = min(len(files), os.cpu_count())
+    allocate = allocate_shared_array if num_workers > 0 else np.empty
+    arrays = [allocate((offsets[-1],) + DATASET_SHAPES[key], dtypes[key]) for key in DATASETS]
+    _loading_arrays = [(array, scales[key]) for key, array in zip(DATASETS, arrays)]
+    # Largest files first, to balance the work of the processes
+    tasks = [(files[idx], offsets[idx]) for idx in np.argsort(lengths, kind="stable")[::-1]]
+    try:
+        if num_workers > 0:
+            with multiprocessing.get_context("fork").Pool(num_workers) as pool:
+                for _ in pool.imap_unordered(_read_file, tasks):
+                    pass
+        else:
+            for task in tasks:
+                _read_file(task)
+    finally:
+        _loading_arrays = None
+    return tuple(arrays), scales
 
 
 if __name__ == "__main__":
@@ -0,0 +1,132 @@
+"""
+Benchmark of the loading of processed episode files: load time and peak resident memory of read_proc_parallel versus the
+number of files, compared with the previous loader growing the arrays with np.append
+The episode files are synthetic, with the datasets and types written by dataset_generation_il_example.py
+Usage (from this directory):
+    python benchmark_loading.py --file-counts 1 2 4 8 16 --frames-per-file 300
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import base_input_utils as BIU
+import h5py
+import numpy as np
+
+LOADERS = ["append", "parallel", "sequential"]
+
+
+def read_proc_append(files):
+    """
+    Previous loader: grows the arrays with np.append for each file, copying all the data read so far
+    """
+    actions, proprioceptions, rgbs, task_obss = (
+        np.empty((0, BIU.ACT_DIM)),
+        np.empty((0, BIU.PROPRIOCEPTION_DIM)),
+        np.empty((0, BIU.IMG_DIM, BIU.IMG_DIM, 3)),
+        np.empty((0, BIU.TASK_OBS_DIM)),
+    )
+    for f in files:
+        hf = h5py.File(f, "r")
+        actions = np.append(actions, np.asarray(hf["action"]), axis=0)
+        proprioceptions = np.append(proprioceptions, np.asarray(hf["proprioception"]), axis=0)
+        rgbs = np.append(rgbs, np.asarray(hf["rgb"]), axis=0)
+        task_obss = np.append(task_obss, np.asarray(hf["task_obs"]), axis=0)
+        hf.close()
+    return actions, proprioceptions, rgbs, task_obss
+
+
+def write_episode_files(directory, num_files, frames_per_file):
+    """
+    :return: List of synthetic processed episode files
+    """
+    files = []
+    for idx in range(num_files):
+        path = os.path.join(directory, "synthetic_{}_episode.hdf5".format(idx))
+        with h5py.File(path, "w") as hf:
+            for key, shape in BIU.DATASET_SHAPES.items():
+                dtype = np.float64 if key == "action" else np.float32
+                data = np.random.uniform(size=(frames_per_file,) + shape).astype(dtype)
+                hf.create_dataset(key, data=data, compression="lzf")
+        files.append(path)
+    return files
+
+
+def measure(loader, files):
+    """
+    Load the files and report the load time and the peak resident memory of this process and of its loading workers
+    """
+    start_time = time.time()
+    if loader == "append":
+        arrays = read_proc_append(files)
+    else:
+        arrays, _ = BIU.read_proc_parallel(files, num_workers=None if loader == "parallel" else 0)
+    load_time = time.time() - start_time
+    checksum = float(sum(np.sum(array, dtype=np.float64) for array in arrays))
+    print(
+        json.dumps(
+            {
+                "load_time": load_time,
+                "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+                "peak_worker_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0,
+                "num_frames": len(arrays[0]),
+                "checksum": checksum,
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the loading of processed episode files")
+    parser.add_argument("--file-counts", nargs="+", default=[1, 2, 4, 8], type=int, help="numbers of files to load")
+    parser.add_argument("--frames-per-file", default=300, type=int, help="number of frames of each synthetic file")
+    parser.add_argument("--loaders", nargs="+", default=LOADERS, choices=LOADERS, help="loaders to compare")
+    parser.add_argument("--output", default=None, type=str, help="JSON file to save the results in")
+    parser.add_argument("--measure", nargs="+", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure is not None:
+        # Measurement of one loader in a fresh process, so that the peak memory of the others does not count
+        measure(args.measure[0], args.measure[1:])
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        all_files = write_episode_files(directory, max(args.file_counts), args.frames_per_file)
+        print(
+            "{:>6} {:>8} {:>11} {:>10} {:>14} {:>18}".format(
+                "files", "frames", "loader", "time (s)", "peak RSS (MB)", "worker RSS (MB)"
+            )
+        )
+        for num_files in args.file_counts:
+            checksums = []
+            for loader in args.loaders:
+                command = [sys.executable, os.path.abspath(__file__), "--measure", loader] + all_files[:num_files]
+                output = subprocess.run(command, check=True, stdout=subprocess.PIPE).stdout.decode("utf-8")
+                result = json.loads(output.strip().splitlines()[-1])
+                result.update({"num_files": num_files, "loader": loader})
+                results.append(result)
+                checksums.append(result["checksum"])
+                print(
+                    "{:>6} {:>8} {:>11} {:>10.2f} {:>14.0f} {:>18.0f}".format(
+                        num_files,
+                        result["num_frames"],
+                        loader,
+                        result["load_time"],
+                        result["peak_rss_mb"],
+                        result["peak_worker_rss_mb"],
+                    )
+                )
+            assert np.allclose(checksums, checksums[0]), "The loaders read different data"
+    if args.output is not None:
+        with open(args.output, "w+") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,14 +3,19 @@ Behavioral cloning agent network architecture and training
 """
 import argparse
 import logging
+import os
 import sys
+import time
 
 sys.path.insert(0, "../utils")
 import base_input_utils as BIU
 import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
+from torch.nn.parallel import DistributedDataParallel
 
 log = logging.getLogger(__name__)
 
@@ -63,34 +68,263 @@ class BCNet_taskObs(nn.Module):
         return x
 
 
+# Constructor and inputs (datasets of the processed episode files) of each network
+NETS = {"rgbp": BCNet_rgbp, "taskObs": BCNet_taskObs}
+NET_INPUTS = {"rgbp": ["rgb", "proprioception"], "taskObs": ["task_obs", "proprioception"]}
+
+
+class DeviceBatchCopier(object):
+    """
+    Copy of the batches of a BatchPrefetcher to the training device. On a GPU, the batches go through reusable pinned
+    buffers, so that the copies to the device are asynchronous. On the CPU, the batches are used in place
+    """
+
+    def __init__(self, device, batch_size, keys, num_staging_buffers=2):
+        """
+        :param device: Training device
+        :param batch_size: Maximum number of frames per batch
+        :param keys: Datasets of the batches
+        :param num_staging_buffers: Number of sets of pinned buffers used in turn
+        """
+        self.device = device
+        self.staging_buffers = []
+        if device != "cpu":
+            for _ in range(num_staging_buffers):
+                buffers = {
+                    key: torch.empty((batch_size,) + BIU.get_frame_shape(key), dtype=torch.float32, pin_memory=True)
+                    for key in keys
+                }
+                self.staging_buffers.append((buffers, torch.cuda.Event()))
+        self.next_staging_buffers = 0
+
+    def __call__(self, batch):
+        """
+        :param batch: Dictionary of dataset name to array of frames
+        :return: Dictionary of dataset name to tensor of frames on the device
+        """
+        if len(self.staging_buffers) == 0:
+            return {key: torch.from_numpy(array) for key, array in batch.items()}
+        buffers, copied = self.staging_buffers[self.next_staging_buffers]
+        self.next_staging_buffers = (self.next_staging_buffers + 1) % len(self.staging_buffers)
+        # The previous copies from these buffers to the device must be done before they are overwritten
+        copied.synchronize()
+        tensors = {}
+        for key, array in batch.items():
+            pinned = buffers[key][: len(array)]
+            pinned.copy_(torch.from_numpy(array))
+            tensors[key] = pinned.to(self.device, non_blocking=True)
+        copied.record()
+        return tensors
+
+
+def train_full_batch(bc_agent, optimizer, data, inputs, num_epochs):
+    """
+    Train with one gradient step per epoch over the whole dataset, in memory on the device
+    :param data: BHDataset, sent to the device
+    :param inputs: Datasets given to the network
+    """
+    tensors = {
+        "action": data.actions,
+        "proprioception": data.proprioceptions,
+        "rgb": data.rgbs,
+        "task_obs": data.task_obss,
+    }
+    loss_func = nn.MSELoss()
+    for epoch in range(num_epochs):
+        optimizer.zero_grad()
+        output = bc_agent(*[tensors[key] for key in inputs])
+        loss = loss_func(output, tensors["action"])
+        loss.backward()
+        optimizer.step()
+
+        log.info(loss.item())
+
+
+def train_minibatch(
+    bc_agent, optimizer, batches, copy_to_device, inputs, num_epochs, log_every=100, epoch_callback=None
+):
+    """
+    Train with minibatches read in the background, shuffled across the episodes at each epoch
+    :param batches: BatchPrefetcher of the actions and the inputs
+    :param copy_to_device: DeviceBatchCopier
+    :param inputs: Datasets given to the network
+    :param log_every: Number of batches between the logs of the loss and the throughput
+    :param epoch_callback: Function called with the index of the epoch at the end of each epoch (e.g. to save a
+        checkpoint)
+    """
+    loss_func = nn.MSELoss()
+    for epoch in range(num_epochs):
+        start_time = time.time()
+        interval_start_time = start_time
+        num_samples = 0
+        interval_samples = 0
+        total_loss = 0.0
+        for batch_idx, batch in enumerate(batches):
+            tensors = copy_to_device(batch)
+            optimizer.zero_grad()
+            output = bc_agent(*[tensors[key] for key in inputs])
+            loss = loss_func(output, tensors["action"])
+            loss.backward()
+            optimizer.step()
+
+            batch_samples = len(batch["action"])
+            total_loss += loss.item() * batch_samples
+            num_samples += batch_samples
+            interval_samples += batch_samples
+            if (batch_idx + 1) % log_every == 0:
+                log.info(
+                    "Epoch %d, batch %d/%d: loss %.4f, %.0f samples/s"
+                    % (
+                        epoch,
+                        batch_idx + 1,
+                        len(batches),
+                        loss.item(),
+                        interval_samples / (time.time() - interval_start_time),
+                    )
+                )
+                interval_start_time = time.time()
+                interval_samples = 0
+        log.info(
+            "Epoch %d: loss %.4f, %d samples, %.0f samples/s"
+            % (epoch, total_loss / max(num_samples, 1), num_samples, num_samples / (time.time() - start_time))
+        )
+        if epoch_callback is not None:
+            epoch_callback(epoch)
+
+
+def save_model(bc_agent, path):
+    """
+    Save the trained network, loaded by test_bc_agent.py
+    """
+    if os.path.dirname(path) != "":
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    torch.save(bc_agent, path)
+
+
+def train_distributed(rank, args):
+    """
+    Process of the data-parallel training on the CPU: it trains a replica of the network with minibatches of its shard
+    of the episodes, and the gradients are averaged across the processes at every step (DistributedDataParallel with
+    the gloo backend). The process of rank 0 saves the network at the end of every epoch
+    :param rank: Rank of the process, from 0 to args.num_processes - 1
+    :param args: Command line arguments
+    """
+    logging.basicConfig(level=logging.INFO if rank == 0 else logging.WARNING)
+    # The cores are split between the processes
+    torch.set_num_threads(max(1, os.cpu_count() // args.num_processes))
+    files = BIU.read_spec_file(args.spec)
+    lengths, _, _ = BIU.read_dataset_info(files)
+    shard = BIU.shard_files(files, lengths, args.num_processes)[rank]
+    file_lengths = dict(zip(files, lengths))
+    log.info("Process %d: %d episode files, %d frames" % (rank, len(shard), sum(file_lengths[f] for f in shard)))
+    inputs = NET_INPUTS[args.net]
+    keys = ["action"] + inputs
+    # The loading processes are forked before the process group starts its threads
+    batches = BIU.BatchPrefetcher(
+        BIU.LazyBHDataset(args.spec, files=shard),
+        args.batch_size,
+        keys=keys,
+        block_length=args.block_length,
+        num_workers=args.num_workers,
+        seed=rank,
+    )
+    os.environ.setdefault("MASTER_ADDR", "127.0.0.1")
+    os.environ.setdefault("MASTER_PORT", str(args.master_port))
+    dist.init_process_group("gloo", rank=rank, world_size=args.num_processes)
+    try:
+        # The replicas start from the weights of the process of rank 0, broadcast by DistributedDataParallel
+        bc_agent = DistributedDataParallel(NETS[args.net]())
+        optimizer = optim.Adam(bc_agent.parameters())
+
+        def save_checkpoint(epoch):
+            if rank == 0:
+                save_model(bc_agent.module, args.output)
+                log.info("Epoch %d: model saved to %s" % (epoch, args.output))
+
+        # The shards can have different numbers of batches: the processes that finish first keep joining the gradient
+        # averaging of the others
+        with bc_agent.join():
+            train_minibatch(
+                bc_agent,
+                optimizer,
+                batches,
+                DeviceBatchCopier("cpu", args.batch_size, keys),
+                inputs,
+                args.epochs,
+                epoch_callback=save_checkpoint,
+            )
+    finally:
+        batches.close()
+        dist.destroy_process_group()
+
+
 if __name__ == "__main__":
 
     def parse_args():
         parser = argparse.ArgumentParser(description="Dataset loader")
         parser.add_argument("--spec", type=str, help="spec file name")
+        parser.add_argument("--net", type=str, choices=list(NETS.keys()), default="taskObs", help="network to train")
+        parser.add_argument("--epochs", type=int, default=5, help="number of training epochs")
+        parser.add_argument(
+            "--batch_size",
+            type=int,
+            default=0,
+            help="number of frames per minibatch. If 0, full-batch training with all the data in memory",
+        )
+        parser.add_argument(
+            "--block_length",
+            type=int,
+            default=BIU.DEFAULT_BLOCK_LENGTH,
+            help="number of contiguous frames of the blocks shuffled across the episodes in minibatch training",
+        )
+        parser.add_argument(
+            "--num_workers", type=int, default=2, help="number of processes reading the batches in minibatch training"
+        )
+        parser.add_argument(
+            "--num_processes",
+            type=int,
+            default=1,
+            help="number of data-parallel training processes on the CPU, each with its shard of the episodes and "
+            "--batch_size frames per minibatch. Requires minibatch training",
+        )
+        parser.add_argument(
+            "--master_port", type=int, default=29500, help="port of the process group of the data-parallel training"
+        )
+        parser.add_argument("--output", type=str, default="trained_models/model.pth", help="trained model file")
         return parser.parse_args()
 
     args = parse_args()
-    data = BIU.BHDataset(args.spec)
-    data.to_device()
+
+    if args.num_processes > 1:
+        assert args.batch_size > 0, "The data-parallel training requires minibatch training (--batch_size)"
+        mp.spawn(train_distributed, args=(args,), nprocs=args.num_processes)
+        sys.exit(0)
+
+    logging.basicConfig(level=logging.INFO)
 
     # Training
     device = "cuda" if torch.cuda.is_available() else "cpu"
-    # bc_agent = BCNet_rgbp().to(device)
-    bc_agent = BCNet_taskObs().to(device)
+    bc_agent = NETS[args.net]().to(device)
     optimizer = optim.Adam(bc_agent.parameters())
+    inputs = NET_INPUTS[args.net]
 
-    NUM_EPOCH = 5
-    PATH = "trained_models/model.pth"
-
-    for epoch in range(NUM_EPOCH):
-        optimizer.zero_grad()
-        output = bc_agent(data.task_obss, data.proprioceptions)
-        loss_func = nn.MSELoss()
-        loss = loss_func(output, data.actions)
-        loss.backward()
-        optimizer.step()
-
-        log.info(loss.item())
+    if args.batch_size > 0:
+        keys = ["action"] + inputs
+        batches = BIU.BatchPrefetcher(
+            BIU.LazyBHDataset(args.spec),
+            args.batch_size,
+            keys=keys,
+            block_length=args.block_length,
+            num_workers=args.num_workers,
+        )
+        try:
+            copy_to_device = DeviceBatchCopier(device, args.batch_size, keys)
+            train_minibatch(bc_agent, optimizer, batches, copy_to_device, inputs, args.epochs)
+        finally:
+            batches.close()
+    else:
+        data = BIU.BHDataset(args.spec)
+        data.to_device()
+        train_full_batch(bc_agent, optimizer, data, inputs, args.epochs)
 
-    torch.save(bc_agent, PATH)
+    save_model(bc_agent, args.output)
@@ -0,0 +1,65 @@
+"""
+Action repeat (frame skip) for iGibson environments: the agent is queried once every k steps of 1/30 s and the
+observations are only computed, and rendered, in the last of them
+"""
+from contextlib import contextmanager
+
+import gym
+
+
+@contextmanager
+def skip_observations(env):
+    """
+    Skip computing the observations (and rendering) in the steps of an iGibson environment within the context: its
+    get_state returns None. Wrappers of get_state set on the instance (e.g. by StepProfiler) are kept
+    :param env: iGibson environment (unwrapped)
+    """
+    get_state = env.__dict__.get("get_state")
+    env.get_state = lambda: None
+    try:
+        yield
+    finally:
+        if get_state is None:
+            # Removing the instance attribute exposes the method of the class again
+            del env.get_state
+        else:
+            env.get_state = get_state
+
+
+class ActionRepeat(gym.Wrapper):
+    """
+    Wrapper that repeats each action for a number of steps of the environment and returns the sum of their rewards
+    The intermediate steps skip the observations: they are only computed in the last step, or after the step in which
+    the episode ends. With automatic reset, an episode ending in an intermediate step returns the observation after the
+    reset and its info has no last_observation
+    """
+
+    def __init__(self, env, repeat, step_callback=None):
+        """
+        Constructor
+        :param env: iGibson environment, or a wrapper of one
+        :param repeat: Number of steps of the environment per action
+        :param step_callback: Function called after every step of the environment with the action, the reward, whether
+            the episode is done and the info of the step (e.g. to evaluate the metrics at every step)
+        """
+        super(ActionRepeat, self).__init__(env)
+        assert repeat >= 1, "The action repeat must be at least 1"
+        self.repeat = repeat
+        self.step_callback = step_callback
+
+    def step(self, action):
+        total_reward = 0.0
+        for repeat in range(self.repeat):
+            if repeat < self.repeat - 1:
+                with skip_observations(self.env.unwrapped):
+                    state, reward, done, info = self.env.step(action)
+            else:
+                state, reward, done, info = self.env.step(action)
+            total_reward += reward
+            if self.step_callback is not None:
+                self.step_callback(action, reward, done, info)
+            if done:
+                break
+        if state is None:
+            state = self.env.unwrapped.get_state()
+        return state, total_reward, done, info
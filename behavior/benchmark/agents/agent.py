@@ -25,3 +25,42 @@ class Agent(object):
         :returns: action taken by the agent given the observation (and any internal information)
         """
         pass
+
+    def get_observation_keys(self):
+        """
+        Observations (modalities) used by the agent
+        The benchmark only computes these observations, skipping the rendering passes of the ones the agent does not use
+        :returns: list of observation keys (e.g. ["rgb", "proprioception"]), or None if the agent needs all the
+            observations of the environment config
+        """
+        return None
+
+    def act_batch(self, obs_batch):
+        """
+        Batched version of act, used when several environments are stepped in lockstep
+        By default, it calls act for each observation. Agents can override it to query their policy once for the batch
+        :param obs_batch: list of observations, one per environment
+        :returns: list of actions, one per observation
+        """
+        return [self.act(obs) for obs in obs_batch]
+
+    def reset_slot(self, slot_id):
+        """
+        Reset function for one environment of a lockstep evaluation (see act_slots)
+        To be called every time that the environment of the slot resets, while the other environments keep running
+        By default, it calls reset. Agents that keep a state per environment should only clear the one of the slot
+        :param slot_id: id of the environment slot
+        """
+        self.reset()
+
+    def act_slots(self, obs_batch, slot_ids):
+        """
+        Batched version of act used when several environments are stepped in lockstep, with the ids of the environment
+        slots of the observations. The id of a slot is stable during an episode, while the position of its observation
+        in the batch changes as the other slots start and finish episodes
+        By default, it calls act_batch
+        :param obs_batch: list of observations, one per environment
+        :param slot_ids: list of the ids of the environment slots of the observations
+        :returns: list of actions, one per observation
+        """
+        return self.act_batch(obs_batch)
@@ -0,0 +1,65 @@
+import json
+
+import numpy as np
+import torch
+
+from behavior.benchmark.agents.agent import Agent
+from behavior.benchmark.agents.policy_export import METADATA_FILE
+
+# Calls of the policy before the evaluation, so that TorchScript optimizes the graph before the first episode
+NUM_WARMUP_CALLS = 3
+
+
+class ExportedPPOAgent(Agent):
+    """
+    Implementation of the Agent class that runs a PPO policy exported with policy_export, without Stable Baselines 3
+    The observations are copied into preallocated input tensors and the policy runs in inference mode with a fixed
+    number of intra-op threads, so that it does not compete with the simulator and the renderer for all the cores
+    """
+
+    def __init__(self, policy_path, num_threads=1):
+        """
+        Constructor
+        :param policy_path: Policy exported with policy_export
+        :param num_threads: Number of intra-op threads of torch in this process
+        """
+        torch.set_num_threads(num_threads)
+        extra_files = {METADATA_FILE: ""}
+        self.policy = torch.jit.load(policy_path, map_location="cpu", _extra_files=extra_files)
+        self.policy.eval()
+        metadata = json.loads(extra_files[METADATA_FILE])
+        self.observations = [
+            (obs["key"], tuple(obs["shape"]), np.dtype(obs["dtype"])) for obs in metadata["observations"]
+        ]
+        # Input tensors per batch size, and numpy views of them to copy the observations into
+        self.inputs = {}
+        for _ in range(NUM_WARMUP_CALLS):
+            self.act({key: np.zeros(shape, dtype=dtype) for key, shape, dtype in self.observations})
+
+    def get_inputs(self, batch_size):
+        """
+        :return: Tuple of (list of input tensors, list of numpy views of them) for the given batch size
+        """
+        if batch_size not in self.inputs:
+            views = [np.zeros((batch_size,) + shape, dtype=dtype) for _, shape, dtype in self.observations]
+            self.inputs[batch_size] = ([torch.from_numpy(view) for view in views], views)
+        return self.inputs[batch_size]
+
+    def reset(self):
+        pass
+
+    def get_observation_keys(self):
+        # The observations the policy was trained with
+        return [key for key, _, _ in self.observations]
+
+    def act(self, obs):
+        return self.act_batch([obs])[0]
+
+    def act_batch(self, obs_batch):
+        tensors, views = self.get_inputs(len(obs_batch))
+        for (key, _, _), view in zip(self.observations, views):
+            for idx, obs in enumerate(obs_batch):
+                view[idx] = obs[key]
+        with torch.inference_mode():
+            actions = self.policy(*tensors).numpy()
+        return list(actions)
@@ -0,0 +1,110 @@
+"""
+Export of a trained Stable Baselines 3 PPO policy to a standalone TorchScript module with only the features extractor
+and the action head, to be run by ExportedPPOAgent without Stable Baselines 3
+Usage:
+    python -m behavior.benchmark.agents.policy_export path/to/ppo_checkpoint path/to/exported_policy.pt
+"""
+import argparse
+import json
+
+import numpy as np
+import torch
+import torch.nn as nn
+from stable_baselines3 import PPO
+from stable_baselines3.common.preprocessing import preprocess_obs
+
+# Name of the file with the metadata of the policy (observations and action space) stored in the exported module
+METADATA_FILE = "metadata.json"
+
+
+class DeterministicPolicy(nn.Module):
+    """
+    Deterministic action of a PPO actor-critic policy: preprocessing of the observations, features extractor, actor
+    network and action head. The value network is dropped. The observations are passed as positional tensors in the
+    order of the observation keys, with a batch dimension
+    """
+
+    def __init__(self, policy):
+        """
+        Constructor
+        :param policy: ActorCriticPolicy of a PPO model
+        """
+        super(DeterministicPolicy, self).__init__()
+        self.observation_space = policy.observation_space
+        self.observation_keys = list(policy.observation_space.spaces.keys())
+        self.normalize_images = policy.normalize_images
+        # Recent versions of Stable Baselines 3 can use separate features extractors for the actor and the critic
+        self.features_extractor = getattr(policy, "pi_features_extractor", policy.features_extractor)
+        self.mlp_extractor = policy.mlp_extractor
+        self.action_net = policy.action_net
+        self.squash_output = policy.squash_output
+        action_space = policy.action_space
+        self.register_buffer("action_low", torch.as_tensor(action_space.low, dtype=torch.float32))
+        self.register_buffer("action_high", torch.as_tensor(action_space.high, dtype=torch.float32))
+
+    def forward(self, *observations):
+        obs = dict(zip(self.observation_keys, observations))
+        features = self.features_extractor(preprocess_obs(obs, self.observation_space, self.normalize_images))
+        actions = self.action_net(self.mlp_extractor.forward_actor(features))
+        # Same post-processing of the actions as PPO.predict
+        if self.squash_output:
+            actions = torch.tanh(actions)
+            return self.action_low + 0.5 * (actions + 1.0) * (self.action_high - self.action_low)
+        return torch.max(torch.min(actions, self.action_high), self.action_low)
+
+
+def get_example_observations(observation_space, batch_size=1):
+    """
+    :return: List of zero tensors with the shapes and types of the observations, in the order of the observation keys
+    """
+    return [
+        torch.from_numpy(np.zeros((batch_size,) + space.shape, dtype=space.dtype))
+        for space in observation_space.spaces.values()
+    ]
+
+
+def export_policy(ckpt_path, output_path):
+    """
+    Trace the deterministic policy of a PPO checkpoint and save it as a frozen TorchScript module, together with the
+    metadata needed to feed it (observation keys, shapes and types, and action space)
+    :param ckpt_path: Checkpoint of a PPO model saved by Stable Baselines 3
+    :param output_path: Path of the exported module
+    :return: Maximum absolute difference between the actions of the exported module and PPO.predict on random
+        observations
+    """
+    model = PPO.load(ckpt_path, device="cpu")
+    module = DeterministicPolicy(model.policy).eval()
+    with torch.no_grad():
+        traced = torch.jit.trace(module, tuple(get_example_observations(model.observation_space)))
+    traced = torch.jit.freeze(traced)
+    metadata = {
+        "observations": [
+            {"key": key, "shape": list(space.shape), "dtype": np.dtype(space.dtype).str}
+            for key, space in model.observation_space.spaces.items()
+        ],
+        "action_shape": list(model.action_space.shape),
+    }
+    torch.jit.save(traced, output_path, _extra_files={METADATA_FILE: json.dumps(metadata)})
+
+    # Check the exported module against the original policy
+    obs = {key: space.sample() for key, space in model.observation_space.spaces.items()}
+    with torch.no_grad():
+        exported_action = traced(*[torch.as_tensor(obs[key])[None] for key in module.observation_keys])[0].numpy()
+    return float(np.max(np.abs(exported_action - model.predict(obs, deterministic=True)[0])))
+
+
+def main():
+    """
+    Entry point to export the policy of a PPO checkpoint
+    """
+    parser = argparse.ArgumentParser(description="Export the policy of a PPO checkpoint to TorchScript")
+    parser.add_argument("ckpt_path", type=str, help="checkpoint of a PPO model saved by Stable Baselines 3")
+    parser.add_argument("output_path", type=str, help="path of the exported policy")
+    args = parser.parse_args()
+    max_difference = export_policy(args.ckpt_path, args.output_path)
+    print("Policy exported to {}".format(args.output_path))
+    print("Maximum difference with the actions of PPO.predict: {:.2e}".format(max_difference))
+
+
+if __name__ == "__main__":
+    main()
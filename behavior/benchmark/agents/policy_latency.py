@@ -0,0 +1,75 @@
+"""
+Latency of the actions of a PPO checkpoint queried with PPOAgent (Stable Baselines 3) and of the same policy exported
+with policy_export and queried with ExportedPPOAgent, on random observations
+Usage:
+    python -m behavior.benchmark.agents.policy_latency path/to/ppo_checkpoint path/to/exported_policy.pt
+"""
+import argparse
+import time
+
+import numpy as np
+
+from behavior.benchmark.profiling import PERCENTILES
+
+
+def measure_latency(agent, obs_batch, num_calls, num_warmup_calls=10):
+    """
+    Measure the latency of an agent
+    :param agent: Agent to query
+    :param obs_batch: List of observations. With one observation the agent is queried with act, else with act_batch
+    :param num_calls: Number of measured calls
+    :param num_warmup_calls: Number of calls before the measurement
+    :return: Tuple of (dictionary of statistic name to latency in milliseconds, actions of the last call)
+    """
+    durations = []
+    for call in range(num_warmup_calls + num_calls):
+        start_time = time.perf_counter()
+        if len(obs_batch) == 1:
+            actions = [agent.act(obs_batch[0])]
+        else:
+            actions = agent.act_batch(obs_batch)
+        if call >= num_warmup_calls:
+            durations.append((time.perf_counter() - start_time) * 1000.0)
+    stats = {"mean": float(np.mean(durations))}
+    for percentile, value in zip(PERCENTILES, np.percentile(durations, PERCENTILES)):
+        stats["p{}".format(percentile)] = float(value)
+    return stats, np.asarray(actions)
+
+
+def main():
+    """
+    Entry point of the latency benchmark of the PPO agents
+    """
+    parser = argparse.ArgumentParser(description="Compare the latency of PPOAgent and ExportedPPOAgent")
+    parser.add_argument("ckpt_path", type=str, help="checkpoint of a PPO model saved by Stable Baselines 3")
+    parser.add_argument("policy_path", type=str, help="policy of the checkpoint exported with policy_export")
+    parser.add_argument("--num-calls", default=200, type=int, help="number of measured calls of each agent")
+    parser.add_argument("--batch-size", default=1, type=int, help="number of observations per call")
+    parser.add_argument("--num-threads", default=1, type=int, help="intra-op threads of the exported policy")
+    args = parser.parse_args()
+
+    from behavior.benchmark.agents.exported_ppo_agent import ExportedPPOAgent
+    from behavior.benchmark.agents.rl_agent import PPOAgent
+
+    ppo_agent = PPOAgent(args.ckpt_path)
+    obs_batch = [
+        {key: space.sample() for key, space in ppo_agent.agent.observation_space.spaces.items()}
+        for _ in range(args.batch_size)
+    ]
+    # PPOAgent is measured first, with the default threading of torch: ExportedPPOAgent sets the threads of the process
+    results = {}
+    results["PPOAgent"], ppo_actions = measure_latency(ppo_agent, obs_batch, args.num_calls)
+    exported_agent = ExportedPPOAgent(args.policy_path, num_threads=args.num_threads)
+    results["ExportedPPOAgent"], exported_actions = measure_latency(exported_agent, obs_batch, args.num_calls)
+
+    print("Latency per call with {} observations (ms):".format(args.batch_size))
+    for name, stats in results.items():
+        print("{:>18}: {}".format(name, ", ".join("{} {:.3f}".format(stat, value) for stat, value in stats.items())))
+    print(
+        "Speedup of the mean latency: {:.2f}x".format(results["PPOAgent"]["mean"] / results["ExportedPPOAgent"]["mean"])
+    )
+    print("Maximum difference between the actions: {:.2e}".format(np.max(np.abs(ppo_actions - exported_actions))))
+
+
+if __name__ == "__main__":
+    main()
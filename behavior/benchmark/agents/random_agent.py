@@ -40,10 +40,18 @@ class RandomAgent(Agent):
     def reset(self):
         pass
 
+    def get_observation_keys(self):
+        # The random agent does not use the observations. Proprioception does not require rendering
+        return ["proprioception"]
+
     def act(self, obs):
         action = np.random.uniform(low=-1, high=1, size=(self.action_dim,))
         return action
 
+    def act_batch(self, obs_batch):
+        actions = np.random.uniform(low=-1, high=1, size=(len(obs_batch), self.action_dim))
+        return list(actions)
+
 
 # Test to print random actions
 if __name__ == "__main__":
@@ -58,3 +66,5 @@ if __name__ == "__main__":
     agent = RandomAgent()
     action = agent.act(obs)
     print("action", action)
+    actions = agent.act_batch([obs, obs])
+    print("batched actions", actions)
@@ -0,0 +1,261 @@
+import atexit
+import multiprocessing
+import os
+import traceback
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from behavior.benchmark.agents.agent import Agent
+
+# Number of observation slots of the shared-memory ring buffer. With one-step latency the simulator writes the next
+# observation while the agent reads the previous one, so two slots are enough
+RING_SIZE = 2
+
+# Offsets of the observation arrays in a slot are aligned to this number of bytes
+ALIGNMENT = 64
+
+
+def get_observation_layout(obs):
+    """
+    Layout of the array observations in a slot of the ring buffer
+    :param obs: Dictionary of observations
+    :return: Tuple of (list of (key, shape, dtype, offset) of the numpy arrays of the observation, size of a slot)
+    """
+    layout = []
+    offset = 0
+    for key, value in obs.items():
+        if not isinstance(value, np.ndarray):
+            continue
+        layout.append((key, value.shape, value.dtype.str, offset))
+        offset += (value.nbytes + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+    return layout, max(offset, ALIGNMENT)
+
+
+def get_slot_views(buffer, layout, slot_size, slot):
+    """
+    :return: Dictionary of key to numpy array backed by the given slot of the ring buffer
+    """
+    views = {}
+    for key, shape, dtype, offset in layout:
+        views[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=buffer, offset=slot * slot_size + offset)
+    return views
+
+
+def _agent_server(agent_factory, conn):
+    """
+    Main loop of the agent process: creates the agent and answers the requests of the RemoteAgent
+    The arrays of the observations are read from the shared-memory ring buffer allocated by the RemoteAgent, attached by
+    name. They are only valid during the call to act: agents that keep observations between steps need to copy them
+    :param agent_factory: Function without arguments that creates the agent
+    :param conn: End of the pipe connecting the agent process with the RemoteAgent
+    """
+    agent = agent_factory()
+    memory, layout, slot_size = None, None, 0
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        command, data = message
+        try:
+            result = None
+            if command == "act":
+                slot, other_obs = data
+                obs = get_slot_views(memory.buf, layout, slot_size, slot)
+                obs.update(other_obs)
+                result = agent.act(obs)
+                del obs
+            elif command == "reset":
+                agent.reset()
+            elif command == "keys":
+                result = agent.get_observation_keys()
+            elif command == "buffer":
+                # The observations changed shape: attach the new ring buffer
+                if memory is not None:
+                    memory.close()
+                name, layout, slot_size = data
+                memory = shared_memory.SharedMemory(name=name)
+            else:
+                raise ValueError("Unknown command {}".format(command))
+            conn.send((result, None))
+        except Exception:
+            conn.send((None, traceback.format_exc()))
+    if memory is not None:
+        memory.close()
+    conn.close()
+
+
+class RemoteAgent(Agent):
+    """
+    Agent that runs another agent in a separate process, so that the policy (and its threads) does not compete with the
+    simulator and the renderer for the CPU of the benchmark process
+    The numpy arrays of the observations (rgb, depth, seg, ins_seg, highlight, proprioception...) are passed through a
+    shared-memory ring buffer without pickling them; the rest of the observation is sent through a pipe.
+    With one-step latency, act returns the action computed for the previous observation and the agent process computes
+    the action of the current observation while the simulator steps and renders the next frame. The action of the
+    first observation of an episode is used in its first two steps.
+    The agent process is forked from the process that uses the agent the first time it is needed: to query the
+    observations used by the agent (see get_observation_keys) or to act. The ring buffer is allocated at the first
+    observation, once its size is known, and again if the shapes of the observations change. The agent cannot be used
+    from the daemonic workers of EpisodeWorkerPool.
+    """
+
+    def __init__(self, agent_factory, one_step_latency=False, observation_keys=None):
+        """
+        Constructor
+        :param agent_factory: Function without arguments that creates the agent in the agent process
+        :param one_step_latency: Whether the agent accepts acting on the observation of the previous step, overlapping
+            its computation with the simulation
+        :param observation_keys: Observations used by the agent (see Agent.get_observation_keys). If None, they are
+            queried from the agent in the agent process
+        """
+        self.agent_factory = agent_factory
+        self.one_step_latency = one_step_latency
+        self.observation_keys = observation_keys
+        self.observation_keys_known = observation_keys is not None
+        self.context = multiprocessing.get_context("fork")
+        self.owner_pid = None
+        self.process = None
+        self.conn = None
+        self.memory = None
+        self.layout = None
+        self.slot_size = 0
+        self.next_slot = 0
+        self.pending = False
+        self.last_action = None
+
+    def start(self):
+        """
+        Start the agent process, which creates the agent
+        """
+        # The agent process inherits the resource tracker of this process, so that the ring buffers it attaches are not
+        # unlinked again when it exits
+        resource_tracker.ensure_running()
+        parent_conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(
+            target=_agent_server, args=(self.agent_factory, child_conn), name="behavior_agent"
+        )
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self.owner_pid = os.getpid()
+        self.memory, self.layout, self.slot_size, self.next_slot = None, None, 0, 0
+        atexit.register(self.close)
+
+    def allocate_buffer(self, layout, slot_size):
+        """
+        Allocate the ring buffer for observations with the given layout, and attach it in the agent process
+        """
+        memory = shared_memory.SharedMemory(create=True, size=slot_size * RING_SIZE)
+        self.conn.send(("buffer", (memory.name, layout, slot_size)))
+        self._receive()
+        self.free_buffer()
+        self.memory, self.layout, self.slot_size, self.next_slot = memory, layout, slot_size, 0
+
+    def free_buffer(self):
+        if self.memory is not None:
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
+
+    def started(self):
+        # A copy of the agent inherited by a forked process starts its own agent process
+        return self.owner_pid == os.getpid()
+
+    def close(self):
+        if not self.started():
+            return
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, EOFError, OSError):
+            pass
+        self.process.join()
+        self.conn.close()
+        self.free_buffer()
+        self.owner_pid = None
+        self.pending = False
+
+    def _receive(self):
+        try:
+            result, error = self.conn.recv()
+        except EOFError:
+            raise RuntimeError("The agent process died")
+        if error is not None:
+            raise RuntimeError("The agent process failed:\n{}".format(error))
+        return result
+
+    def _send_observation(self, obs):
+        """
+        Copy the arrays of the observation into the next slot of the ring buffer and request an action for it
+        """
+        if not self.started():
+            self.start()
+        layout, slot_size = get_observation_layout(obs)
+        if layout != self.layout:
+            self.allocate_buffer(layout, slot_size)
+        slot = self.next_slot
+        self.next_slot = (self.next_slot + 1) % RING_SIZE
+        for key, view in get_slot_views(self.memory.buf, self.layout, self.slot_size, slot).items():
+            view[...] = obs[key]
+        other_obs = {key: value for key, value in obs.items() if not isinstance(value, np.ndarray)}
+        self.conn.send(("act", (slot, other_obs)))
+
+    def reset(self):
+        self.last_action = None
+        if not self.started():
+            # The agent is created when the agent process starts
+            self.pending = False
+            return
+        if self.pending:
+            self._receive()
+            self.pending = False
+        self.conn.send(("reset", None))
+        self._receive()
+
+    def act(self, obs):
+        if not self.one_step_latency:
+            self._send_observation(obs)
+            return self._receive()
+        if self.pending:
+            self.last_action = self._receive()
+            self.pending = False
+        self._send_observation(obs)
+        self.pending = True
+        if self.last_action is None:
+            # First step of the episode: there is no action of a previous observation yet
+            self.last_action = self._receive()
+            self.pending = False
+        return self.last_action
+
+    def get_observation_keys(self):
+        if not self.observation_keys_known:
+            # Asked once to the agent, which is created in the agent process
+            if not self.started():
+                self.start()
+            self.conn.send(("keys", None))
+            self.observation_keys = self._receive()
+            self.observation_keys_known = True
+        return self.observation_keys
+
+    def act_batch(self, obs_batch):
+        assert not self.one_step_latency, "Batched queries are not supported with one-step latency"
+        return super(RemoteAgent, self).act_batch(obs_batch)
+
+
+# Test to print actions
+if __name__ == "__main__":
+    from behavior.benchmark.agents.random_agent import RandomAgent
+
+    obs = {
+        "rgb": np.ones((128, 128, 3), dtype=np.float32),
+        "depth": np.ones((128, 128, 1), dtype=np.float32),
+        "proprioception": np.ones((20,), dtype=np.float32),
+    }
+    for one_step_latency in [False, True]:
+        agent = RemoteAgent(RandomAgent, one_step_latency=one_step_latency)
+        agent.reset()
+        for _ in range(3):
+            action = agent.act(obs)
+        print("action (one-step latency: {})".format(one_step_latency), action)
+        agent.close()
@@ -20,9 +20,18 @@ class PPOAgent(Agent):
     def reset(self):
         pass
 
+    def get_observation_keys(self):
+        # The observations the policy was trained with
+        return list(self.agent.observation_space.spaces.keys())
+
     def act(self, obs):
         return self.agent.predict(obs, deterministic=True)[0]
 
+    def act_batch(self, obs_batch):
+        # Stack the observations of all environments along a batch dimension to query the policy once
+        batched_obs = {key: np.stack([obs[key] for obs in obs_batch]) for key in obs_batch[0].keys()}
+        return list(self.agent.predict(batched_obs, deterministic=True)[0])
+
 
 # Test to print actions
 if __name__ == "__main__":
@@ -37,3 +46,5 @@ if __name__ == "__main__":
     agent = PPOAgent(ckpt_path="checkpoints/onboard_sensing_ppo_random")
     action = agent.act(obs)
     print("action", action)
+    actions = agent.act_batch([obs, obs])
+    print("batched actions", actions)
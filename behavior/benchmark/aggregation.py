@@ -0,0 +1,163 @@
+"""
+Aggregation of per-episode metrics into the official benchmark metrics
+"""
+import json
+import logging
+import os
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# Metrics averaged over episodes, in the order they are reported
+EPISODE_METRICS = [
+    "Success Score",
+    "Simulated Time",
+    "Kinematic Disarrangement",
+    "Logical Disarrangement",
+    "Distance Navigated",
+    "Displacement of Hands",
+]
+
+# Number of best activities averaged in "Success Score Top 5"
+TOP_ACTIVITIES = 5
+
+# Two-sided 95% quantile of the normal distribution
+NORMAL_QUANTILE_95 = 1.960
+
+# Episodes that failed (e.g. hung or crashed the simulator) and are not part of the aggregated metrics
+FAILED_EPISODES_FILE = "failed_episodes.json"
+
+
+def get_episode_values(metric):
+    """
+    Values of the aggregated benchmark metrics for one episode
+    :param metric: Metrics summary of the episode
+    :return: Ordered dictionary of metric name (see EPISODE_METRICS) to value
+    """
+    return OrderedDict(
+        [
+            ("Success Score", metric["q_score"]["final"]),
+            ("Simulated Time", metric["time"]["simulator_time"]),
+            ("Kinematic Disarrangement", metric["kinematic_disarrangement"]["relative"]),
+            ("Logical Disarrangement", metric["logical_disarrangement"]["relative"]),
+            ("Distance Navigated", np.sum(metric["agent_distance"]["timestep"]["body"])),
+            (
+                "Displacement of Hands",
+                np.sum(metric["grasp_distance"]["timestep"]["left_hand"])
+                + np.sum(metric["grasp_distance"]["timestep"]["right_hand"]),
+            ),
+        ]
+    )
+
+
+def aggregate_metrics(per_episode_metrics):
+    """
+    Aggregates the metrics of several episodes into the official benchmark metrics
+    :param per_episode_metrics: Dictionary of episode index to the metrics summary of the episode
+    :return: Dictionary of aggregated metrics
+    """
+    aggregated_metrics = {}
+    episode_values = defaultdict(list)
+
+    task_to_mean_success_score = defaultdict(list)
+    task_scores = []
+
+    for episode, metric in per_episode_metrics.items():
+        task_to_mean_success_score[metric["task"]].append(metric["q_score"]["final"])
+
+    for task, scores in task_to_mean_success_score.items():
+        task_scores.append(np.mean(scores))
+
+    task_scores = sorted(task_scores, reverse=True)
+
+    for episode, metric in per_episode_metrics.items():
+        for name, value in get_episode_values(metric).items():
+            episode_values[name].append(value)
+
+    aggregated_metrics["Success Score"] = np.mean(episode_values["Success Score"])
+    aggregated_metrics["Success Score Top 5"] = np.mean(np.array(task_scores)[:TOP_ACTIVITIES])
+    for name in EPISODE_METRICS[1:]:
+        aggregated_metrics[name] = np.mean(episode_values[name])
+    return aggregated_metrics
+
+
+def get_confidence_interval(values):
+    """
+    95% Wilson score interval of the mean of some values in [0, 1], such as success scores
+    The variance of the values is bounded by the one of a Bernoulli variable with the same mean, so the interval does
+    not collapse when all the values are equal (e.g. an activity instance that is always solved or always failed)
+    :param values: List of values in [0, 1]
+    :return: Tuple of (low, high) bounds of the interval. Without values, the interval is [0, 1]
+    """
+    if len(values) == 0:
+        return 0.0, 1.0
+    num_values = len(values)
+    mean = min(max(float(np.mean(values)), 0.0), 1.0)
+    z2 = NORMAL_QUANTILE_95**2
+    center = (mean + z2 / (2 * num_values)) / (1 + z2 / num_values)
+    half_width = (
+        NORMAL_QUANTILE_95 / (1 + z2 / num_values) * np.sqrt(mean * (1 - mean) / num_values + z2 / (4 * num_values**2))
+    )
+    return float(max(center - half_width, 0.0)), float(min(center + half_width, 1.0))
+
+
+def get_success_confidence_intervals(per_episode_metrics):
+    """
+    95% confidence intervals of the success score over all episodes and per activity (see get_confidence_interval)
+    :param per_episode_metrics: Dictionary of episode index to the metrics summary of the episode
+    :return: Dictionary of name to interval [low, high] (intervals per activity in a nested dictionary)
+    """
+    task_scores = defaultdict(list)
+    for metric in per_episode_metrics.values():
+        task_scores[metric["task"]].append(metric["q_score"]["final"])
+    scores = [score for task in task_scores for score in task_scores[task]]
+    confidence_intervals = OrderedDict()
+    confidence_intervals["Success Score 95% CI"] = list(get_confidence_interval(scores))
+    confidence_intervals["Success Score 95% CI per Activity"] = OrderedDict(
+        (task, list(get_confidence_interval(task_scores[task]))) for task in sorted(task_scores.keys())
+    )
+    return confidence_intervals
+
+
+def save_results(output_dir, per_episode_metrics, confidence_intervals=False):
+    """
+    Save the per-episode metrics and the aggregated metrics in the output directory
+    The aggregated metrics are computed from the serialized per-episode metrics, so the files are byte-identical
+    whether the episodes were evaluated in a single run or merged from several shards. Without episodes (e.g. all of
+    them failed), both files are saved empty, replacing the results of a previous run in the directory
+    :param output_dir: Directory to save the results in
+    :param per_episode_metrics: Dictionary of episode index to the metrics summary of the episode, in episode order
+    :param confidence_intervals: Whether to add the confidence intervals of the success score to the aggregated metrics
+    :return: Paths to the per-episode and aggregated metrics files
+    """
+    log_file = os.path.join(output_dir, "per_episode_metrics.json")
+    summary_log_file = os.path.join(output_dir, "aggregated_metrics.json")
+    serialized = json.dumps(per_episode_metrics)
+    with open(log_file, "w+") as f:
+        f.write(serialized)
+    if len(per_episode_metrics) == 0:
+        log.warning("No successful episodes, the aggregated metrics saved in {} are empty".format(output_dir))
+        aggregated_metrics = {}
+    else:
+        aggregated_metrics = aggregate_metrics(json.loads(serialized))
+    if confidence_intervals and len(per_episode_metrics) > 0:
+        aggregated_metrics.update(get_success_confidence_intervals(json.loads(serialized)))
+    with open(summary_log_file, "w+") as f:
+        json.dump(aggregated_metrics, f)
+    return log_file, summary_log_file
+
+
+def save_failed_episodes(output_dir, failed_episodes):
+    """
+    Save the failed episodes in the output directory
+    :param output_dir: Directory to save the failed episodes in
+    :param failed_episodes: Dictionary of episode index to a dictionary with the task, scene_id, instance_id,
+        episode_id and failure reason of the episode, in episode order
+    :return: Path to the failed episodes file
+    """
+    failed_episodes_file = os.path.join(output_dir, FAILED_EPISODES_FILE)
+    with open(failed_episodes_file, "w+") as f:
+        json.dump(failed_episodes, f)
+    return failed_episodes_file
@@ -1,34 +1,53 @@
 import argparse
+import copy
+import functools
 import json
 import logging
 import os
 import shutil
-from collections import defaultdict
-
-import bddl
-import igibson
-import numpy as np
-from igibson.envs.igibson_env import iGibsonEnv
-from igibson.metrics.agent import RobotMetric
-from igibson.metrics.disarrangement import KinematicDisarrangement, LogicalDisarrangement
-from igibson.metrics.task import TaskMetric
-from igibson.utils.utils import parse_config
-
-from behavior.benchmark.agents.random_agent import RandomAgent
-from behavior.benchmark.agents.rl_agent import PPOAgent
-from behavior.benchmark.agents.users_agent import CustomAgent
+import time
+
+from behavior.benchmark.agents.remote_agent import RemoteAgent
+from behavior.benchmark.aggregation import get_confidence_interval, save_failed_episodes, save_results
+from behavior.benchmark.env_cache import EnvironmentCache
+from behavior.benchmark.episode_log import EpisodeLog, get_episode_key
+from behavior.benchmark.evaluation_plan import get_plan
+from behavior.benchmark.lockstep import LockstepEnvironments
+from behavior.benchmark.merge_results import SHARD_INFO_FILE
+from behavior.benchmark.metric_scheduling import (
+    create_metrics,
+    create_reference_metrics,
+    verify_metric_results,
+)
+from behavior.benchmark.planner import EpisodeCostModel, print_plan, schedule_longest_first
+from behavior.benchmark.profiling import StepProfiler, measure_steps_per_second
+from behavior.benchmark.resource_usage import sample_resources
+from behavior.benchmark.result_store import ResultStore
+from behavior.benchmark.run_options import RunOptions, add_run_arguments
+from behavior.benchmark.trajectory import (
+    TRAJECTORY_DIR,
+    AgentRandomState,
+    TrajectoryRecorder,
+    get_episode_seed,
+    seed_episode,
+)
+from behavior.benchmark.worker_pool import EpisodeWorkerPool
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.WARNING)
 
+# iGibson, the metrics and the agents (and their learning frameworks) are imported where they are first used, so that
+# the command line, the planning and the dry runs start without loading the simulator
+
 
-def get_metrics_callbacks():
-    metrics = [
-        KinematicDisarrangement(),
-        LogicalDisarrangement(),
-        RobotMetric(),
-        TaskMetric(),
-    ]
+def get_metrics_callbacks(metric_schedules=None):
+    """
+    :param metric_schedules: Dictionary of metric name to schedule ("every_step", "on_change" or "stride:N") overriding
+        the default schedules of metric_scheduling
+    :return: Tuple of lists of start, step, end and data callbacks of the metrics. The step callbacks take the keyword
+        argument final_step, which must be True in the last step of the episode
+    """
+    metrics = create_metrics(metric_schedules)
 
     return (
         [metric.start_callback for metric in metrics],
@@ -38,23 +57,63 @@ def get_metrics_callbacks():
     )
 
 
+def get_callback_name(callback):
+    """
+    :return: Name of a metric callback for the timing reports, e.g. "metrics.TaskMetric"
+    """
+    if hasattr(callback, "__self__"):
+        return "metrics.{}".format(getattr(callback.__self__, "name", type(callback.__self__).__name__))
+    return "metrics.{}".format(callback.__name__)
+
+
+def create_headless_env(env_config):
+    """
+    :return: iGibson environment of the benchmark for a config, without a window
+    """
+    from igibson.envs.igibson_env import iGibsonEnv
+
+    return iGibsonEnv(
+        config_file=env_config,
+        mode="headless",
+        action_timestep=1.0 / 30.0,
+        physics_timestep=1.0 / 120.0,
+    )
+
+
 class BehaviorBenchmark(object):
-    def __init__(self, agent, env_config_file="", output_dir="", split="", episodes_per_instance=1):
+    def __init__(self, agent, env_config_file="", output_dir="", split="", episodes_per_instance=1, options=None):
         """
         Constructor
         :param agent: Agent to evaluate
-        :param env_config_file: Config file to set up the environment. If empty, search a system variable (for Docker)
+        :param env_config_file: Config file to set up the environment. If empty, search a system variable (for Docker).
+            If None, the benchmark has no config file and can only evaluate episodes given their environment config
         :param output_dir: Directory to output results. If empty, search a system variable (for Docker)
         :param split: Split of activities to benchmark the agent on. If empty, search a system variable (for Docker)
-        :param episodes_per_instance: Number of episodes to evaluate the agent in the same conditions
+        :param episodes_per_instance: Number of episodes to evaluate the agent in the same conditions (minimum number
+            with options.target_ci_width)
+        :param options: RunOptions of the evaluation (workers, environment cache, shards, seeds...). If None, the
+            defaults of RunOptions
         """
         self.agent = agent
         self.episodes_per_instance = episodes_per_instance
+        self.options = options if options is not None else RunOptions()
+        # Episodes evaluated by this process and its resident memory after the first one, to recycle workers
+        self.process_usage = None
+        self.current_episode = None
+        self.trace_episode_key = None
+        self.plan = None
+        self.env_config = None
+        self.env_cache = None
+        if self.options.env_cache_size > 0:
+            self.env_cache = EnvironmentCache(
+                self.create_env, max_envs=self.options.env_cache_size, max_memory_mb=self.options.env_cache_memory_mb
+            )
         # Takes variables set as environment variables or passed as params in initialization
         if env_config_file == "":
             print("Environment's config file is not an argument. Obtaining it from the environmental variables.")
             env_config_file = os.environ["CONFIG_FILE"]
-        print("Using environment's config file: " + env_config_file)
+        if env_config_file is not None:
+            print("Using environment's config file: " + env_config_file)
         self.env_config_file = env_config_file
 
         if output_dir == "":
@@ -62,6 +121,20 @@ class BehaviorBenchmark(object):
             output_dir = os.environ["OUTPUT_DIR"]
         print("Using output dir: " + output_dir)
         self.output_dir = output_dir
+        # Every finished episode is appended to this log so that an interrupted run can be resumed
+        self.episode_log = EpisodeLog(os.path.join(self.output_dir, "episode_log.jsonl"))
+        self.trajectory_recorder = None
+        if self.options.record_trajectories:
+            self.trajectory_recorder = TrajectoryRecorder(os.path.join(self.output_dir, TRAJECTORY_DIR))
+
+        self.result_store_path = self.options.result_store_path
+        if self.result_store_path == "":
+            self.result_store_path = os.path.join(self.output_dir, "results.sqlite")
+        self.result_store = None
+        self.run_id = None
+        self.run_metrics = {}
+        self.run_failures = {}
+        self.num_planned_episodes = 0
 
         if split == "":
             print("Split is not an argument. Obtaining it from the environmental variables.")
@@ -77,25 +150,22 @@ class BehaviorBenchmark(object):
             - Three activity instances with "unseen" object poses, "seen" objects, furniture and scene/home
             - Three activity instances with "unseen" object poses, "seen" objects, "unseen" furniture, "seen" scene
         The evaluation is performed on the activities indicated in the split: all, a subset, a single activity
+        The episodes of all the activities are planned up front and evaluated together
         :return:
         """
-        # Get list of all 100 activities
-        activities = sorted(
-            [
-                item
-                for item in os.listdir(os.path.join(os.path.dirname(bddl.__file__), "activity_definitions"))
-                if item != "domain_igibson.bddl"
-            ]
-        )
-        assert len(activities) == 100
+        if self.copy_self_reported_results():
+            return
+
+        # Activities, instances and maximum number of steps of the benchmark
+        plan = self.get_plan()
+        activities = sorted(plan["activities"].keys())
 
         if self.split in ["dev", "test"]:
             # Evaluate all activities
             print("Evaluating agent on all 100 activities")
         elif self.split == "minival":
             # Only evaluate a single activity specified in the config file
-            env_config = parse_config(self.env_config_file)
-            activities = [env_config["task"]]
+            activities = [self.get_env_config()["task"]]
             print("Evaluating agent on the activity specified in the config file: {}".format(activities[0]))
         elif self.split in activities:
             # Only evaluate a single activity specified by name
@@ -106,62 +176,65 @@ class BehaviorBenchmark(object):
             activities = self.split
             print("Evaluating agent on activities {}".format(activities))
 
-        # This provides a dictionary of scenes where each activity can be successfully performed
-        scene_json = os.path.join(
-            os.path.dirname(bddl.__file__),
-            "activity_to_preselected_scenes.json",
-        )
-        with open(scene_json) as f:
-            activity_to_scenes = json.load(f)
+        if not self.options.dry_run:
+            self.start_run()
+        self.num_planned_episodes = 0
 
-        # Loop all the activities to evaluate
+        # Plan all the activities to evaluate
+        episodes = []
         for activity in activities:
-            assert activity in activity_to_scenes.keys()
-            scenes = sorted(set(activity_to_scenes[activity]))  # Get the scenes where the activity can be performed
-            num_scenes = len(scenes)
-            assert num_scenes <= 3
-
-            # Official benchmark: Evaluate 9 episodes per activity
-            # instance id 0-9: seen poses
-            # instance id 10-19: unseen poses
-            # instance id 20-29: unseen scenes (same houses but different furniture arrangement)
-            # If you don't have enough activity instances in ig_dataset, the behavior data bundle is outdated.
-            # You need to follow the participant guide and download again.
-
-            # Depending on the number of scenes available for this activity
-            if num_scenes == 3:
-                # Regular case. We use three instances per scene (one "seen poses", one "unseen poses" and one
-                # "unseen scene" (different furniture))
-                scene_instance_ids = {
-                    scenes[0]: [0, 10, 20],
-                    scenes[1]: [0, 10, 20],
-                    scenes[2]: [0, 10, 20],
-                }
-            elif num_scenes == 2:
-                # We use four instances of one scene (two "seen poses", one "unseen poses" and one
-                # "unseen scene" (different furniture)) and five from another scene (two "seen poses", two
-                # "unseen poses" and one "unseen scene" (different furniture))
-                scene_instance_ids = {
-                    scenes[0]: [0, 1, 10, 20],
-                    scenes[1]: [0, 1, 10, 11, 20],
-                }
-            else:
-                # We use nine instances of one scene (three "seen poses", three "unseen poses" and three
-                # "unseen scene" (different furniture))
-                scene_instance_ids = {scenes[0]: [0, 1, 2, 10, 11, 12, 20, 21, 22]}
-
-            self.evaluate_agent_on_one_activity(activity, scene_instance_ids)
+            scene_instance_ids = plan["activities"][activity]["scene_instance_ids"]
+            episodes += self.plan_activity(activity, scene_instance_ids)
 
-    def evaluate_agent_on_one_activity(self, task, scene_instance_ids):
+        if self.options.dry_run:
+            self.print_plan(episodes)
+            return
+
+        if self.options.calibration_steps > 0 and len(episodes) > 0:
+            self.calibrate_outputs(episodes[0][1][4])
+
+        self.evaluate_plan(episodes)
+
+        if self.options.num_shards > 1:
+            with open(os.path.join(self.output_dir, SHARD_INFO_FILE), "w+") as f:
+                json.dump(
+                    {
+                        "shard_index": self.options.shard_index,
+                        "num_shards": self.options.num_shards,
+                        "num_planned_episodes": self.num_planned_episodes,
+                    },
+                    f,
+                )
+            print("Evaluated shard {} out of {}".format(self.options.shard_index, self.options.num_shards))
+
+        print("Results of run {} stored in {}".format(self.run_id, self.result_store_path))
+        print(json.dumps(self.result_store.summarize(self.run_id), indent=4))
+
+    def start_run(self):
         """
-        Evaluates the given agent in the activities and instances indicated by the config file and split
-        The results are stored in the output directory
-        :param task: Tasks to evaluate
-        :param scene_instance_ids: Dictionary of scenes and instances per scene to perform evaluation
-        :return:
+        Open the result store and register a new run, or continue the last one when resuming
+        The results of all the activities evaluated in the run are accumulated and saved together in the output directory
+        """
+        self.open_result_store()
+        self.run_id = self.result_store.get_last_run() if self.options.resume else None
+        if self.run_id is None:
+            self.run_id = self.result_store.start_run(self.split, self.env_config_file)
+        if not self.options.resume:
+            self.episode_log.clear()
+        self.run_metrics = {}
+        self.run_failures = {}
+        self.num_planned_episodes = 0
+
+    def open_result_store(self):
+        if self.result_store is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.result_store_path)), exist_ok=True)
+            self.result_store = ResultStore(self.result_store_path)
+
+    def copy_self_reported_results(self):
+        """
+        Copy the results reported by the participant, if any, to the output directory
+        :return: Whether the aggregated results were reported and the evaluation can be skipped
         """
-        env_config = parse_config(self.env_config_file)
-
         log_file = os.path.join(self.output_dir, "per_episode_metrics.json")
         summary_log_file = os.path.join(self.output_dir, "aggregated_metrics.json")
         self_reported_log_file = os.path.join(
@@ -173,132 +246,570 @@ class BehaviorBenchmark(object):
         if os.path.exists(self_reported_log_file):
             shutil.copyfile(self_reported_log_file, log_file)
             print("Per episode eval results copied from self-reported results %s" % log_file)
-            with open(self_reported_log_file) as f:
-                self_reported_log = json.load(f)
         if os.path.exists(self_reported_summary_log_file):
             shutil.copyfile(self_reported_summary_log_file, summary_log_file)
             print("Aggregated eval results copied from self-reported results %s" % summary_log_file)
+            return True
+        return False
+
+    def evaluate_agent_on_one_activity(self, task, scene_instance_ids):
+        """
+        Evaluates the given agent in the activities and instances indicated by the config file and split
+        The results are stored in the output directory
+        :param task: Tasks to evaluate
+        :param scene_instance_ids: Dictionary of scenes and instances per scene to perform evaluation
+        :return:
+        """
+        if self.copy_self_reported_results():
             return
 
-        # Evaluation ##################################################################################################
-        episode = 0
-        per_episode_metrics = {}
+        if self.run_id is None:
+            self.start_run()
 
-        # This provides metadata about the activities, including the time humans require to perform them
-        with open(os.path.join(igibson.ig_dataset_path, "metadata", "behavior_activity_statistics.json")) as f:
-            activity_metadata = json.load(f)
+        self.evaluate_plan(self.plan_activity(task, scene_instance_ids))
 
-        human_demo_mean_step = activity_metadata[task]["mean"]  # Mean time invested by humans in the task
-        print("Maximum number of steps is twice the mean of human time: {}".format(human_demo_mean_step * 2))
-        env_config["max_step"] = human_demo_mean_step * 2  # adjust env_config['max_step'] based on the human
-        # demonstration, we give agent 2x steps of average human demonstration across all possible scenes
+    def get_plan(self):
+        """
+        :return: Evaluation plan of the benchmark (see evaluation_plan), loaded once
+        """
+        if self.plan is None:
+            self.plan = get_plan(self.options.plan_file)
+        return self.plan
 
-        # The robot name is "popped" from the config when loading into iG. We need to load it again in the loop
-        # This is because the same parsed config is not expected to be reused consecutively
-        robot_name = env_config["robot"]["name"]
+    def get_env_config(self):
+        """
+        :return: Environment config parsed once from the config file. Copy it before modifying it
+        """
+        if self.env_config is None:
+            from igibson.utils.utils import parse_config
 
+            assert self.env_config_file is not None, "The benchmark has no environment config file"
+
+            self.env_config = parse_config(self.env_config_file)
+        return self.env_config
+
+    def plan_activity(self, task, scene_instance_ids):
+        """
+        Plan the episodes of an activity that belong to the shard of this benchmark
+        Episodes are numbered consecutively across all the activities of the run (the evaluation plan)
+        :param task: Task to evaluate
+        :param scene_instance_ids: Dictionary of scenes and instances per scene to perform evaluation
+        :return: List of pairs (episode index, arguments of evaluate_episode)
+        """
+        env_config = copy.deepcopy(self.get_env_config())
+        env_config["output"] = self.get_env_outputs(env_config["output"])
+        episode = self.num_planned_episodes
+        episodes = []
+
+        # The maximum number of steps is twice the mean time invested by humans in the task (see evaluation_plan)
+        env_config["max_step"] = self.get_plan()["activities"][task]["max_step"]
+        print("Maximum number of steps is twice the mean of human time: {}".format(env_config["max_step"]))
+
+        # The robot name is "popped" from the config when loading into iG. Each episode gets its own copy of the config
+        # This is because the same parsed config is not expected to be reused consecutively
         for scene_id, instance_ids in scene_instance_ids.items():
             env_config["scene_id"] = scene_id
             env_config["task"] = task
             env_config["task_id"] = 0
             for instance_id in instance_ids:
                 for episode_id in range(self.episodes_per_instance):
-                    env_config["robot"]["name"] = robot_name
-                    per_episode_metrics[episode] = self.evaluate_episode(
-                        task, scene_id, instance_id, episode_id, env_config
-                    )
+                    # Deterministic partition of the evaluation plan across shards
+                    if episode % self.options.num_shards == self.options.shard_index:
+                        episodes.append((episode, (task, scene_id, instance_id, episode_id, copy.deepcopy(env_config))))
                     episode += 1
+        self.num_planned_episodes = episode
+        return episodes
 
-        with open(log_file, "w+") as f:
-            json.dump(per_episode_metrics, f)
+    def evaluate_plan(self, episodes):
+        """
+        Evaluates the planned episodes (skipping the ones already in the episode log when resuming, except failed ones)
+        and saves the per-episode and aggregated metrics and the failed episodes of the run in the output directory
+        With a target confidence interval width, episodes are then added in rounds to the instances whose success score
+        is still too uncertain
+        :param episodes: List of pairs (episode index, arguments of evaluate_episode)
+        """
+        log_file = os.path.join(self.output_dir, "per_episode_metrics.json")
+        summary_log_file = os.path.join(self.output_dir, "aggregated_metrics.json")
+
+        for episode, episode_args in episodes:
+            if episode == self.options.trace_episode:
+                self.trace_episode_key = get_episode_key(*episode_args[:4])
+
+        per_episode_metrics = self.evaluate_or_resume(episodes)
+        if self.options.target_ci_width is not None:
+            while True:
+                additional_episodes = self.plan_additional_episodes(episodes, per_episode_metrics)
+                if len(additional_episodes) == 0:
+                    break
+                print("Adding {} episodes to reach the target confidence intervals".format(len(additional_episodes)))
+                episodes = episodes + additional_episodes
+                per_episode_metrics.update(self.evaluate_or_resume(additional_episodes))
+
+        for episode, _ in episodes:
+            # Failed episodes were recorded in run_failures by record_failure
+            if episode in per_episode_metrics:
+                self.run_metrics[episode] = per_episode_metrics[episode]
+
+        failed_episodes_file = save_failed_episodes(
+            self.output_dir, {episode: self.run_failures[episode] for episode in sorted(self.run_failures.keys())}
+        )
+        if len(self.run_failures) > 0:
+            print("{} failed episodes saved to {}".format(len(self.run_failures), failed_episodes_file))
+
+        # Saved even without successful episodes, so that the shards can be merged and no aggregated metrics of a
+        # previous run are left next to the new results
+        save_results(self.output_dir, self.run_metrics, confidence_intervals=self.options.target_ci_width is not None)
         print("Per episode eval results saved to %s" % log_file)
+        print("Aggregated eval results saved to %s" % summary_log_file)
 
-        aggregated_metrics = {}
-        success_score = []
-        simulator_time = []
-        kinematic_disarrangement = []
-        logical_disarrangement = []
-        distance_navigated = []
-        displacement_of_hands = []
-
-        task_to_mean_success_score = defaultdict(list)
-        task_scores = []
-
-        for episode, metric in per_episode_metrics.items():
-            task_to_mean_success_score[metric["task"]].append(metric["q_score"]["final"])
-
-        for task, scores in task_to_mean_success_score.items():
-            task_scores.append(np.mean(scores))
-
-        task_scores = sorted(task_scores, reverse=True)
-
-        for episode, metric in per_episode_metrics.items():
-            success_score.append(metric["q_score"]["final"])
-            simulator_time.append(metric["time"]["simulator_time"])
-            kinematic_disarrangement.append(metric["kinematic_disarrangement"]["relative"])
-            logical_disarrangement.append(metric["logical_disarrangement"]["relative"])
-            distance_navigated.append(np.sum(metric["agent_distance"]["timestep"]["body"]))
-            displacement_of_hands.append(
-                np.sum(metric["grasp_distance"]["timestep"]["left_hand"])
-                + np.sum(metric["grasp_distance"]["timestep"]["right_hand"])
+    def evaluate_or_resume(self, episodes):
+        """
+        Evaluates episodes, taking the results of the ones already in the episode log when resuming
+        :param episodes: List of pairs (episode index, arguments of evaluate_episode)
+        :return: Dictionary of episode index to metrics summary of the successful episodes
+        """
+        per_episode_metrics = {}
+        if self.options.resume:
+            finished_episodes = self.episode_log.load()
+            for episode, episode_args in episodes:
+                episode_key = get_episode_key(*episode_args[:4])
+                if episode_key in finished_episodes and "failure" not in finished_episodes[episode_key]:
+                    per_episode_metrics[episode] = finished_episodes[episode_key]["metrics"]
+                    # The run may have been interrupted before the episode reached the result store
+                    self.result_store.add_episode(self.run_id, *episode_key, per_episode_metrics[episode])
+            print("Resuming: {} out of {} episodes already evaluated".format(len(per_episode_metrics), len(episodes)))
+        per_episode_metrics.update(
+            self.evaluate_episodes(
+                [(episode, args) for episode, args in episodes if episode not in per_episode_metrics]
             )
+        )
+        return per_episode_metrics
 
-        aggregated_metrics["Success Score"] = np.mean(success_score)
-        aggregated_metrics["Success Score Top 5"] = np.mean(np.array(task_scores)[:5])
-        aggregated_metrics["Simulated Time"] = np.mean(simulator_time)
-        aggregated_metrics["Kinematic Disarrangement"] = np.mean(kinematic_disarrangement)
-        aggregated_metrics["Logical Disarrangement"] = np.mean(logical_disarrangement)
-        aggregated_metrics["Distance Navigated"] = np.mean(distance_navigated)
-        aggregated_metrics["Displacement of Hands"] = np.mean(displacement_of_hands)
-        with open(summary_log_file, "w+") as f:
-            json.dump(aggregated_metrics, f)
-        print("Aggregated eval results saved to %s" % summary_log_file)
+    def plan_additional_episodes(self, episodes, per_episode_metrics):
+        """
+        Plan one more episode for each activity instance whose 95% confidence interval of the success score is wider
+        than the target and that has less than the maximum number of episodes
+        :param episodes: List of pairs (episode index, arguments of evaluate_episode) evaluated so far
+        :param per_episode_metrics: Dictionary of episode index to metrics summary of the successful episodes
+        :return: List of pairs (episode index, arguments of evaluate_episode) of the additional episodes
+        """
+        instance_episodes = {}
+        for episode, episode_args in episodes:
+            instance_episodes.setdefault(tuple(episode_args[:3]), []).append(episode_args)
+        additional_episodes = []
+        for instance, instance_args in instance_episodes.items():
+            if len(instance_args) >= self.options.max_episodes_per_instance:
+                continue
+            scores = [
+                per_episode_metrics[episode]["q_score"]["final"]
+                for episode, episode_args in episodes
+                if tuple(episode_args[:3]) == instance and episode in per_episode_metrics
+            ]
+            low, high = get_confidence_interval(scores)
+            if high - low <= self.options.target_ci_width:
+                continue
+            episode_id = max(episode_args[3] for episode_args in instance_args) + 1
+            env_config = copy.deepcopy(instance_args[-1][4])
+            additional_episodes.append((self.num_planned_episodes, instance + (episode_id, env_config)))
+            self.num_planned_episodes += 1
+        return additional_episodes
+
+    def get_env_outputs(self, outputs):
+        """
+        Observations the environment computes in every step: the ones of the config the agent uses (plus the ones it
+        uses that are not in the config), so that the rendering passes of the other modalities are skipped
+        :param outputs: Output list of the environment config
+        :return: Output list for the environment
+        """
+        if not self.options.restrict_outputs or self.agent is None:
+            return outputs
+        agent_keys = self.agent.get_observation_keys()
+        if agent_keys is None:
+            return outputs
+        env_outputs = [output for output in outputs if output in agent_keys]
+        env_outputs += [key for key in agent_keys if key not in outputs]
+        if env_outputs != outputs:
+            print("Computing only the observations used by the agent: {} (config: {})".format(env_outputs, outputs))
+        return env_outputs
+
+    def calibrate_outputs(self, env_config):
+        """
+        Measure and log the throughput of the environment with all the observations of the config and with the ones
+        used by the agent
+        :param env_config: Environment config of an episode
+        """
+        config_outputs = self.get_env_config()["output"]
+        if config_outputs == env_config["output"]:
+            print("The agent uses all the observations of the config, skipping the calibration")
+            return
+        steps_per_second = []
+        for outputs in [config_outputs, env_config["output"]]:
+            calibration_config = copy.deepcopy(env_config)
+            calibration_config["output"] = outputs
+            steps_per_second.append(
+                measure_steps_per_second(self.create_env, calibration_config, self.options.calibration_steps)
+            )
+            print("Outputs {}: {:.2f} steps/s".format(outputs, steps_per_second[-1]))
+        print(
+            "Computing only the observations used by the agent: {:.2f}x steps/s".format(
+                steps_per_second[1] / steps_per_second[0]
+            )
+        )
+
+    def get_cost_model(self):
+        """
+        Cost model of the episodes using the times measured in previous runs stored in the result store
+        """
+        if self.result_store is None and not os.path.exists(self.result_store_path):
+            return EpisodeCostModel()
+        self.open_result_store()
+        return EpisodeCostModel.from_result_store(self.result_store)
+
+    def print_plan(self, episodes):
+        """
+        Print the planned episodes in the order they would be scheduled, and the predicted makespan
+        :param episodes: List of pairs (episode index, arguments of evaluate_episode)
+        """
+        cost_model = self.get_cost_model()
+        costs = [cost_model.estimate(args[1], args[4]["max_step"]) for _, args in episodes]
+        print_plan(episodes, costs, self.options.num_workers)
+
+    def evaluate_episodes(self, episodes):
+        """
+        Evaluates a list of episodes, sequentially or in parallel in a pool of worker processes
+        Each finished episode is saved in the episode log and the result store. With an episode timeout, the episodes
+        are always evaluated in worker processes. Episodes that fail in worker processes (exception, crash or timeout)
+        are recorded with record_failure
+        :param episodes: List of pairs (episode index, arguments of evaluate_episode)
+        :return: Dictionary of episode index to metrics summary of the successful episodes, sorted by episode index
+        """
+        results = {}
+        if len(episodes) == 0:
+            return results
+
+        episode_args = dict(episodes)
+        if self.options.batch_envs > 0:
+            num_envs = min(self.options.batch_envs, len(episodes))
+            print("Evaluating {} episodes with {} environments in lockstep".format(len(episodes), num_envs))
+            with LockstepEnvironments(self, num_envs) as environments:
+                for episode, metrics in environments.run(episodes):
+                    results[episode] = metrics
+                    self.record_episode(episode_args[episode], metrics)
+            return {episode: results[episode] for episode, _ in episodes}
+
+        if self.options.num_workers <= 0 and not self.options.supervise_episodes():
+            for episode, args in episodes:
+                results[episode] = self.evaluate_episode(*args)
+                self.record_episode(args, results[episode])
+            self.close_environments()
+            return results
+
+        num_workers = min(max(self.options.num_workers, 1), len(episodes))
+        print("Evaluating {} episodes with {} workers".format(len(episodes), num_workers))
+        # Longest episodes first, so that no worker starts a long episode when the others are about to finish
+        cost_model = self.get_cost_model()
+        order, _, makespan = schedule_longest_first(
+            [cost_model.estimate(args[1], args[4]["max_step"]) for _, args in episodes], num_workers
+        )
+        print("Predicted makespan: {:.1f}s".format(makespan))
+        num_finished = 0
+        with EpisodeWorkerPool(self, num_workers, episode_timeout=self.options.episode_timeout) as pool:
+            for episode, metrics, failure in pool.run([episodes[idx] for idx in order]):
+                num_finished += 1
+                if failure is not None:
+                    print("Episode {} failed: {} ({} out of {})".format(episode, failure, num_finished, len(episodes)))
+                    self.record_failure(episode, episode_args[episode], failure)
+                    continue
+                print("Finished episode {} ({} out of {})".format(episode, num_finished, len(episodes)))
+                results[episode] = metrics
+                self.record_episode(episode_args[episode], metrics)
+        # Keep the same order as the sequential evaluation so that the saved results are identical
+        return {episode: results[episode] for episode, _ in episodes if episode in results}
+
+    def should_recycle_worker(self):
+        """
+        Called by a worker process after each episode
+        :return: Whether the worker process should be replaced by a new one, because it evaluated the maximum number of
+            episodes or its memory grew more than the threshold
+        """
+        if self.process_usage is None or self.process_usage["pid"] != os.getpid():
+            return False
+        if 0 < self.options.recycle_worker_episodes <= self.process_usage["num_episodes"]:
+            print("Recycling worker after {} episodes".format(self.process_usage["num_episodes"]))
+            return True
+        if (
+            self.options.recycle_worker_memory_mb is not None
+            and self.process_usage["rss_mb_growth"] > self.options.recycle_worker_memory_mb
+        ):
+            print("Recycling worker after its memory grew {:.1f}MB".format(self.process_usage["rss_mb_growth"]))
+            return True
+        return False
+
+    def update_process_usage(self, resources):
+        """
+        Count an episode evaluated by this process and the growth of its resident memory since its first episode
+        :param resources: Resources used by the process at the end of the episode (see sample_resources)
+        :return: Dictionary with the number of episodes evaluated by the process and the growth of its memory in MB
+        """
+        if self.process_usage is None or self.process_usage["pid"] != os.getpid():
+            # First episode of this process (a forked worker inherits the usage of its parent)
+            self.process_usage = {"pid": os.getpid(), "num_episodes": 0, "rss_mb_baseline": resources["rss_mb"]}
+        self.process_usage["num_episodes"] += 1
+        self.process_usage["rss_mb_growth"] = resources["rss_mb"] - self.process_usage["rss_mb_baseline"]
+        return {
+            "process_episodes": self.process_usage["num_episodes"],
+            "rss_mb_growth": self.process_usage["rss_mb_growth"],
+        }
+
+    def record_episode(self, episode_args, metrics):
+        """
+        Save the results of a finished episode in the episode log and the result store
+        :param episode_args: Arguments of evaluate_episode for the episode
+        :param metrics: Metrics summary of the episode
+        """
+        self.episode_log.append(*episode_args[:4], metrics)
+        self.result_store.add_episode(self.run_id, *episode_args[:4], metrics)
+
+    def record_failure(self, episode, episode_args, failure):
+        """
+        Save a failed episode in the episode log, the result store and the failed episodes of the run
+        :param episode: Index of the episode in the evaluation plan
+        :param episode_args: Arguments of evaluate_episode for the episode
+        :param failure: Reason of the failure
+        """
+        task, scene_id, instance_id, episode_id = episode_args[:4]
+        self.episode_log.append(task, scene_id, instance_id, episode_id, None, failure=failure)
+        self.result_store.add_failed_episode(self.run_id, task, scene_id, instance_id, episode_id, failure)
+        self.run_failures[episode] = {
+            "task": task,
+            "scene_id": scene_id,
+            "instance_id": int(instance_id),
+            "episode_id": int(episode_id),
+            "failure": failure,
+        }
+
+    def create_env(self, env_config):
+        return create_headless_env(env_config)
+
+    def close_environments(self):
+        """
+        Close the environments kept loaded between episodes, if any
+        """
+        if self.env_cache is not None:
+            self.env_cache.close()
 
     def evaluate_episode(self, task, scene_id, instance_id, episode_id, env_config):
+        state = self.start_episode(task, scene_id, instance_id, episode_id, env_config)
+        profiler = self.current_episode["profiler"]
+        # The agent draws its random numbers apart from the environment, so that its recorded actions can be replayed
+        agent_random_state = AgentRandomState(self.current_episode["agent_seed"])
+        with agent_random_state:
+            self.agent.reset()
+        done = False
+        while not done:
+            with profiler.record("agent.act"), agent_random_state:
+                action = self.agent.act(state)
+            state, done = self.step_episode(action)
+        return self.end_episode()
+
+    def start_episode(self, task, scene_id, instance_id, episode_id, env_config, seed=None):
+        """
+        Load the environment of an episode, start the metrics and reset the environment
+        The episode is evaluated by calling step_episode until it is done, and then end_episode
+        :param seed: Seed of the episode. If None, it is derived from the seed of the benchmark and the episode
+        :return: Initial observation of the episode
+        """
         print("New episode: task {}, scene {}, instance {}, episode {}".format(task, scene_id, instance_id, episode_id))
+        # The environment modifies its config, keep the planned one intact (e.g. to plan more episodes of the instance)
+        env_config = copy.deepcopy(env_config)
         env_config["instance_id"] = instance_id
-        env = iGibsonEnv(
-            config_file=env_config,
-            mode="headless",
-            action_timestep=1.0 / 30.0,
-            physics_timestep=1.0 / 120.0,
-        )
+        episode_key = get_episode_key(task, scene_id, instance_id, episode_id)
+        if seed is None:
+            seed = get_episode_seed(self.options.seed, episode_key)
+        if self.trajectory_recorder is not None:
+            # Saved before creating the environment, which modifies the config
+            self.trajectory_recorder.start_episode(
+                task,
+                scene_id,
+                instance_id,
+                episode_id,
+                {
+                    "task": task,
+                    "scene_id": scene_id,
+                    "instance_id": int(instance_id),
+                    "episode_id": int(episode_id),
+                    "seed": seed,
+                    "env_config": json.dumps(env_config),
+                    # Whether the episode may have reused a loaded environment, to replay it in the same conditions
+                    "env_cache_size": self.options.env_cache_size,
+                },
+            )
+        resources_before = sample_resources()
+        if self.env_cache is not None:
+            env, env_reused, load_time = self.env_cache.get(env_config)
+        else:
+            start_time = time.time()
+            env = self.create_env(env_config)
+            env_reused, load_time = False, time.time() - start_time
         (
             start_callbacks,
             step_callbacks,
             end_callbacks,
             data_callbacks,
-        ) = get_metrics_callbacks()
-        for callback in start_callbacks:
+        ) = get_metrics_callbacks(self.options.metric_schedules)
+        # Every-step copies of the scheduled metrics, to verify the results of the schedules
+        reference_metrics = []
+        if self.options.verify_metrics:
+            reference_metrics = create_reference_metrics(self.options.metric_schedules)
+        for callback in start_callbacks + [metric.start_callback for metric in reference_metrics]:
             callback(env, None)
-        self.agent.reset()
+        seed_episode(seed)
+        start_time = time.time()
         state = env.reset()
-        while True:
-            action = self.agent.act(state)
-            state, reward, done, info = env.step(action)
-            for callback in step_callbacks:
-                callback(env, None)
-            if done:
-                break
-        for callback in end_callbacks:
+        reset_time = time.time() - start_time
+        profiler = StepProfiler(trace=episode_key == self.trace_episode_key)
+        profiler.instrument_env(env)
+        from behavior.benchmark.action_repeat import ActionRepeat
+
+        self.current_episode = {
+            "key": episode_key,
+            "seed": seed,
+            "agent_seed": (seed + 1) % 2**32,
+            "env": env,
+            # Repeats the actions of the agent, evaluating the metrics after every step of the environment
+            "repeat_env": ActionRepeat(env, self.options.action_repeat, step_callback=self.step_metrics),
+            "profiler": profiler,
+            "step_callbacks": step_callbacks,
+            "step_callback_names": [get_callback_name(callback) for callback in step_callbacks],
+            "end_callbacks": end_callbacks,
+            "data_callbacks": data_callbacks,
+            "reference_metrics": reference_metrics,
+            "resources_before": resources_before,
+            # Wall-clock time spent loading the environment versus stepping it
+            "benchmark_time": {
+                "env_load": load_time,
+                "env_reused": env_reused,
+                "reset": reset_time,
+                "steps": 0.0,
+                "agent": 0.0,
+                "num_steps": 0,
+            },
+        }
+        return state
+
+    def step_episode(self, action, agent_time=None):
+        """
+        Step the environment of the current episode and its metrics, repeating the action action_repeat times
+        :param action: Action of the agent
+        :param agent_time: Time spent by the agent to compute the action when it is computed outside of this process
+            (e.g. batched with other environments), for the timing report
+        :return: Tuple of (next observation, whether the episode is done)
+        """
+        profiler = self.current_episode["profiler"]
+        if agent_time is not None:
+            profiler.add("agent.act_batch", agent_time)
+        start_time = time.time()
+        state, _, done, _ = self.current_episode["repeat_env"].step(action)
+        self.current_episode["benchmark_time"]["steps"] += time.time() - start_time
+        return state, done
+
+    def step_metrics(self, action, reward, done, info):
+        """
+        Record the action and evaluate the metrics after a step of the environment of the current episode
+        """
+        env = self.current_episode["env"]
+        profiler = self.current_episode["profiler"]
+        if self.trajectory_recorder is not None:
+            self.trajectory_recorder.record(action)
+        for callback, name in zip(self.current_episode["step_callbacks"], self.current_episode["step_callback_names"]):
+            with profiler.record(name):
+                callback(env, None, final_step=done)
+        for metric in self.current_episode["reference_metrics"]:
+            with profiler.record("metrics.reference"):
+                metric.step_callback(env, None)
+        self.current_episode["benchmark_time"]["num_steps"] += 1
+
+    def end_episode(self):
+        """
+        Finish the current episode and gather its metrics
+        :return: Metrics summary of the episode
+        """
+        env = self.current_episode["env"]
+        profiler = self.current_episode["profiler"]
+        profiler.restore_env()
+        reference_metrics = self.current_episode["reference_metrics"]
+        # The reference metrics finish first because the end callbacks of some metrics step the simulator
+        for callback in [metric.end_callback for metric in reference_metrics] + self.current_episode["end_callbacks"]:
             callback(env, None)
         metrics_summary = {}
-        for callback in data_callbacks:
+        for callback in self.current_episode["data_callbacks"]:
             print("Generating report for the episode")
             metrics_summary.update(callback())
+        if len(reference_metrics) > 0:
+            reference_results = {}
+            for metric in reference_metrics:
+                reference_results.update(metric.gather_results())
+            metrics_summary["metric_verification"] = verify_metric_results(metrics_summary, reference_results)
 
+        task, scene_id, instance_id, episode_id = self.current_episode["key"]
         metrics_summary["task"] = task
-
-        env.close()
+        metrics_summary["seed"] = self.current_episode["seed"]
+        metrics_summary["metric_schedules"] = dict(self.options.metric_schedules)
+        benchmark_time = self.current_episode["benchmark_time"]
+        benchmark_time["agent"] = profiler.total("agent.act") + profiler.total("agent.act_batch")
+        metrics_summary["benchmark_time"] = benchmark_time
+        # Percentiles of the duration of each stage of the steps
+        metrics_summary["step_timing"] = profiler.summary()
+        if benchmark_time["num_steps"] > 0:
+            print(
+                "Episode steps/s: {:.2f} with outputs {}".format(
+                    benchmark_time["num_steps"] / (benchmark_time["steps"] + benchmark_time["agent"]), env.output
+                )
+            )
+        if profiler.trace_events is not None:
+            trace_file = os.path.join(
+                self.output_dir, "trace_{}_{}_{}_{}.json".format(task, scene_id, instance_id, episode_id)
+            )
+            profiler.save_trace(trace_file)
+            print("Timeline of the episode saved to %s" % trace_file)
+
+        if self.trajectory_recorder is not None:
+            self.trajectory_recorder.end_episode({})
+        if self.env_cache is None:
+            env.close()
+        # Memory and file descriptors (including EGL contexts) of the process before loading and after closing the
+        # environment, to detect leaks across episodes
+        resources_before = self.current_episode["resources_before"]
+        resources_after = sample_resources()
+        resource_usage = {
+            "rss_mb_before": resources_before["rss_mb"],
+            "rss_mb_after": resources_after["rss_mb"],
+            "num_fds_before": resources_before["num_fds"],
+            "num_fds_after": resources_after["num_fds"],
+        }
+        resource_usage.update(self.update_process_usage(resources_after))
+        metrics_summary["resource_usage"] = resource_usage
+        self.current_episode = None
         return metrics_summary
 
 
 def get_agent(agent_class, args):
+    # Only the evaluated agent is imported
     if agent_class == "Random":
+        from behavior.benchmark.agents.random_agent import RandomAgent
+
         return RandomAgent()
     elif agent_class == "PPO":
+        from behavior.benchmark.agents.rl_agent import PPOAgent
+
         return PPOAgent(args.ckpt_path)
-    elif agent_class == "PPO":
+    elif agent_class == "ExportedPPO":
+        from behavior.benchmark.agents.exported_ppo_agent import ExportedPPOAgent
+
+        return ExportedPPOAgent(args.ckpt_path, num_threads=args.agent_threads)
+    elif agent_class == "Custom":
+        from behavior.benchmark.agents.users_agent import CustomAgent
+
         return CustomAgent()
     else:
         print("Agent class not recognize. Consider adding it.")
@@ -311,8 +822,36 @@ def main():
     Arguments:
         agent-class: the Python class the agent belongs to
         ckpt-path: path to the checkpoint file if the agent is implemented as a neural network policy trained before
+                   (for ExportedPPO, the policy exported with behavior.benchmark.agents.policy_export)
+        agent-threads: number of intra-op threads of the ExportedPPO policy
         split: activities to evaluate the agent on. The split can be ["minival", "dev", "test"], a list of activity
                labels, or a single activity label
+        num-workers: number of worker processes to evaluate episodes in parallel
+        episode-timeout: wall-clock budget of an episode, after which its worker is replaced and the episode fails
+        recycle-worker-episodes: number of episodes after which a worker process is replaced
+        recycle-worker-memory-mb: memory growth of a worker process after which it is replaced
+        record-trajectories: record the actions of each episode to recompute the metrics with rescore
+        seed: base seed of the episodes
+        episodes-per-instance: number of episodes per activity instance (minimum with target-ci-width)
+        target-ci-width: add episodes to each instance until the 95% confidence interval of its success score is this
+                         narrow
+        max-episodes-per-instance: maximum number of episodes per instance with target-ci-width
+        plan-file: compiled evaluation plan, compiled and saved if it does not exist
+        action-repeat: number of steps each action of the agent is repeated for, computing only the last observation
+        all-outputs: compute all the observations of the config, even if the agent does not use them
+        calibration-steps: steps to measure the throughput gain of computing only the observations used by the agent
+        env-cache-size: number of loaded environments kept between episodes to avoid reloading the scene
+        env-cache-memory-mb: memory bound of the environment cache
+        resume: continue an interrupted evaluation from the episode log in the output directory
+        result-store: SQLite file accumulating the results of all activities and runs
+        shard-index, num-shards: evaluate only one shard of the deterministic partition of the evaluation plan
+        dry-run: print the evaluation plan and its predicted makespan
+        batch-envs: number of environments stepped in lockstep with batched agent queries
+        trace-episode: episode of the evaluation plan whose timeline of step timings is saved
+        remote-agent: run the agent in a separate process, receiving the observations through shared memory
+        one-step-latency: with remote-agent, compute the action of each observation while the simulator steps
+        metric-schedule: schedule of the step callback of a metric, e.g. KinematicDisarrangement=stride:10
+        verify-metrics: check that the scheduled metrics match the every-step metrics within the tolerance
     Add your own arguments for your agent, if needed
     """
     parser = argparse.ArgumentParser()
@@ -320,7 +859,7 @@ def main():
         "--agent-class",
         type=str,
         default="Random",
-        choices=["Random", "PPO", "Custom"],
+        choices=["Random", "PPO", "ExportedPPO", "Custom"],
         help="the Python class the agent belongs to",
     )
     parser.add_argument(
@@ -329,22 +868,57 @@ def main():
         type=str,
         help="path to the checkpoint file if the agent is implemented as a neural network policy trained before",
     )
+    parser.add_argument(
+        "--agent-threads",
+        default=1,
+        type=int,
+        help="number of intra-op threads of the ExportedPPO policy",
+    )
     parser.add_argument(
         "--split",
         default="minival",
         type=str,
         help='activities to evaluate the agent on. The split can be ["minival", "dev", "test"], a list of activity labels, or a single activity label',
     )
+    parser.add_argument(
+        "--remote-agent",
+        action="store_true",
+        help="run the agent in a separate process that receives the observations through shared memory",
+    )
+    parser.add_argument(
+        "--one-step-latency",
+        action="store_true",
+        help="with --remote-agent, act on the observation of the previous step to overlap the agent with the simulator",
+    )
+    parser.add_argument(
+        "--episodes-per-instance",
+        default=1,
+        type=int,
+        help="number of episodes per activity instance (minimum number with --target-ci-width)",
+    )
+
+    add_run_arguments(parser)
 
     args = parser.parse_args()
 
     print("Evaluating agent of type {} on {}".format(args.agent_class, args.split))
 
     # Create agent to be evaluated
-    agent = get_agent(args.agent_class, args)
+    if args.remote_agent:
+        assert args.num_workers <= 0, "The remote agent cannot be used with worker processes"
+        agent = RemoteAgent(
+            functools.partial(get_agent, args.agent_class, args), one_step_latency=args.one_step_latency
+        )
+    else:
+        agent = get_agent(args.agent_class, args)
 
     # Create an instance of the benchmark
-    benchmark = BehaviorBenchmark(agent, split=args.split)
+    benchmark = BehaviorBenchmark(
+        agent,
+        split=args.split,
+        episodes_per_instance=args.episodes_per_instance,
+        options=RunOptions.from_args(args),
+    )
 
     # Evaluate agent on the benchmark
     benchmark.evaluate_agent()
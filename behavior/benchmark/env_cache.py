@@ -0,0 +1,110 @@
+"""
+Cache of loaded iGibson environments to avoid reloading the scene between consecutive benchmark episodes
+"""
+import copy
+import logging
+import time
+from collections import OrderedDict
+
+from behavior.benchmark.resource_usage import get_rss_mb
+
+log = logging.getLogger(__name__)
+
+
+def get_env_key(env_config):
+    """
+    Key of the cache for an environment config: scene, robot and observation modalities
+    :param env_config: Parsed environment config
+    :return: Hashable key
+    """
+    return (
+        env_config["scene_id"],
+        env_config["robot"]["name"],
+        tuple(sorted(env_config.get("output", []))),
+    )
+
+
+def get_instance_key(env_config):
+    """
+    Identifier of the activity instance loaded in an environment
+    :param env_config: Parsed environment config
+    :return: Hashable identifier
+    """
+    return (env_config["task"], env_config.get("task_id", 0), env_config["instance_id"], env_config.get("max_step"))
+
+
+class EnvironmentCache(object):
+    """
+    Least recently used cache of iGibson environments keyed by (scene_id, robot, modalities)
+    A cached environment is reused (only reset) when the next episode is evaluated in the same activity instance: the
+    BehaviorTask restores the initial snapshot of the scene on reset. If the activity instance is different, the instance
+    is reloaded in place with iGibsonEnv.reload_model, which keeps the environment object but needs to reload the scene
+    URDF of the new instance (objects and furniture change between instances).
+    The cache is bounded both by number of environments and by the resident memory of the process.
+    """
+
+    def __init__(self, create_env, max_envs=1, max_memory_mb=None):
+        """
+        Constructor
+        :param create_env: Function that creates an environment from a parsed config
+        :param max_envs: Maximum number of environments kept loaded
+        :param max_memory_mb: Maximum resident memory of the process (in MB) before evicting environments. If None,
+            the cache is only bounded by the number of environments
+        """
+        assert max_envs > 0, "The environment cache needs to hold at least one environment"
+        self.create_env = create_env
+        self.max_envs = max_envs
+        self.max_memory_mb = max_memory_mb
+        self.envs = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, env_config):
+        """
+        Get an environment for the given config, reusing a cached environment if possible
+        :param env_config: Parsed environment config, including the instance_id of the episode
+        :return: Tuple of (environment, whether the loaded environment was reused, time spent loading in seconds)
+        """
+        key = get_env_key(env_config)
+        instance_key = get_instance_key(env_config)
+        start = time.time()
+        if key in self.envs:
+            env, cached_instance_key = self.envs.pop(key)
+            if cached_instance_key == instance_key:
+                self.envs[key] = (env, instance_key)
+                self.hits += 1
+                log.debug("Reusing loaded environment for {}".format(key))
+                return env, True, time.time() - start
+            log.debug("Reloading activity instance {} in {}".format(instance_key, key))
+            self.misses += 1
+            # The robot name is popped from the config when loading, so the environment needs a fresh copy of it
+            env.config = copy.deepcopy(env_config)
+            env.reload_model(env_config["scene_id"])
+            self.envs[key] = (env, instance_key)
+            self.evict()
+            return env, False, time.time() - start
+
+        self.misses += 1
+        self.evict(reserve=1)
+        env = self.create_env(env_config)
+        self.envs[key] = (env, instance_key)
+        return env, False, time.time() - start
+
+    def evict(self, reserve=0):
+        """
+        Close least recently used environments until the cache is within bounds
+        :param reserve: Number of slots to free for environments about to be created
+        """
+        while self.envs and len(self.envs) + reserve > self.max_envs:
+            self._evict_oldest()
+        while len(self.envs) > 1 and self.max_memory_mb is not None and get_rss_mb() > self.max_memory_mb:
+            self._evict_oldest()
+
+    def _evict_oldest(self):
+        key, (env, _) = self.envs.popitem(last=False)
+        log.debug("Evicting environment {} from the cache".format(key))
+        env.close()
+
+    def close(self):
+        while self.envs:
+            self._evict_oldest()
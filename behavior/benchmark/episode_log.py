@@ -0,0 +1,95 @@
+"""
+Append-only log of finished benchmark episodes, used to resume interrupted runs
+"""
+import json
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+
+def get_episode_key(task, scene_id, instance_id, episode_id):
+    """
+    Key identifying an episode of the benchmark
+    :return: Tuple (task, scene_id, instance_id, episode_id)
+    """
+    return (task, scene_id, int(instance_id), int(episode_id))
+
+
+class EpisodeLog(object):
+    """
+    JSON Lines file with one record per finished episode. Failed episodes (see EpisodeWorkerPool) are recorded with the
+    reason of the failure instead of metrics, and are evaluated again when the run is resumed
+    Each record is appended with a single write on a file opened in append mode and flushed to disk before the next
+    episode starts, so a crash can at most leave a truncated last line, which is ignored (and removed) when the log is
+    read again.
+    """
+
+    def __init__(self, path):
+        """
+        Constructor
+        :param path: Path of the log file
+        """
+        self.path = path
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def load(self):
+        """
+        Read the finished episodes
+        :return: Dictionary of episode key (see get_episode_key) to the record of the episode
+        """
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, "rb") as f:
+            data = f.read()
+        valid_size = 0
+        for line in data.splitlines(True):
+            if not line.endswith(b"\n"):
+                log.warning("Ignoring truncated last record of the episode log {}".format(self.path))
+                break
+            try:
+                record = json.loads(line.decode("utf-8"))
+            except ValueError:
+                log.warning("Ignoring corrupted record of the episode log {}".format(self.path))
+                valid_size += len(line)
+                continue
+            valid_size += len(line)
+            key = get_episode_key(record["task"], record["scene_id"], record["instance_id"], record["episode_id"])
+            records[key] = record
+        if valid_size < len(data):
+            # Remove the truncated record so that the next append starts on a new line
+            with open(self.path, "r+b") as f:
+                f.truncate(valid_size)
+        return records
+
+    def append(self, task, scene_id, instance_id, episode_id, metrics, failure=None):
+        """
+        Append a finished episode to the log
+        :param metrics: Metrics summary of the episode, None if it failed
+        :param failure: Reason of the failure of the episode, None if it succeeded
+        """
+        record = {
+            "task": task,
+            "scene_id": scene_id,
+            "instance_id": int(instance_id),
+            "episode_id": int(episode_id),
+            "metrics": metrics,
+        }
+        if failure is not None:
+            record["failure"] = failure
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        directory = os.path.dirname(self.path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            written = 0
+            while written < len(line):
+                written += os.write(fd, line[written:])
+            os.fsync(fd)
+        finally:
+            os.close(fd)
@@ -0,0 +1,178 @@
+"""
+Precompiled evaluation plan of the benchmark: activities, scenes and activity instances per scene, and maximum number of
+steps of each activity
+Compiling the plan lists the bddl activity definitions and reads the preselected scenes of bddl and the activity
+statistics of the iGibson dataset. The compiled plan is a versioned JSON file validated by the hash of its content, so
+that shards and resumed runs plan their episodes without touching the bddl and iGibson dataset trees
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+# Version of the format of the compiled plan. Plans compiled with another version must be compiled again
+PLAN_VERSION = 1
+
+NUM_ACTIVITIES = 100
+
+
+def get_scene_instance_ids(scenes):
+    """
+    Activity instances evaluated in each scene of an activity, following the official benchmark rules
+    :param scenes: Sorted list of the scenes where the activity can be performed
+    :return: Dictionary of scene to list of instance ids
+    """
+    # Official benchmark: Evaluate 9 episodes per activity
+    # instance id 0-9: seen poses
+    # instance id 10-19: unseen poses
+    # instance id 20-29: unseen scenes (same houses but different furniture arrangement)
+    # If you don't have enough activity instances in ig_dataset, the behavior data bundle is outdated.
+    # You need to follow the participant guide and download again.
+    num_scenes = len(scenes)
+    assert 0 < num_scenes <= 3
+
+    # Depending on the number of scenes available for this activity
+    if num_scenes == 3:
+        # Regular case. We use three instances per scene (one "seen poses", one "unseen poses" and one
+        # "unseen scene" (different furniture))
+        return {
+            scenes[0]: [0, 10, 20],
+            scenes[1]: [0, 10, 20],
+            scenes[2]: [0, 10, 20],
+        }
+    elif num_scenes == 2:
+        # We use four instances of one scene (two "seen poses", one "unseen poses" and one
+        # "unseen scene" (different furniture)) and five from another scene (two "seen poses", two
+        # "unseen poses" and one "unseen scene" (different furniture))
+        return {
+            scenes[0]: [0, 1, 10, 20],
+            scenes[1]: [0, 1, 10, 11, 20],
+        }
+    # We use nine instances of one scene (three "seen poses", three "unseen poses" and three
+    # "unseen scene" (different furniture))
+    return {scenes[0]: [0, 1, 2, 10, 11, 12, 20, 21, 22]}
+
+
+def get_content_hash(activities):
+    """
+    :param activities: Dictionary of activity to plan of the activity
+    :return: SHA-256 of the canonical JSON of the plan format version and the activities
+    """
+    content = json.dumps({"version": PLAN_VERSION, "activities": activities}, sort_keys=True)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def compile_plan():
+    """
+    Compile the evaluation plan from the bddl and iGibson dataset trees
+    :return: Dictionary with the version, the content hash and, for each activity, the instance ids to evaluate per
+        scene and the maximum number of steps
+    """
+    # Only needed to compile the plan
+    import bddl
+    import igibson
+
+    # Get list of all 100 activities
+    activities = sorted(
+        [
+            item
+            for item in os.listdir(os.path.join(os.path.dirname(bddl.__file__), "activity_definitions"))
+            if item != "domain_igibson.bddl"
+        ]
+    )
+    assert len(activities) == NUM_ACTIVITIES
+
+    # This provides a dictionary of scenes where each activity can be successfully performed
+    with open(os.path.join(os.path.dirname(bddl.__file__), "activity_to_preselected_scenes.json")) as f:
+        activity_to_scenes = json.load(f)
+
+    # This provides metadata about the activities, including the time humans require to perform them
+    with open(os.path.join(igibson.ig_dataset_path, "metadata", "behavior_activity_statistics.json")) as f:
+        activity_metadata = json.load(f)
+
+    plan_activities = {}
+    for activity in activities:
+        assert activity in activity_to_scenes.keys()
+        scenes = sorted(set(activity_to_scenes[activity]))  # Get the scenes where the activity can be performed
+        plan_activities[activity] = {
+            "scene_instance_ids": get_scene_instance_ids(scenes),
+            # We give agent 2x steps of average human demonstration across all possible scenes
+            "max_step": activity_metadata[activity]["mean"] * 2,
+        }
+    return {"version": PLAN_VERSION, "content_hash": get_content_hash(plan_activities), "activities": plan_activities}
+
+
+def save_plan(plan, path):
+    """
+    Save a compiled plan, replacing the file atomically so that concurrent shards never read a partial plan
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(plan, f, indent=4, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def load_plan(path):
+    """
+    Load a compiled plan and validate its version and content hash
+    :return: Compiled plan (see compile_plan)
+    """
+    with open(path) as f:
+        plan = json.load(f)
+    version = plan.get("version")
+    assert version == PLAN_VERSION, "The evaluation plan {} has version {}: compile it again".format(path, version)
+    content_hash = get_content_hash(plan["activities"])
+    assert (
+        plan["content_hash"] == content_hash
+    ), "The evaluation plan {} does not match its hash: compile it again".format(path)
+    return plan
+
+
+def get_plan(path=None):
+    """
+    Load the compiled plan, or compile it if it does not exist
+    :param path: Path of the compiled plan. If None, the plan is compiled and not saved
+    :return: Compiled plan (see compile_plan)
+    """
+    if path is not None and os.path.exists(path):
+        return load_plan(path)
+    plan = compile_plan()
+    if path is not None:
+        save_plan(plan, path)
+        print("Evaluation plan compiled to {}".format(path))
+    return plan
+
+
+def main():
+    """
+    Compile the evaluation plan, or check that a compiled plan matches the bddl and iGibson dataset trees
+    """
+    parser = argparse.ArgumentParser(description="Compile the evaluation plan of the benchmark")
+    parser.add_argument("plan_file", type=str, help="path of the compiled plan")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="check that the compiled plan is valid and up to date instead of compiling it",
+    )
+    args = parser.parse_args()
+    plan = compile_plan()
+    if args.check:
+        up_to_date = load_plan(args.plan_file)["content_hash"] == plan["content_hash"]
+        print("The evaluation plan {} is {}".format(args.plan_file, "up to date" if up_to_date else "outdated"))
+        sys.exit(0 if up_to_date else 1)
+    save_plan(plan, args.plan_file)
+    num_instances = sum(
+        len(instance_ids)
+        for activity_plan in plan["activities"].values()
+        for instance_ids in activity_plan["scene_instance_ids"].values()
+    )
+    print(
+        "Evaluation plan with {} activities and {} activity instances saved to {}".format(
+            len(plan["activities"]), num_instances, args.plan_file
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
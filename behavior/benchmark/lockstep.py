@@ -0,0 +1,180 @@
+"""
+Evaluation of several benchmark episodes in lockstep, querying the agent once per step for all of them
+"""
+import logging
+import multiprocessing
+import time
+import traceback
+from multiprocessing.connection import wait
+
+log = logging.getLogger(__name__)
+
+
+def _slot_loop(benchmark, conn):
+    """
+    Main loop of the process of an environment slot: runs the environment and the metrics of its episodes
+    iGibson uses the default pybullet client of the process, so each environment needs its own process
+    :param benchmark: BehaviorBenchmark object inherited from the parent process
+    :param conn: End of the pipe connecting the slot with the main process
+    """
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        command, data = message
+        try:
+            if command == "start":
+                result = benchmark.start_episode(*data)
+            elif command == "step":
+                result = benchmark.step_episode(*data)
+            elif command == "end":
+                result = benchmark.end_episode()
+            else:
+                raise ValueError("Unknown command {}".format(command))
+            conn.send((result, None))
+        except Exception:
+            conn.send((None, traceback.format_exc()))
+    benchmark.close_environments()
+    conn.close()
+
+
+class LockstepEnvironments(object):
+    """
+    Steps the environments of several episodes in lockstep. The environments run in forked processes (slots) while
+    the agent runs in the main process and computes the actions of all of them with a single call to act_batch
+    A slot starts the next pending episode as soon as its episode ends, and its new observation joins the batch once the
+    environment is loaded, without waiting for the other slots. The observations are passed to the agent with the ids
+    of their slots (see Agent.act_slots), and the agent is reset for a slot when the slot starts an episode (see
+    Agent.reset_slot)
+    """
+
+    def __init__(self, benchmark, num_envs):
+        """
+        Constructor
+        :param benchmark: BehaviorBenchmark with the agent and the environment setup
+        :param num_envs: Number of environments stepped in lockstep
+        """
+        assert num_envs > 0, "Lockstep evaluation needs at least one environment"
+        self.benchmark = benchmark
+        self.num_envs = num_envs
+        self.context = multiprocessing.get_context("fork")
+        self.slots = []
+        self.connections = []
+
+    def start(self):
+        for slot_id in range(self.num_envs):
+            parent_conn, child_conn = self.context.Pipe()
+            slot = self.context.Process(
+                target=_slot_loop, args=(self.benchmark, child_conn), name="behavior_env_slot_{}".format(slot_id)
+            )
+            slot.daemon = True
+            slot.start()
+            child_conn.close()
+            self.slots.append(slot)
+            self.connections.append(parent_conn)
+
+    def close(self):
+        for conn in self.connections:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, EOFError, OSError):
+                pass
+        for slot in self.slots:
+            slot.join()
+        for conn in self.connections:
+            conn.close()
+        self.slots = []
+        self.connections = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type is not None:
+            for slot in self.slots:
+                slot.terminate()
+        self.close()
+
+    @staticmethod
+    def _receive(conn):
+        """
+        :return: Result of the last command sent to a slot
+        """
+        try:
+            result, error = conn.recv()
+        except EOFError:
+            raise RuntimeError("An environment slot died during the lockstep evaluation")
+        if error is not None:
+            raise RuntimeError("An environment slot failed:\n{}".format(error))
+        return result
+
+    @staticmethod
+    def _call(connections, command, data):
+        """
+        Send a command to several slots and wait for all the results, so that the slots work concurrently
+        :param connections: Connections of the slots
+        :param command: "start", "step" or "end"
+        :param data: List with the arguments of the command for each slot
+        :return: List of results
+        """
+        for conn, args in zip(connections, data):
+            conn.send((command, args))
+        return [LockstepEnvironments._receive(conn) for conn in connections]
+
+    def run(self, episodes):
+        """
+        Evaluates the given episodes in the lockstep environments, starting a new episode in a slot as soon as its
+        episode ends
+        :param episodes: List of pairs (episode index, arguments of BehaviorBenchmark.evaluate_episode)
+        :return: Generator of pairs (episode index, metrics summary) in order of completion
+        """
+        agent = self.benchmark.agent
+        pending = list(episodes)
+        slot_episodes = [None] * self.num_envs
+        # Slots loading the environment of their next episode, and observations of the slots waiting for an action
+        starting = set()
+        states = {}
+
+        def start_next_episode(slot_id):
+            slot_episodes[slot_id], episode_args = pending.pop(0)
+            self.connections[slot_id].send(("start", episode_args))
+            starting.add(slot_id)
+
+        for slot_id in range(min(self.num_envs, len(pending))):
+            start_next_episode(slot_id)
+        while len(starting) > 0 or len(states) > 0:
+            # Wait for a slot to start its episode only if no other slot is waiting for an action
+            timeout = 0.0 if len(states) > 0 else None
+            for conn in wait([self.connections[slot_id] for slot_id in starting], timeout):
+                slot_id = self.connections.index(conn)
+                starting.remove(slot_id)
+                states[slot_id] = self._receive(conn)
+                agent.reset_slot(slot_id)
+            if len(states) == 0:
+                continue
+
+            slot_ids = sorted(states.keys())
+            start_time = time.time()
+            actions = agent.act_slots([states[slot_id] for slot_id in slot_ids], slot_ids)
+            # The time of the batched query is shared among the episodes of the batch
+            agent_time = (time.time() - start_time) / len(slot_ids)
+            results = self._call(
+                [self.connections[slot_id] for slot_id in slot_ids],
+                "step",
+                [(action, agent_time) for action in actions],
+            )
+            states = {}
+            finished = []
+            for slot_id, (state, done) in zip(slot_ids, results):
+                if done:
+                    finished.append(slot_id)
+                else:
+                    states[slot_id] = state
+            if len(finished) > 0:
+                metrics = self._call([self.connections[slot_id] for slot_id in finished], "end", [None] * len(finished))
+                for slot_id, episode_metrics in zip(finished, metrics):
+                    episode = slot_episodes[slot_id]
+                    if len(pending) > 0:
+                        start_next_episode(slot_id)
+                    yield episode, episode_metrics
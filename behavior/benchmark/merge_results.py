@@ -0,0 +1,97 @@
+"""
+Merge the results of a benchmark evaluated in several shards into a single report
+"""
+import argparse
+import json
+import logging
+import os
+
+from behavior.benchmark.aggregation import FAILED_EPISODES_FILE, save_failed_episodes, save_results
+
+log = logging.getLogger(__name__)
+
+SHARD_INFO_FILE = "shard_info.json"
+
+
+def merge_results(shard_dirs, output_dir):
+    """
+    Merge the per-episode metrics of several shards and save the merged per-episode and aggregated metrics
+    The episodes are sorted by their index in the evaluation plan, so the merged files are byte-identical to the ones of
+    a run evaluating all the episodes on a single node. The failed episodes of the shards, if any, are merged as well.
+    If all the episodes failed, the merged per-episode and aggregated metrics are empty
+    :param shard_dirs: Output directories of the shards
+    :param output_dir: Directory to save the merged results in
+    """
+    per_episode_metrics = {}
+    failed_episodes = {}
+    num_shards = None
+    num_planned_episodes = None
+    shard_indices = set()
+    for shard_dir in shard_dirs:
+        info_file = os.path.join(shard_dir, SHARD_INFO_FILE)
+        if os.path.exists(info_file):
+            with open(info_file) as f:
+                shard_info = json.load(f)
+            if num_shards is not None and (num_shards, num_planned_episodes) != (
+                shard_info["num_shards"],
+                shard_info["num_planned_episodes"],
+            ):
+                raise ValueError("Shard {} belongs to a different evaluation plan".format(shard_dir))
+            num_shards = shard_info["num_shards"]
+            num_planned_episodes = shard_info["num_planned_episodes"]
+            shard_indices.add(shard_info["shard_index"])
+        else:
+            log.warning("No shard information in {}, the merged results cannot be checked".format(shard_dir))
+
+        log_file = os.path.join(shard_dir, "per_episode_metrics.json")
+        if not os.path.exists(log_file):
+            raise ValueError("Shard {} has no per-episode metrics".format(shard_dir))
+        with open(log_file) as f:
+            shard_metrics = json.load(f)
+        for episode, metrics in shard_metrics.items():
+            if int(episode) in per_episode_metrics:
+                raise ValueError("Episode {} is in more than one shard".format(episode))
+            per_episode_metrics[int(episode)] = metrics
+
+        failed_episodes_file = os.path.join(shard_dir, FAILED_EPISODES_FILE)
+        if os.path.exists(failed_episodes_file):
+            with open(failed_episodes_file) as f:
+                for episode, failure in json.load(f).items():
+                    if int(episode) in per_episode_metrics or int(episode) in failed_episodes:
+                        raise ValueError("Episode {} is in more than one shard".format(episode))
+                    failed_episodes[int(episode)] = failure
+
+    if num_shards is not None:
+        missing_shards = sorted(set(range(num_shards)) - shard_indices)
+        if len(missing_shards) > 0:
+            log.warning("Missing shards {} out of {}".format(missing_shards, num_shards))
+        if len(per_episode_metrics) + len(failed_episodes) != num_planned_episodes:
+            log.warning(
+                "Merged {} episodes but the evaluation plan has {}".format(
+                    len(per_episode_metrics) + len(failed_episodes), num_planned_episodes
+                )
+            )
+
+    os.makedirs(output_dir, exist_ok=True)
+    per_episode_metrics = {episode: per_episode_metrics[episode] for episode in sorted(per_episode_metrics.keys())}
+    log_file, summary_log_file = save_results(output_dir, per_episode_metrics)
+    print("Merged per episode eval results of {} shards saved to {}".format(len(shard_dirs), log_file))
+    print("Merged aggregated eval results saved to {}".format(summary_log_file))
+    failed_episodes = {episode: failed_episodes[episode] for episode in sorted(failed_episodes.keys())}
+    failed_episodes_file = save_failed_episodes(output_dir, failed_episodes)
+    print("Merged {} failed episodes saved to {}".format(len(failed_episodes), failed_episodes_file))
+
+
+def main():
+    """
+    Entry point to merge the results of a sharded benchmark evaluation
+    """
+    parser = argparse.ArgumentParser(description="Merge the results of a benchmark evaluated in several shards")
+    parser.add_argument("shard_dirs", nargs="+", type=str, help="output directories of the shards")
+    parser.add_argument("--output-dir", required=True, type=str, help="directory to save the merged results in")
+    args = parser.parse_args()
+    merge_results(args.shard_dirs, args.output_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Metric classes of the benchmark. They import iGibson, so metric_scheduling only imports this module when the metrics of
+an episode are created
+"""
+from collections import OrderedDict
+
+import numpy as np
+import pybullet as p
+from igibson.metrics.agent import RobotMetric
+from igibson.metrics.disarrangement import KinematicDisarrangement, LogicalDisarrangement
+from igibson.metrics.task import TaskMetric
+from igibson.object_states import Pose
+from igibson.objects.multi_object_wrappers import ObjectMultiplexer
+from igibson.utils.constants import PyBulletSleepState
+
+
+class IncrementalKinematicDisarrangement(KinematicDisarrangement):
+    """
+    KinematicDisarrangement that only queries the kinematic state of the objects that may have changed since the
+    previous step: the ones with a body awake in pybullet, or whose active part changed. A sleeping body does not move,
+    the same assumption the simulator makes to skip syncing it with the renderer. The state cache of the previous step
+    is kept instead of deep-copying it every step
+    The displacement of an unchanged object is exactly zero, so the results are the same as KinematicDisarrangement
+    """
+
+    def __init__(self):
+        super(IncrementalKinematicDisarrangement, self).__init__()
+        # Object name to list of (body id, link ids) of all its bodies (of all the parts of multiplexed objects)
+        self.object_bodies = {}
+
+    @staticmethod
+    def get_object_bodies(obj):
+        """
+        :return: List of (body id, list of link ids including the base) of the bodies of an object
+        """
+        if type(obj) == ObjectMultiplexer:
+            objects = [obj._multiplexed_objects[0]] + list(obj._multiplexed_objects[1].objects)
+        else:
+            objects = [obj]
+        return [
+            (body_id, [-1] + list(range(p.getNumJoints(body_id))))
+            for part in objects
+            for body_id in part.get_body_ids()
+        ]
+
+    @staticmethod
+    def get_object_state(obj, bodies):
+        """
+        Kinematic state of one object, with the layout of KinematicDisarrangement.update_state_cache plus the joint
+        positions of its bodies
+        """
+        if type(obj) == ObjectMultiplexer:
+            object_state = {
+                "pose": {
+                    "base": obj._multiplexed_objects[0].states[Pose].get_value(),
+                    "children": [part.states[Pose].get_value() for part in obj._multiplexed_objects[1].objects],
+                },
+                "active": obj.current_index,
+            }
+        else:
+            object_state = {"pose": {"base": obj.states[Pose].get_value()}, "active": 0}
+        object_state["joints"] = IncrementalKinematicDisarrangement.get_joint_positions(bodies)
+        return object_state
+
+    @staticmethod
+    def get_joint_positions(bodies):
+        """
+        :return: List of arrays of the joint positions of each body
+        """
+        return [
+            (
+                np.array([joint_state[0] for joint_state in p.getJointStates(body_id, link_ids[1:])])
+                if len(link_ids) > 1
+                else np.zeros(0)
+            )
+            for body_id, link_ids in bodies
+        ]
+
+    @staticmethod
+    def bodies_awake(bodies):
+        """
+        :return: Whether a link of the bodies is awake. Links whose activation state is not reported count as awake
+        """
+        for body_id, link_ids in bodies:
+            for link_id in link_ids:
+                dynamics_info = p.getDynamicsInfo(body_id, link_id)
+                if len(dynamics_info) < 13 or dynamics_info[12] in [
+                    PyBulletSleepState.AWAKE,
+                    PyBulletSleepState.ISLAND_AWAKE,
+                ]:
+                    return True
+        return False
+
+    @staticmethod
+    def object_changed(prev_object_cache, cur_object_cache):
+        """
+        :return: Whether the cached kinematic state (active part, position and orientation of the base and the parts,
+            joint positions) of an object differs between two steps
+        """
+        if prev_object_cache["active"] != cur_object_cache["active"]:
+            return True
+        prev_pose, cur_pose = prev_object_cache["pose"], cur_object_cache["pose"]
+        prev_poses = [prev_pose["base"]] + list(prev_pose.get("children", []))
+        cur_poses = [cur_pose["base"]] + list(cur_pose.get("children", []))
+        for (prev_pos, prev_orn), (cur_pos, cur_orn) in zip(prev_poses, cur_poses):
+            if not np.array_equal(prev_pos, cur_pos) or not np.array_equal(prev_orn, cur_orn):
+                return True
+        for prev_joints, cur_joints in zip(prev_object_cache.get("joints", []), cur_object_cache.get("joints", [])):
+            if not np.array_equal(prev_joints, cur_joints):
+                return True
+        return False
+
+    @staticmethod
+    def get_zero_disarrangement(active):
+        """
+        :return: Displacement of an object that did not move, with the layout and types of
+            calculate_object_disarrangement
+        """
+        if active == 0:
+            return {"base": 0.0, "children": [0, 0]}
+        return {"base": 0, "children": [0.0, 0.0]}
+
+    def step_callback(self, env, log_reader):
+        if not self.initialized:
+            total_disarrangement = super(IncrementalKinematicDisarrangement, self).step_callback(env, log_reader)
+            self.object_bodies = {
+                obj: self.get_object_bodies(env.scene.objects_by_name[obj]) for obj in self.prev_state_cache
+            }
+            for obj, bodies in self.object_bodies.items():
+                self.prev_state_cache[obj]["joints"] = self.get_joint_positions(bodies)
+            return total_disarrangement
+
+        total_disarrangement = 0.0
+        # The entries of the objects that did not change are shared with the cache of the previous step
+        self.cur_state_cache = dict(self.prev_state_cache)
+        for obj, bodies in self.object_bodies.items():
+            prev_object_cache = self.prev_state_cache[obj]
+            scene_obj = env.scene.objects_by_name[obj]
+            active = scene_obj.current_index if type(scene_obj) == ObjectMultiplexer else 0
+            changed = False
+            if active != prev_object_cache["active"] or self.bodies_awake(bodies):
+                cur_object_cache = self.get_object_state(scene_obj, bodies)
+                changed = self.object_changed(prev_object_cache, cur_object_cache)
+                if changed:
+                    self.cur_state_cache[obj] = cur_object_cache
+            if not changed:
+                zero_disarrangement = self.get_zero_disarrangement(prev_object_cache["active"])
+                self.delta_obj_disp_dict[obj]["base"].append(zero_disarrangement["base"])
+                self.delta_obj_disp_dict[obj]["children"].append(zero_disarrangement["children"])
+                continue
+            obj_disarrangement = self.calculate_object_disarrangement(obj, self.prev_state_cache, self.cur_state_cache)
+            total_disarrangement += obj_disarrangement["base"]
+            total_disarrangement += np.sum(obj_disarrangement["children"])
+
+            self.delta_obj_disp_dict[obj]["base"].append(obj_disarrangement["base"])
+            self.delta_obj_disp_dict[obj]["children"].append(obj_disarrangement["children"])
+
+            self.int_obj_disp_dict[obj]["base"] += obj_disarrangement["base"]
+            self.int_obj_disp_dict[obj]["children"] = np.array(self.int_obj_disp_dict[obj]["children"]) + np.array(
+                obj_disarrangement["children"]
+            )
+
+        # The cache entries are replaced, never modified, so the cache of this step is not modified afterwards
+        self.prev_state_cache = self.cur_state_cache
+        self.integrated_disarrangement += total_disarrangement
+        self.delta_disarrangement.append(total_disarrangement)
+
+        return total_disarrangement
+
+
+# Metrics of the benchmark, in the order their callbacks are called
+METRIC_CLASSES = OrderedDict(
+    [
+        ("KinematicDisarrangement", KinematicDisarrangement),
+        ("LogicalDisarrangement", LogicalDisarrangement),
+        ("RobotMetric", RobotMetric),
+        ("TaskMetric", TaskMetric),
+    ]
+)
+
+# Implementations of the metrics that support change-driven evaluation
+INCREMENTAL_METRIC_CLASSES = {"KinematicDisarrangement": IncrementalKinematicDisarrangement}
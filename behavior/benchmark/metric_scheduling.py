@@ -0,0 +1,177 @@
+"""
+Scheduling of the step callbacks of the benchmark metrics: every step, every N steps or only on the objects that changed
+The aggregated benchmark metrics computed with a schedule match the ones computed evaluating every metric at every step
+within METRIC_TOLERANCE:
+- "every_step": the metric is evaluated after every action step, as in the original benchmark
+- "on_change": the metric only queries the objects with a body awake in pybullet (or whose active part changed), and
+  only processes the ones whose pose or joints changed since the previous step. Unchanged objects contribute exactly
+  zero, so the results are the same as "every_step" as long as every moved body is awake. Bodies moved kinematically
+  (teleported, e.g. with resetBasePositionAndOrientation) can stay asleep and be missed, so this schedule is opt-in
+- "stride:N": the metric is evaluated at the first step, every N steps and at the final step. Only allowed for metrics
+  whose reported benchmark values depend on the initial and final states (e.g. the relative kinematic disarrangement).
+  Their per-step series contain one value per evaluated step and their integrated values are lower bounds of the ones
+  computed every step
+Use RunOptions(verify_metrics=True) (--verify-metrics) to also compute every-step reference metrics and check
+the tolerance in every episode.
+"""
+import logging
+from collections import OrderedDict
+
+import numpy as np
+
+from behavior.benchmark.aggregation import get_episode_values
+
+log = logging.getLogger(__name__)
+
+EVERY_STEP = "every_step"
+ON_CHANGE = "on_change"
+STRIDE = "stride"
+
+# Maximum difference between the aggregated benchmark values of an episode computed with a schedule and every step
+METRIC_TOLERANCE = {"rtol": 1e-6, "atol": 1e-6}
+
+# Metrics of the benchmark, in the order their callbacks are called (see metric_classes)
+METRIC_NAMES = ["KinematicDisarrangement", "LogicalDisarrangement", "RobotMetric", "TaskMetric"]
+
+# Metrics with an implementation that supports change-driven evaluation
+INCREMENTAL_METRICS = ["KinematicDisarrangement"]
+
+# Metrics that support a sampling stride. LogicalDisarrangement caches the logical state at a fixed simulator frame,
+# RobotMetric sums the distance traveled at every step and TaskMetric counts the steps, so they run every step
+STRIDED_METRICS = ["KinematicDisarrangement"]
+
+# Every metric is evaluated every step unless a schedule is given. "on_change" relies on the sleep state of the bodies
+# in pybullet, which bodies moved kinematically (e.g. with resetBasePositionAndOrientation) can keep, so it is opt-in
+DEFAULT_METRIC_SCHEDULES = {}
+
+
+def get_metric_class(name, incremental=False):
+    """
+    Import the class of a metric. The metric classes import iGibson, so they are only imported when the metrics of an
+    episode are created
+    :param name: Name of the metric in METRIC_NAMES
+    :param incremental: Whether to get the implementation that supports change-driven evaluation
+    :return: Class of the metric
+    """
+    from behavior.benchmark.metric_classes import INCREMENTAL_METRIC_CLASSES, METRIC_CLASSES
+
+    if incremental:
+        return INCREMENTAL_METRIC_CLASSES[name]
+    return METRIC_CLASSES[name]
+
+
+def parse_schedule(schedule):
+    """
+    :param schedule: "every_step", "on_change" or "stride:N"
+    :return: Tuple of (mode, stride)
+    """
+    if schedule.startswith(STRIDE + ":"):
+        stride = int(schedule[len(STRIDE) + 1 :])
+        assert stride > 0, "The stride of a metric schedule must be positive"
+        return (STRIDE, stride) if stride > 1 else (EVERY_STEP, 1)
+    assert schedule in [EVERY_STEP, ON_CHANGE], "Unknown metric schedule {}".format(schedule)
+    return schedule, 1
+
+
+def get_metric_schedules(metric_schedules=None):
+    """
+    Complete and validate the schedules of the metrics
+    :param metric_schedules: Dictionary of metric name to schedule overriding DEFAULT_METRIC_SCHEDULES
+    :return: Ordered dictionary of metric name to schedule, for all the metrics of the benchmark
+    """
+    schedules = OrderedDict()
+    for name in METRIC_NAMES:
+        schedules[name] = DEFAULT_METRIC_SCHEDULES.get(name, EVERY_STEP)
+    for name, schedule in (metric_schedules or {}).items():
+        assert name in METRIC_NAMES, "Unknown metric {}".format(name)
+        mode, _ = parse_schedule(schedule)
+        assert mode != ON_CHANGE or name in INCREMENTAL_METRICS, "{} does not support {}".format(name, mode)
+        assert mode != STRIDE or name in STRIDED_METRICS, "{} does not support {}".format(name, mode)
+        schedules[name] = schedule
+    return schedules
+
+
+class ScheduledMetric(object):
+    """
+    Metric whose step callback is only evaluated at the steps given by its schedule
+    The first and the final steps of an episode are always evaluated
+    """
+
+    def __init__(self, name, schedule):
+        """
+        Constructor
+        :param name: Name of the metric in METRIC_NAMES
+        :param schedule: Schedule of the metric (see parse_schedule)
+        """
+        self.name = name
+        self.schedule = schedule
+        self.mode, self.stride = parse_schedule(schedule)
+        self.metric = get_metric_class(name, incremental=self.mode == ON_CHANGE)()
+        self.num_steps = 0
+        self.last_evaluated_step = 0
+
+    def start_callback(self, env, log_reader):
+        self.metric.start_callback(env, log_reader)
+
+    def step_callback(self, env, log_reader, final_step=False):
+        """
+        :param final_step: Whether this is the last step of the episode
+        """
+        self.num_steps += 1
+        if final_step or (self.num_steps - 1) % self.stride == 0:
+            self.metric.step_callback(env, log_reader)
+            self.last_evaluated_step = self.num_steps
+
+    def end_callback(self, env, log_reader):
+        # Evaluate the final state if the episode ended without flagging its final step
+        if self.last_evaluated_step < self.num_steps:
+            self.metric.step_callback(env, log_reader)
+            self.last_evaluated_step = self.num_steps
+        self.metric.end_callback(env, log_reader)
+
+    def gather_results(self):
+        return self.metric.gather_results()
+
+
+def create_metrics(metric_schedules=None):
+    """
+    :param metric_schedules: Dictionary of metric name to schedule overriding DEFAULT_METRIC_SCHEDULES
+    :return: List of ScheduledMetric, one per metric of the benchmark
+    """
+    return [ScheduledMetric(name, schedule) for name, schedule in get_metric_schedules(metric_schedules).items()]
+
+
+def create_reference_metrics(metric_schedules):
+    """
+    :param metric_schedules: Dictionary of metric name to schedule
+    :return: List of metrics to evaluate every step, one per metric whose schedule is not "every_step"
+    """
+    return [
+        get_metric_class(name)()
+        for name, schedule in metric_schedules.items()
+        if parse_schedule(schedule)[0] != EVERY_STEP
+    ]
+
+
+def verify_metric_results(metrics_summary, reference_results):
+    """
+    Compare the aggregated benchmark values of an episode with the ones computed with every-step reference metrics
+    :param metrics_summary: Metrics summary of the episode computed with the scheduled metrics
+    :param reference_results: Results gathered from the reference metrics
+    :return: Dictionary of benchmark value name to (scheduled value, reference value, whether within METRIC_TOLERANCE)
+    """
+    reference_summary = dict(metrics_summary)
+    reference_summary.update(reference_results)
+    verification = OrderedDict()
+    reference_values = get_episode_values(reference_summary)
+    for name, value in get_episode_values(metrics_summary).items():
+        reference_value = reference_values[name]
+        within_tolerance = bool(np.isclose(value, reference_value, **METRIC_TOLERANCE))
+        if not within_tolerance:
+            log.warning(
+                "{} computed with the metric schedules ({}) differs from the every-step value ({})".format(
+                    name, value, reference_value
+                )
+            )
+        verification[name] = (float(value), float(reference_value), within_tolerance)
+    return verification
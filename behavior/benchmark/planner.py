@@ -0,0 +1,96 @@
+"""
+Cost model and longest-processing-time-first scheduling of the benchmark episodes
+"""
+import heapq
+import logging
+
+log = logging.getLogger(__name__)
+
+# Estimates used until the result store has measurements of previous episodes
+DEFAULT_LOAD_TIME = 60.0  # Seconds to load a scene and an activity instance
+DEFAULT_STEP_TIME = 0.1  # Seconds per action step (agent, simulation, rendering and metrics)
+
+
+class EpisodeCostModel(object):
+    """
+    Estimates the wall-clock time of an episode as the time to load its scene plus its maximum number of steps (twice
+    the mean length of the human demonstrations of the activity) times the time per step
+    """
+
+    def __init__(self, scene_load_times=None, step_time=None):
+        """
+        Constructor
+        :param scene_load_times: Dictionary of scene_id to measured load time in seconds
+        :param step_time: Measured time per action step in seconds
+        """
+        self.scene_load_times = scene_load_times if scene_load_times is not None else {}
+        self.step_time = step_time if step_time is not None else DEFAULT_STEP_TIME
+        if len(self.scene_load_times) > 0:
+            self.default_load_time = sum(self.scene_load_times.values()) / len(self.scene_load_times)
+        else:
+            self.default_load_time = DEFAULT_LOAD_TIME
+
+    @classmethod
+    def from_result_store(cls, result_store):
+        """
+        Create a cost model from the times measured in previous episodes
+        :param result_store: ResultStore with the results of previous runs
+        """
+        scene_load_times, step_time = result_store.get_timing_statistics()
+        return cls(scene_load_times, step_time)
+
+    def estimate(self, scene_id, max_step):
+        """
+        :return: Estimated wall-clock time of an episode in seconds
+        """
+        return self.scene_load_times.get(scene_id, self.default_load_time) + max_step * self.step_time
+
+
+def schedule_longest_first(costs, num_workers):
+    """
+    Longest-processing-time-first schedule: episodes are sorted by decreasing cost and each one is assigned to the
+    worker that becomes idle first. Dispatching the episodes in this order to a pool of workers reproduces the schedule
+    :param costs: List of estimated costs of the episodes
+    :param num_workers: Number of workers
+    :return: Tuple of (order of the episodes, list of (worker, start, end) per episode, predicted makespan)
+    """
+    order = sorted(range(len(costs)), key=lambda idx: (-costs[idx], idx))
+    workers = [(0.0, worker) for worker in range(max(num_workers, 1))]
+    heapq.heapify(workers)
+    assignment = [None] * len(costs)
+    makespan = 0.0
+    for idx in order:
+        start, worker = heapq.heappop(workers)
+        end = start + costs[idx]
+        assignment[idx] = (worker, start, end)
+        makespan = max(makespan, end)
+        heapq.heappush(workers, (end, worker))
+    return order, assignment, makespan
+
+
+def print_plan(episodes, costs, num_workers):
+    """
+    Print the schedule of an evaluation plan and its predicted makespan
+    :param episodes: List of pairs (episode index, arguments of BehaviorBenchmark.evaluate_episode)
+    :param costs: List of estimated costs of the episodes
+    :param num_workers: Number of workers
+    """
+    order, assignment, makespan = schedule_longest_first(costs, num_workers)
+    print("{:>8} {:>6} {:>10} {:>10} {:>10}  {}".format("episode", "worker", "cost[s]", "start[s]", "end[s]", "task"))
+    for idx in order:
+        episode, episode_args = episodes[idx]
+        task, scene_id, instance_id, episode_id = episode_args[:4]
+        worker, start, end = assignment[idx]
+        print(
+            "{:>8} {:>6} {:>10.1f} {:>10.1f} {:>10.1f}  {} {} instance {} episode {}".format(
+                episode, worker, costs[idx], start, end, task, scene_id, instance_id, episode_id
+            )
+        )
+    total_cost = sum(costs)
+    print("Episodes: {}, workers: {}".format(len(episodes), max(num_workers, 1)))
+    print("Total estimated cost: {:.1f}s".format(total_cost))
+    print(
+        "Predicted makespan: {:.1f}s (lower bound {:.1f}s)".format(
+            makespan, max(total_cost / max(num_workers, 1), max(costs) if len(costs) > 0 else 0.0)
+        )
+    )
@@ -0,0 +1,192 @@
+"""
+Per-step latency instrumentation of the benchmark episodes
+"""
+import json
+import logging
+import multiprocessing
+import os
+import time
+import traceback
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+PERCENTILES = [50, 90, 99]
+
+# Methods of iGibsonEnv timed by the profiler, if the environment has them: the step and its stages
+ENV_STEP_STAGES = OrderedDict(
+    [
+        ("step", "env.step"),
+        ("run_simulation", "env.step.physics"),
+        ("get_state", "env.step.observations"),
+    ]
+)
+
+
+class StepProfiler(object):
+    """
+    Records the duration of each stage of every step of an episode (agent, environment step, metric callbacks) and
+    optionally a timeline in the Chrome trace event format (chrome://tracing or https://ui.perfetto.dev)
+    """
+
+    def __init__(self, trace=False):
+        """
+        Constructor
+        :param trace: Whether to keep the timeline of all the recorded events
+        """
+        self.durations = OrderedDict()
+        self.trace_events = [] if trace else None
+        self.origin = time.perf_counter()
+        self.wrapped_envs = []
+
+    def add(self, name, duration, start=None):
+        """
+        Add a measured duration
+        :param name: Name of the stage
+        :param duration: Duration in seconds
+        :param start: perf_counter time at which the stage started, used for the timeline
+        """
+        self.durations.setdefault(name, []).append(duration)
+        if self.trace_events is not None and start is not None:
+            self.trace_events.append(
+                {
+                    "name": name,
+                    "cat": name.split(".")[0],
+                    "ph": "X",
+                    "ts": (start - self.origin) * 1e6,
+                    "dur": duration * 1e6,
+                    "pid": os.getpid(),
+                    "tid": 0,
+                }
+            )
+
+    @contextmanager
+    def record(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, start)
+
+    def wrap(self, name, function):
+        """
+        :return: Function that records the duration of every call to the given function
+        """
+
+        def timed_function(*args, **kwargs):
+            with self.record(name):
+                return function(*args, **kwargs)
+
+        return timed_function
+
+    def instrument_env(self, env):
+        """
+        Time env.step and its stages separately (physics and observations/rendering) by wrapping the methods of the
+        environment instance. Undone by restore_env
+        """
+        for method, name in ENV_STEP_STAGES.items():
+            if hasattr(env, method):
+                setattr(env, method, self.wrap(name, getattr(env, method)))
+        self.wrapped_envs.append(env)
+
+    def restore_env(self):
+        for env in self.wrapped_envs:
+            for method in ENV_STEP_STAGES.keys():
+                # Removing the instance attribute exposes the method of the class again
+                if method in env.__dict__:
+                    delattr(env, method)
+        self.wrapped_envs = []
+
+    def total(self, name):
+        return float(np.sum(self.durations.get(name, [])))
+
+    def summary(self):
+        """
+        :return: Dictionary of stage name to statistics of its durations in seconds (count, mean, percentiles, max)
+        """
+        summary = OrderedDict()
+        for name, durations in self.durations.items():
+            durations = np.asarray(durations)
+            stats = OrderedDict([("count", len(durations)), ("total", float(np.sum(durations)))])
+            stats["mean"] = float(np.mean(durations))
+            for percentile, value in zip(PERCENTILES, np.percentile(durations, PERCENTILES)):
+                stats["p{}".format(percentile)] = float(value)
+            stats["max"] = float(np.max(durations))
+            summary[name] = stats
+        return summary
+
+    def save_trace(self, path):
+        """
+        Save the timeline in the Chrome trace event format
+        :param path: Path of the JSON file
+        """
+        assert self.trace_events is not None, "The profiler was created without tracing"
+        with open(path, "w+") as f:
+            json.dump({"traceEvents": self.trace_events, "displayTimeUnit": "ms"}, f)
+
+
+def _measure_environment(create_env, env_config, num_steps, agent_factory, conn):
+    try:
+        agent = agent_factory() if agent_factory is not None else None
+        start_time = time.perf_counter()
+        env = create_env(env_config)
+        load_time = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        state = env.reset()
+        reset_time = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        for _ in range(num_steps):
+            action = agent.act(state) if agent is not None else env.action_space.sample()
+            state, _, _, _ = env.step(action)
+        steps_per_second = num_steps / (time.perf_counter() - start_time)
+        env.close()
+        measurements = OrderedDict(
+            [("load_time", load_time), ("reset_time", reset_time), ("steps_per_second", steps_per_second)]
+        )
+        conn.send((measurements, None))
+    except Exception:
+        conn.send((None, traceback.format_exc()))
+    conn.close()
+
+
+def measure_environment(create_env, env_config, num_steps, agent_factory=None):
+    """
+    Measure the time to create and reset an environment and its throughput (without metrics)
+    The environment is created in a forked process, so that no simulator is loaded in the calling process
+    :param create_env: Function that creates an environment from a config
+    :param env_config: Environment config
+    :param num_steps: Number of steps to measure
+    :param agent_factory: Function without arguments that creates the agent choosing the actions. If None, the actions
+        are sampled from the action space
+    :return: Ordered dictionary with the load and reset times in seconds and the steps per second
+    """
+    context = multiprocessing.get_context("fork")
+    parent_conn, child_conn = context.Pipe()
+    process = context.Process(
+        target=_measure_environment, args=(create_env, env_config, num_steps, agent_factory, child_conn)
+    )
+    process.start()
+    child_conn.close()
+    try:
+        measurements, error = parent_conn.recv()
+    except EOFError:
+        measurements, error = None, "the process died (exit code {})".format(process.exitcode)
+    process.join()
+    if error is not None:
+        raise RuntimeError("Failed to measure the throughput of the environment:\n{}".format(error))
+    return measurements
+
+
+def measure_steps_per_second(create_env, env_config, num_steps):
+    """
+    Measure the throughput of an environment stepped with random actions (without agent and metrics)
+    The environment is created in a forked process, so that no simulator is loaded in the calling process
+    :param create_env: Function that creates an environment from a config
+    :param env_config: Environment config
+    :param num_steps: Number of steps to measure
+    :return: Steps per second
+    """
+    return measure_environment(create_env, env_config, num_steps)["steps_per_second"]
@@ -0,0 +1,120 @@
+"""
+Recompute the metrics of recorded benchmark episodes by replaying their actions, without the agent
+"""
+import argparse
+import glob
+import logging
+import os
+
+from behavior.benchmark.aggregation import save_results
+from behavior.benchmark.behavior_benchmark import BehaviorBenchmark
+from behavior.benchmark.run_options import RunOptions
+from behavior.benchmark.trajectory import load_trajectory
+
+log = logging.getLogger(__name__)
+
+# Observations computed while replaying. The metrics do not use the observations, so nothing is rendered
+REPLAY_OUTPUT = ["proprioception"]
+
+
+def rescore(trajectory_dirs, output_dir, metric_schedules=None, env_cache_size=0):
+    """
+    Replay the recorded episodes headless with the same seeds and actions, and save their per-episode and aggregated
+    metrics. The agents evaluated in the benchmark process draw their random numbers apart from the environment (see
+    AgentRandomState), so the replay without the agent reproduces the episodes. The episodes are numbered in the order
+    of the evaluation plan (activity, scene, instance, episode), which is the numbering of the original run if all its
+    episodes were recorded
+    :param trajectory_dirs: Directories with trajectory files (OUTPUT_DIR/trajectories of the recorded runs)
+    :param output_dir: Directory to save the recomputed results in
+    :param metric_schedules: Dictionary of metric name to schedule (see metric_scheduling)
+    :param env_cache_size: Number of loaded environments kept between the replayed episodes. The default creates a
+        new environment per episode, as the default of the benchmark runs. Replaying from an environment in another
+        state than the recorded episode can change its metrics
+    :return: Dictionary of episode index to recomputed metrics summary
+    """
+    trajectories = []
+    for trajectory_dir in trajectory_dirs:
+        for path in glob.glob(os.path.join(trajectory_dir, "*.hdf5")):
+            attributes, actions = load_trajectory(path)
+            key = (attributes["task"], attributes["scene_id"], attributes["instance_id"], attributes["episode_id"])
+            trajectories.append((key, path, attributes, actions))
+    trajectories.sort(key=lambda trajectory: trajectory[0])
+    print("Replaying {} recorded episodes".format(len(trajectories)))
+
+    # The environment configuration of each episode is recorded in its trajectory
+    benchmark = BehaviorBenchmark(
+        None,
+        env_config_file=None,
+        output_dir=output_dir,
+        split="rescore",
+        options=RunOptions(env_cache_size=env_cache_size, metric_schedules=metric_schedules),
+    )
+    os.makedirs(output_dir, exist_ok=True)
+    per_episode_metrics = {}
+    for episode, ((task, scene_id, instance_id, episode_id), path, attributes, actions) in enumerate(trajectories):
+        recorded_cache_size = int(attributes.get("env_cache_size", 0))
+        if (recorded_cache_size > 0) != (env_cache_size > 0):
+            log.warning(
+                "{} was recorded with an environment cache of size {} and is replayed with {}, the replay may "
+                "start from a different state".format(path, recorded_cache_size, env_cache_size)
+            )
+        env_config = attributes["env_config"]
+        env_config["output"] = REPLAY_OUTPUT
+        benchmark.start_episode(task, scene_id, instance_id, episode_id, env_config, seed=int(attributes["seed"]))
+        done = False
+        num_steps = 0
+        for action in actions:
+            _, done = benchmark.step_episode(action)
+            num_steps += 1
+            if done:
+                break
+        if not done or num_steps != attributes["num_steps"]:
+            log.warning(
+                "The replay of {} ended after {} out of {} recorded steps, it may not be deterministic".format(
+                    path, num_steps, attributes["num_steps"]
+                )
+            )
+        per_episode_metrics[episode] = benchmark.end_episode()
+    benchmark.close_environments()
+
+    if len(per_episode_metrics) == 0:
+        print("No recorded episodes to rescore")
+        return per_episode_metrics
+    log_file, summary_log_file = save_results(output_dir, per_episode_metrics)
+    print("Rescored per episode eval results saved to %s" % log_file)
+    print("Rescored aggregated eval results saved to %s" % summary_log_file)
+    return per_episode_metrics
+
+
+def main():
+    """
+    Entry point to recompute the metrics of recorded episodes (see --record-trajectories of behavior_benchmark)
+    """
+    parser = argparse.ArgumentParser(description="Recompute the metrics of recorded benchmark episodes")
+    parser.add_argument("trajectory_dirs", nargs="+", type=str, help="directories with the recorded trajectories")
+    parser.add_argument("--output-dir", required=True, type=str, help="directory to save the recomputed results in")
+    parser.add_argument(
+        "--metric-schedule",
+        default=[],
+        action="append",
+        type=str,
+        help="schedule of the step callback of a metric as NAME=every_step|on_change|stride:N (can be repeated)",
+    )
+    parser.add_argument(
+        "--env-cache-size",
+        default=0,
+        type=int,
+        help="number of loaded environments kept between the replayed episodes (0 creates one per episode, as the "
+        "default of the benchmark)",
+    )
+    args = parser.parse_args()
+    rescore(
+        args.trajectory_dirs,
+        args.output_dir,
+        metric_schedules=dict(schedule.split("=", 1) for schedule in args.metric_schedule),
+        env_cache_size=args.env_cache_size,
+    )
+
+
+if __name__ == "__main__":
+    main()
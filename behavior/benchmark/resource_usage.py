@@ -0,0 +1,50 @@
+"""
+Helpers to measure the resources used by the benchmark process
+"""
+import logging
+import os
+import resource
+
+log = logging.getLogger(__name__)
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def get_rss_mb():
+    """
+    Resident set size of the current process
+    Uses psutil if available and falls back to /proc (Linux) or the peak RSS reported by getrusage
+    :return: Resident memory of the process in MB
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 1024.0**2
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024.0**2
+    except (IOError, OSError, ValueError):
+        # Peak RSS is in KB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def get_num_fds():
+    """
+    Number of open file descriptors of the current process (also counts EGL/GPU device handles)
+    :return: Number of open file descriptors, or None if it cannot be measured
+    """
+    if psutil is not None and hasattr(psutil.Process, "num_fds"):
+        return psutil.Process().num_fds()
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except (IOError, OSError):
+        return None
+
+
+def sample_resources():
+    """
+    :return: Dictionary with the resident memory in MB (rss_mb) and the number of open file descriptors (num_fds) of
+        the current process
+    """
+    return {"rss_mb": get_rss_mb(), "num_fds": get_num_fds()}
@@ -0,0 +1,285 @@
+"""
+SQLite store of benchmark results accumulating the episodes of all activities and runs
+"""
+import argparse
+import datetime
+import json
+import logging
+import math
+import sqlite3
+
+from behavior.benchmark.aggregation import EPISODE_METRICS, TOP_ACTIVITIES, get_episode_values
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started TEXT NOT NULL,
+    split TEXT,
+    env_config_file TEXT
+);
+CREATE TABLE IF NOT EXISTS episodes (
+    run_id INTEGER NOT NULL,
+    task TEXT NOT NULL,
+    scene_id TEXT NOT NULL,
+    instance_id INTEGER NOT NULL,
+    episode_id INTEGER NOT NULL,
+    metrics TEXT NOT NULL,
+    PRIMARY KEY (run_id, task, scene_id, instance_id, episode_id)
+);
+CREATE INDEX IF NOT EXISTS episodes_by_task ON episodes (task);
+CREATE TABLE IF NOT EXISTS task_aggregates (
+    run_id INTEGER NOT NULL,
+    task TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    mean REAL NOT NULL,
+    m2 REAL NOT NULL,
+    PRIMARY KEY (run_id, task, metric)
+);
+CREATE TABLE IF NOT EXISTS failed_episodes (
+    run_id INTEGER NOT NULL,
+    task TEXT NOT NULL,
+    scene_id TEXT NOT NULL,
+    instance_id INTEGER NOT NULL,
+    episode_id INTEGER NOT NULL,
+    reason TEXT NOT NULL,
+    PRIMARY KEY (run_id, task, scene_id, instance_id, episode_id)
+);
+CREATE TABLE IF NOT EXISTS scene_timings (
+    scene_id TEXT NOT NULL,
+    timing TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    mean REAL NOT NULL,
+    PRIMARY KEY (scene_id, timing)
+);
+"""
+
+
+class ResultStore(object):
+    """
+    Indexed SQLite file with every evaluated episode and running aggregates of the benchmark metrics
+    The aggregates are updated online (Welford's algorithm) per run, activity and metric when an episode is added, so
+    summarizing a run only reads one row per activity and metric instead of reloading all the episodes.
+    The running means agree with the batch aggregation of aggregate_metrics up to floating point rounding (relative
+    error around 1e-12); the official aggregated_metrics.json is still computed with aggregate_metrics.
+    """
+
+    def __init__(self, path):
+        """
+        Constructor
+        :param path: Path of the SQLite file. It is created if it does not exist
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def start_run(self, split="", env_config_file=""):
+        """
+        Register a new run
+        :return: Identifier of the run
+        """
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO runs (started, split, env_config_file) VALUES (?, ?, ?)",
+                (datetime.datetime.now().isoformat(), str(split), env_config_file),
+            )
+        return cursor.lastrowid
+
+    def get_last_run(self):
+        """
+        :return: Identifier of the last registered run, or None if there are none
+        """
+        row = self.connection.execute("SELECT MAX(run_id) FROM runs").fetchone()
+        return row[0]
+
+    def add_episode(self, run_id, task, scene_id, instance_id, episode_id, metrics):
+        """
+        Add an episode to a run and update the running aggregates. Adding an episode twice has no effect
+        :param metrics: Metrics summary of the episode
+        :return: Whether the episode was added
+        """
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT OR IGNORE INTO episodes (run_id, task, scene_id, instance_id, episode_id, metrics) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (run_id, task, scene_id, int(instance_id), int(episode_id), json.dumps(metrics)),
+            )
+            if cursor.rowcount == 0:
+                log.debug("Episode {} already in the result store".format((task, scene_id, instance_id, episode_id)))
+                return False
+            for metric, value in get_episode_values(metrics).items():
+                self._update_aggregate(run_id, task, metric, float(value))
+            self._update_timings(scene_id, metrics)
+            self.connection.execute(
+                "DELETE FROM failed_episodes WHERE run_id = ? AND task = ? AND scene_id = ? AND instance_id = ? "
+                "AND episode_id = ?",
+                (run_id, task, scene_id, int(instance_id), int(episode_id)),
+            )
+        return True
+
+    def add_failed_episode(self, run_id, task, scene_id, instance_id, episode_id, reason):
+        """
+        Record an episode of a run that failed (e.g. its worker hung or died). It does not count in the aggregates
+        :param reason: Reason of the failure
+        """
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO failed_episodes (run_id, task, scene_id, instance_id, episode_id, reason) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (run_id, task, scene_id, int(instance_id), int(episode_id), reason),
+            )
+
+    def get_failed_episodes(self, run_id):
+        """
+        :return: List of (task, scene_id, instance_id, episode_id, reason) of the failed episodes of a run
+        """
+        return self.connection.execute(
+            "SELECT task, scene_id, instance_id, episode_id, reason FROM failed_episodes WHERE run_id = ? "
+            "ORDER BY task, scene_id, instance_id, episode_id",
+            (run_id,),
+        ).fetchall()
+
+    def _update_timings(self, scene_id, metrics):
+        """
+        Update the running means of the wall-clock times of the scene (across all runs), used to plan evaluations
+        """
+        if "benchmark_time" not in metrics:
+            return
+        benchmark_time = metrics["benchmark_time"]
+        timings = {}
+        if not benchmark_time["env_reused"]:
+            timings["env_load"] = benchmark_time["env_load"]
+        if benchmark_time["num_steps"] > 0:
+            step_time = benchmark_time["steps"] + benchmark_time.get("agent", 0.0)
+            timings["step"] = step_time / benchmark_time["num_steps"]
+        for timing, value in timings.items():
+            row = self.connection.execute(
+                "SELECT count, mean FROM scene_timings WHERE scene_id = ? AND timing = ?", (scene_id, timing)
+            ).fetchone()
+            count, mean = row if row is not None else (0, 0.0)
+            count += 1
+            mean += (value - mean) / count
+            self.connection.execute(
+                "INSERT OR REPLACE INTO scene_timings (scene_id, timing, count, mean) VALUES (?, ?, ?, ?)",
+                (scene_id, timing, count, mean),
+            )
+
+    def get_timing_statistics(self):
+        """
+        Wall-clock times measured in the episodes of all runs
+        :return: Tuple of (dictionary of scene_id to mean load time, mean time per step or None if not measured)
+        """
+        scene_load_times = {}
+        step_count, step_total = 0, 0.0
+        for scene_id, timing, count, mean in self.connection.execute(
+            "SELECT scene_id, timing, count, mean FROM scene_timings"
+        ):
+            if timing == "env_load":
+                scene_load_times[scene_id] = mean
+            elif timing == "step":
+                step_count += count
+                step_total += count * mean
+        step_time = step_total / step_count if step_count > 0 else None
+        return scene_load_times, step_time
+
+    def _update_aggregate(self, run_id, task, metric, value):
+        row = self.connection.execute(
+            "SELECT count, mean, m2 FROM task_aggregates WHERE run_id = ? AND task = ? AND metric = ?",
+            (run_id, task, metric),
+        ).fetchone()
+        count, mean, m2 = row if row is not None else (0, 0.0, 0.0)
+        count += 1
+        delta = value - mean
+        mean += delta / count
+        m2 += delta * (value - mean)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO task_aggregates (run_id, task, metric, count, mean, m2) VALUES (?, ?, ?, ?, ?, ?)",
+            (run_id, task, metric, count, mean, m2),
+        )
+
+    def iterate_episodes(self, run_id, task=None):
+        """
+        Iterate the episodes of a run without loading all of them in memory
+        :param task: If given, only the episodes of this activity
+        :return: Generator of (task, scene_id, instance_id, episode_id, metrics summary)
+        """
+        query = "SELECT task, scene_id, instance_id, episode_id, metrics FROM episodes WHERE run_id = ?"
+        params = [run_id]
+        if task is not None:
+            query += " AND task = ?"
+            params.append(task)
+        query += " ORDER BY task, scene_id, instance_id, episode_id"
+        for task, scene_id, instance_id, episode_id, metrics in self.connection.execute(query, params):
+            yield task, scene_id, instance_id, episode_id, json.loads(metrics)
+
+    def summarize_tasks(self, run_id):
+        """
+        Running aggregates of each activity of a run
+        :return: Dictionary of activity to a dictionary of metric to (count, mean, standard deviation)
+        """
+        summary = {}
+        rows = self.connection.execute(
+            "SELECT task, metric, count, mean, m2 FROM task_aggregates WHERE run_id = ? ORDER BY task", (run_id,)
+        )
+        for task, metric, count, mean, m2 in rows:
+            std = math.sqrt(m2 / count) if count > 0 else 0.0
+            summary.setdefault(task, {})[metric] = (count, mean, std)
+        return summary
+
+    def summarize(self, run_id):
+        """
+        Aggregated benchmark metrics of a run, computed from the running aggregates of its activities
+        :return: Dictionary of aggregated metrics, with the same keys as aggregate_metrics plus the number of episodes
+            and failed episodes
+        """
+        task_summary = self.summarize_tasks(run_id)
+        aggregated_metrics = {}
+        num_failed = len(self.get_failed_episodes(run_id))
+        if len(task_summary) == 0:
+            if num_failed > 0:
+                aggregated_metrics["Failed Episodes"] = num_failed
+            return aggregated_metrics
+        task_scores = sorted([metrics["Success Score"][1] for metrics in task_summary.values()], reverse=True)
+        for metric in EPISODE_METRICS:
+            count = sum(metrics[metric][0] for metrics in task_summary.values())
+            total = sum(metrics[metric][0] * metrics[metric][1] for metrics in task_summary.values())
+            aggregated_metrics[metric] = total / count
+            if metric == "Success Score":
+                top_scores = task_scores[:TOP_ACTIVITIES]
+                aggregated_metrics["Success Score Top 5"] = sum(top_scores) / len(top_scores)
+        aggregated_metrics["Episodes"] = sum(metrics["Success Score"][0] for metrics in task_summary.values())
+        if num_failed > 0:
+            aggregated_metrics["Failed Episodes"] = num_failed
+        return aggregated_metrics
+
+
+def main():
+    """
+    Summarize the runs in a result store
+    """
+    parser = argparse.ArgumentParser(description="Summarize benchmark results stored in a SQLite result store")
+    parser.add_argument("store", type=str, help="path to the result store")
+    parser.add_argument("--run", type=int, default=None, help="run to summarize (default: last run)")
+    parser.add_argument("--per-activity", action="store_true", help="also print the aggregates of each activity")
+    args = parser.parse_args()
+
+    store = ResultStore(args.store)
+    run_id = args.run if args.run is not None else store.get_last_run()
+    if run_id is None:
+        print("The result store {} does not contain any run".format(args.store))
+        return
+    print("Run {}".format(run_id))
+    print(json.dumps(store.summarize(run_id), indent=4))
+    if args.per_activity:
+        print(json.dumps(store.summarize_tasks(run_id), indent=4))
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
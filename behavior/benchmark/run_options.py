@@ -0,0 +1,303 @@
+"""
+Options of a benchmark run: how the planned episodes are executed (workers, lockstep environments, environment cache,
+shards, timeouts), seeded, recorded and measured, and how many episodes are added per activity instance
+"""
+from behavior.benchmark.metric_scheduling import get_metric_schedules
+
+
+class RunOptions(object):
+    """
+    Options of a run of BehaviorBenchmark. The defaults evaluate the episodes one by one in the main process, as the
+    original benchmark
+    """
+
+    def __init__(
+        self,
+        num_workers=0,
+        env_cache_size=0,
+        env_cache_memory_mb=None,
+        resume=False,
+        result_store_path="",
+        shard_index=0,
+        num_shards=1,
+        dry_run=False,
+        batch_envs=0,
+        trace_episode=None,
+        metric_schedules=None,
+        verify_metrics=False,
+        episode_timeout=None,
+        recycle_worker_episodes=0,
+        recycle_worker_memory_mb=None,
+        record_trajectories=False,
+        seed=0,
+        restrict_outputs=True,
+        calibration_steps=0,
+        target_ci_width=None,
+        max_episodes_per_instance=10,
+        plan_file="",
+        action_repeat=1,
+    ):
+        """
+        Constructor
+        :param num_workers: Number of worker processes to evaluate episodes in parallel. Each worker owns a copy of the
+            agent and its own simulator. If 0, the episodes are evaluated sequentially in the main process
+        :param env_cache_size: Number of loaded environments kept between episodes (per process), keyed by scene, robot
+            and modalities. If 0, a new environment is created and closed for every episode
+        :param env_cache_memory_mb: Resident memory (in MB) above which cached environments are evicted
+        :param resume: Whether to skip the episodes already recorded in the episode log of the output directory
+        :param result_store_path: SQLite file accumulating the results of all activities and runs. If empty, a file in
+            the output directory
+        :param shard_index: Index of the shard of the evaluation plan to evaluate
+        :param num_shards: Number of shards the evaluation plan is partitioned in. Episode i of the plan belongs to shard
+            i % num_shards. Use merge_results to combine the outputs of the shards
+        :param dry_run: If True, evaluate_agent only prints the planned episodes and the predicted makespan
+        :param batch_envs: Number of environments stepped in lockstep, each one in its own process, querying the agent
+            once per step for all of them with act_slots. If 0, episodes are evaluated one by one. Not compatible with
+            num_workers
+        :param trace_episode: Index in the evaluation plan of an episode whose full timeline of step timings is saved in
+            the output directory in the Chrome trace event format
+        :param metric_schedules: Dictionary of metric name to schedule ("every_step", "on_change" or "stride:N") of its
+            step callback, overriding the defaults of metric_scheduling
+        :param verify_metrics: Whether to also evaluate every step the metrics that are not, and report in each episode
+            if the benchmark values computed with the schedules are within the tolerance of metric_scheduling
+        :param episode_timeout: Wall-clock budget of an episode in seconds. If given, the episodes are evaluated in
+            supervised worker processes (at least one); an episode that exceeds the budget or kills its worker is
+            recorded as failed and the evaluation continues with a new worker. In worker processes, an episode that
+            raises an exception is recorded as failed as well. Not compatible with batch_envs
+        :param recycle_worker_episodes: Number of episodes after which a worker process is replaced by a new one. If
+            given, the episodes are evaluated in worker processes (at least one). If 0, workers are not recycled
+        :param recycle_worker_memory_mb: Growth of the resident memory of a worker (in MB, since the end of its first
+            episode) above which it is replaced by a new one. If given, the episodes are evaluated in worker processes
+        :param record_trajectories: Whether to record the actions of each episode in the output directory, to recompute
+            the metrics offline with rescore
+        :param seed: Base seed of the episodes. Each episode seeds the random number generators with a seed derived from
+            this one and its activity, scene, instance and episode id
+        :param restrict_outputs: Whether to only compute the observations used by the agent (see
+            Agent.get_observation_keys) instead of all the ones in the output list of the environment config
+        :param calibration_steps: If positive, number of steps used to measure the throughput of the environment with
+            all the observations of the config and with the ones used by the agent, before the evaluation
+        :param target_ci_width: If given, episodes are added to each activity instance until the width of the 95%
+            confidence interval of its mean success score (q_score.final) is at most this value, or the instance has
+            max_episodes_per_instance episodes. The confidence intervals are reported in the aggregated metrics. Not
+            compatible with num_shards
+        :param max_episodes_per_instance: Maximum number of episodes per activity instance with target_ci_width
+        :param plan_file: Compiled evaluation plan (see evaluation_plan), compiled and saved if it does not exist. If
+            empty, the plan is compiled from the bddl and iGibson dataset trees
+        :param action_repeat: Number of steps of the environment each action of the agent is repeated for. The
+            observations are only computed in the last one, and the metrics are evaluated at every step
+        """
+        assert batch_envs <= 0 or num_workers <= 0, "Lockstep evaluation is not compatible with the worker pool"
+        assert batch_envs <= 0 or episode_timeout is None, "Lockstep evaluation does not support episode timeouts"
+        assert batch_envs <= 0 or (
+            recycle_worker_episodes <= 0 and recycle_worker_memory_mb is None
+        ), "Lockstep evaluation does not support recycling workers"
+        assert 0 <= shard_index < num_shards, "Invalid shard {} out of {}".format(shard_index, num_shards)
+        assert target_ci_width is None or num_shards == 1, "Sequential evaluation needs all the episodes of an instance"
+        assert action_repeat >= 1, "The action repeat must be at least 1"
+        self.num_workers = num_workers
+        self.env_cache_size = env_cache_size
+        self.env_cache_memory_mb = env_cache_memory_mb
+        self.resume = resume
+        self.result_store_path = result_store_path
+        self.shard_index = shard_index
+        self.num_shards = num_shards
+        self.dry_run = dry_run
+        self.batch_envs = batch_envs
+        self.trace_episode = trace_episode
+        self.metric_schedules = get_metric_schedules(metric_schedules)
+        self.verify_metrics = verify_metrics
+        self.episode_timeout = episode_timeout
+        self.recycle_worker_episodes = recycle_worker_episodes
+        self.recycle_worker_memory_mb = recycle_worker_memory_mb
+        self.record_trajectories = record_trajectories
+        self.seed = seed
+        self.restrict_outputs = restrict_outputs
+        self.calibration_steps = calibration_steps
+        self.target_ci_width = target_ci_width
+        self.max_episodes_per_instance = max_episodes_per_instance
+        self.plan_file = plan_file if plan_file != "" else None
+        self.action_repeat = action_repeat
+
+    def supervise_episodes(self):
+        """
+        :return: Whether the episodes need to be evaluated in supervised worker processes even without num_workers
+        """
+        return (
+            self.episode_timeout is not None
+            or self.recycle_worker_episodes > 0
+            or self.recycle_worker_memory_mb is not None
+        )
+
+    @classmethod
+    def from_args(cls, args):
+        """
+        :param args: Command line arguments parsed with the arguments of add_run_arguments
+        :return: RunOptions of the arguments
+        """
+        return cls(
+            num_workers=args.num_workers,
+            env_cache_size=args.env_cache_size,
+            env_cache_memory_mb=args.env_cache_memory_mb,
+            resume=args.resume,
+            result_store_path=args.result_store,
+            shard_index=args.shard_index,
+            num_shards=args.num_shards,
+            dry_run=args.dry_run,
+            batch_envs=args.batch_envs,
+            trace_episode=args.trace_episode,
+            metric_schedules=dict(schedule.split("=", 1) for schedule in args.metric_schedule),
+            verify_metrics=args.verify_metrics,
+            episode_timeout=args.episode_timeout,
+            recycle_worker_episodes=args.recycle_worker_episodes,
+            recycle_worker_memory_mb=args.recycle_worker_memory_mb,
+            record_trajectories=args.record_trajectories,
+            seed=args.seed,
+            restrict_outputs=not args.all_outputs,
+            calibration_steps=args.calibration_steps,
+            target_ci_width=args.target_ci_width,
+            max_episodes_per_instance=args.max_episodes_per_instance,
+            plan_file=args.plan_file,
+            action_repeat=args.action_repeat,
+        )
+
+
+def add_run_arguments(parser):
+    """
+    Add the command line arguments of the run options (see RunOptions.from_args) to a parser
+    :param parser: argparse.ArgumentParser
+    """
+    parser.add_argument(
+        "--num-workers",
+        default=0,
+        type=int,
+        help="number of worker processes to evaluate episodes in parallel (0 evaluates them in the main process)",
+    )
+    parser.add_argument(
+        "--episode-timeout",
+        default=None,
+        type=float,
+        help="wall-clock budget of an episode in seconds; a worker exceeding it is killed and the episode fails",
+    )
+    parser.add_argument(
+        "--recycle-worker-episodes",
+        default=0,
+        type=int,
+        help="number of episodes after which a worker process is replaced by a new one (0 never replaces workers)",
+    )
+    parser.add_argument(
+        "--recycle-worker-memory-mb",
+        default=None,
+        type=float,
+        help="growth of the resident memory of a worker process in MB after which it is replaced by a new one",
+    )
+    parser.add_argument(
+        "--record-trajectories",
+        action="store_true",
+        help="record the actions of each episode in OUTPUT_DIR/trajectories to recompute the metrics with rescore",
+    )
+    parser.add_argument(
+        "--seed",
+        default=0,
+        type=int,
+        help="base seed of the episodes, combined with the activity, scene, instance and episode of each one",
+    )
+    parser.add_argument(
+        "--target-ci-width",
+        default=None,
+        type=float,
+        help="add episodes to each activity instance until the 95%% confidence interval of its success score is this "
+        "narrow",
+    )
+    parser.add_argument(
+        "--max-episodes-per-instance",
+        default=10,
+        type=int,
+        help="maximum number of episodes per activity instance with --target-ci-width",
+    )
+    parser.add_argument(
+        "--plan-file",
+        default="",
+        type=str,
+        help="compiled evaluation plan (see evaluation_plan), compiled and saved if it does not exist",
+    )
+    parser.add_argument(
+        "--action-repeat",
+        default=1,
+        type=int,
+        help="number of steps each action of the agent is repeated for, computing only the observation of the last one",
+    )
+    parser.add_argument(
+        "--all-outputs",
+        action="store_true",
+        help="compute all the observations of the environment config, instead of only the ones the agent uses",
+    )
+    parser.add_argument(
+        "--calibration-steps",
+        default=0,
+        type=int,
+        help="steps used to measure the throughput with all the observations and with the ones the agent uses",
+    )
+    parser.add_argument(
+        "--env-cache-size",
+        default=0,
+        type=int,
+        help="number of loaded environments kept between episodes by each process (0 creates one per episode)",
+    )
+    parser.add_argument(
+        "--env-cache-memory-mb",
+        default=None,
+        type=float,
+        help="resident memory in MB above which loaded environments are evicted from the cache",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip the episodes already recorded in the episode log of the output directory",
+    )
+    parser.add_argument(
+        "--shard-index",
+        default=0,
+        type=int,
+        help="index of the shard of the evaluation plan to evaluate",
+    )
+    parser.add_argument(
+        "--num-shards",
+        default=1,
+        type=int,
+        help="number of shards the evaluation plan is partitioned in (merge them with behavior.benchmark.merge_results)",
+    )
+    parser.add_argument(
+        "--batch-envs",
+        default=0,
+        type=int,
+        help="number of environments stepped in lockstep, querying the agent once per step for all of them",
+    )
+    parser.add_argument(
+        "--trace-episode",
+        default=None,
+        type=int,
+        help="index in the evaluation plan (see --dry-run) of an episode whose step timeline is saved as a Chrome trace",
+    )
+    parser.add_argument(
+        "--metric-schedule",
+        default=[],
+        action="append",
+        type=str,
+        help="schedule of the step callback of a metric as NAME=every_step|on_change|stride:N (can be repeated)",
+    )
+    parser.add_argument(
+        "--verify-metrics",
+        action="store_true",
+        help="also evaluate every step the scheduled metrics and report whether the results are within the tolerance",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="print the planned episodes, their schedule across workers and the predicted makespan without evaluating",
+    )
+    parser.add_argument(
+        "--result-store",
+        default="",
+        type=str,
+        help="SQLite file accumulating the results of all activities and runs (default: results.sqlite in OUTPUT_DIR)",
+    )
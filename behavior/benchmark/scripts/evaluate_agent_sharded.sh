@@ -0,0 +1,54 @@
+#!/usr/bin/env bash
+
+# Evaluates an agent on several shards of the benchmark launched as local processes and merges their results
+# CONFIG_FILE, OUTPUT_DIR and SPLIT are read from the environment as in evaluate_agent.sh
+# Extra arguments (e.g. "--agent-class Custom") are passed to every shard
+
+NUM_SHARDS=2
+EXTRA_ARGS=()
+
+while [[ $# -gt 0 ]]
+do
+key="${1}"
+
+case $key in
+      --num-shards)
+      shift
+      NUM_SHARDS="${1}"
+      shift
+      ;;
+    *) # argument for the benchmark
+      EXTRA_ARGS+=("${1}")
+      shift
+      ;;
+esac
+done
+
+# The evaluation plan is compiled once, so that the shards do not read the bddl and iGibson dataset trees
+PLAN_FILE=${OUTPUT_DIR}/evaluation_plan.json
+python -m behavior.benchmark.evaluation_plan ${PLAN_FILE} || exit 1
+
+SHARD_DIRS=()
+PIDS=()
+for ((SHARD_INDEX=0; SHARD_INDEX<NUM_SHARDS; SHARD_INDEX++))
+do
+  SHARD_DIR=${OUTPUT_DIR}/shard_${SHARD_INDEX}
+  mkdir -p ${SHARD_DIR}
+  SHARD_DIRS+=(${SHARD_DIR})
+  OUTPUT_DIR=${SHARD_DIR} python -m behavior.benchmark.behavior_benchmark --shard-index ${SHARD_INDEX} \
+      --num-shards ${NUM_SHARDS} --plan-file ${PLAN_FILE} "${EXTRA_ARGS[@]}" > ${SHARD_DIR}/benchmark.log 2>&1 &
+  PIDS+=($!)
+done
+
+FAILED=0
+for PID in "${PIDS[@]}"
+do
+  wait ${PID} || FAILED=1
+done
+
+if [[ ${FAILED} -ne 0 ]]; then
+  echo "At least one shard failed, check the benchmark.log files in ${OUTPUT_DIR}/shard_*"
+  exit 1
+fi
+
+python -m behavior.benchmark.merge_results --output-dir ${OUTPUT_DIR} "${SHARD_DIRS[@]}"
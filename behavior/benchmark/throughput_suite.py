@@ -0,0 +1,214 @@
+"""
+Throughput regression suite of the environment configurations: for each config of behavior/configs and set of
+observation modalities, measure the time to create and reset the environment and its steps per second with the random
+agent, save the results and compare them with a stored baseline
+Measure and store a baseline on the reference machine:
+    python -m behavior.benchmark.throughput_suite --baseline path/to/baseline.json --update-baseline
+and compare a later version against it:
+    python -m behavior.benchmark.throughput_suite --baseline path/to/baseline.json
+"""
+import argparse
+import copy
+import datetime
+import functools
+import json
+import logging
+import os
+import platform
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+import behavior
+from behavior.benchmark.behavior_benchmark import create_headless_env
+from behavior.benchmark.profiling import measure_environment
+
+log = logging.getLogger(__name__)
+
+# Version of the format of the results. Results with another version are not compared
+RESULTS_VERSION = 1
+
+# Sets of observation modalities measured for each config. None stands for the output list of the config. A set is only
+# measured if the config computes all its modalities
+MODALITY_SETS = OrderedDict(
+    [
+        ("config", None),
+        ("rgb", ["proprioception", "rgb"]),
+        ("proprioception", ["proprioception"]),
+    ]
+)
+
+# Measurements where a higher value is better. For the others (load and reset times) a lower value is better
+HIGHER_IS_BETTER = ["steps_per_second"]
+
+DEFAULT_THRESHOLD = 0.1
+
+
+def get_config_files(config_dir):
+    """
+    :return: Sorted list of the YAML config files in a directory
+    """
+    return sorted(os.path.join(config_dir, name) for name in os.listdir(config_dir) if name.endswith((".yaml", ".yml")))
+
+
+def create_random_agent(robot_type):
+    from behavior.benchmark.agents.random_agent import RandomAgent
+
+    return RandomAgent(robot_type=robot_type)
+
+
+def measure_config(config_file, num_steps, repetitions):
+    """
+    Measure an environment config with each set of modalities it supports
+    :param config_file: YAML config file
+    :param num_steps: Number of steps measured per repetition
+    :param repetitions: Number of times each environment is created, reset and stepped. The median is reported
+    :return: Ordered dictionary of modality set to ordered dictionary of measurement name to value
+    """
+    from igibson.utils.utils import parse_config
+
+    env_config = parse_config(config_file)
+    agent_factory = functools.partial(create_random_agent, env_config["robot"]["name"])
+    results = OrderedDict()
+    for modality_set, outputs in MODALITY_SETS.items():
+        if outputs is None:
+            outputs = env_config["output"]
+        elif not set(outputs).issubset(env_config["output"]) or outputs == env_config["output"]:
+            continue
+        measure_env_config = copy.deepcopy(env_config)
+        measure_env_config["output"] = outputs
+        measurements = [
+            measure_environment(create_headless_env, measure_env_config, num_steps, agent_factory=agent_factory)
+            for _ in range(repetitions)
+        ]
+        results[modality_set] = OrderedDict(
+            [(name, float(np.median([m[name] for m in measurements]))) for name in measurements[0].keys()]
+        )
+        results[modality_set]["outputs"] = outputs
+        print(
+            "{} ({}): load {:.2f}s, reset {:.2f}s, {:.2f} steps/s".format(
+                os.path.basename(config_file),
+                modality_set,
+                results[modality_set]["load_time"],
+                results[modality_set]["reset_time"],
+                results[modality_set]["steps_per_second"],
+            )
+        )
+    return results
+
+
+def run_suite(config_files, num_steps, repetitions):
+    """
+    :return: Results of the suite: version, settings, machine and measurements per config file name and modality set
+    """
+    results = OrderedDict(
+        [
+            ("version", RESULTS_VERSION),
+            ("date", datetime.datetime.now().isoformat()),
+            ("machine", OrderedDict([("node", platform.node()), ("platform", platform.platform())])),
+            ("num_steps", num_steps),
+            ("repetitions", repetitions),
+            ("configs", OrderedDict()),
+        ]
+    )
+    for config_file in config_files:
+        results["configs"][os.path.basename(config_file)] = measure_config(config_file, num_steps, repetitions)
+    return results
+
+
+def compare_results(results, baseline, threshold):
+    """
+    Compare the measurements of the suite with a baseline
+    :param results: Results of run_suite
+    :param baseline: Results of run_suite stored as baseline
+    :param threshold: Relative change beyond which a measurement is a regression (e.g. 0.1 for 10% fewer steps per
+        second or 10% longer load times)
+    :return: List of regressions as tuples (config file name, modality set, measurement, baseline value, value)
+    """
+    assert baseline["version"] == RESULTS_VERSION, "The baseline has version {}, measure it again".format(
+        baseline["version"]
+    )
+    if baseline["num_steps"] != results["num_steps"]:
+        log.warning("The baseline was measured with {} steps".format(baseline["num_steps"]))
+    regressions = []
+    for config_name, config_results in results["configs"].items():
+        for modality_set, measurements in config_results.items():
+            baseline_measurements = baseline["configs"].get(config_name, {}).get(modality_set)
+            if baseline_measurements is None:
+                print("{} ({}): not in the baseline".format(config_name, modality_set))
+                continue
+            for name in ["load_time", "reset_time", "steps_per_second"]:
+                value, baseline_value = measurements[name], baseline_measurements[name]
+                change = (value - baseline_value) / baseline_value
+                regression = -change > threshold if name in HIGHER_IS_BETTER else change > threshold
+                if regression:
+                    regressions.append((config_name, modality_set, name, baseline_value, value))
+                print(
+                    "{}{} ({}) {}: {:.3f} -> {:.3f} ({:+.1f}%)".format(
+                        "REGRESSION " if regression else "",
+                        config_name,
+                        modality_set,
+                        name,
+                        baseline_value,
+                        value,
+                        change * 100,
+                    )
+                )
+    return regressions
+
+
+def main():
+    """
+    Entry point of the throughput regression suite
+    """
+    parser = argparse.ArgumentParser(description="Throughput regression suite of the environment configurations")
+    parser.add_argument(
+        "--configs",
+        nargs="+",
+        default=None,
+        type=str,
+        help="config files to measure (default: all the configs in behavior/configs)",
+    )
+    parser.add_argument("--num-steps", default=300, type=int, help="number of steps measured per repetition")
+    parser.add_argument("--repetitions", default=3, type=int, help="repetitions of each measurement (median)")
+    parser.add_argument(
+        "--output", default="throughput_results.json", type=str, help="file to save the results of the suite in"
+    )
+    parser.add_argument("--baseline", required=True, type=str, help="file with the baseline results")
+    parser.add_argument(
+        "--threshold",
+        default=DEFAULT_THRESHOLD,
+        type=float,
+        help="relative change of a measurement beyond which it is a regression",
+    )
+    parser.add_argument(
+        "--update-baseline", action="store_true", help="save the results as the new baseline instead of comparing"
+    )
+    args = parser.parse_args()
+
+    config_files = args.configs if args.configs is not None else get_config_files(behavior.configs_path)
+    results = run_suite(config_files, args.num_steps, args.repetitions)
+    with open(args.output, "w+") as f:
+        json.dump(results, f, indent=4)
+    print("Results saved to {}".format(args.output))
+
+    if args.update_baseline:
+        with open(args.baseline, "w+") as f:
+            json.dump(results, f, indent=4)
+        print("Baseline saved to {}".format(args.baseline))
+        return
+    if not os.path.exists(args.baseline):
+        print("No baseline at {}, store one with --update-baseline".format(args.baseline))
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare_results(results, baseline, args.threshold)
+    if len(regressions) > 0:
+        print("{} measurements regressed more than {:.0f}%".format(len(regressions), args.threshold * 100))
+        sys.exit(1)
+    print("No regressions beyond {:.0f}%".format(args.threshold * 100))
+
+
+if __name__ == "__main__":
+    main()
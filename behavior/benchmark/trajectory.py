@@ -0,0 +1,211 @@
+"""
+Compact recording of the actions of the benchmark episodes, used to recompute their metrics offline (see rescore)
+"""
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import zlib
+
+import h5py
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# Subdirectory of the output directory with one trajectory file per episode
+TRAJECTORY_DIR = "trajectories"
+
+# Number of actions per chunk of the trajectory files, written at once by the background thread
+CHUNK_SIZE = 256
+
+
+def get_episode_seed(seed, episode_key):
+    """
+    Seed of an episode, independent of the order in which the episodes are evaluated (workers, shards, resume)
+    :param seed: Base seed of the benchmark
+    :param episode_key: Key of the episode (see get_episode_key)
+    :return: Seed of the random number generators for the episode
+    """
+    return (seed + zlib.crc32(json.dumps(list(episode_key)).encode("utf-8"))) % 2**32
+
+
+def seed_episode(seed):
+    """
+    Seed the random number generators used by iGibson before resetting the environment of an episode
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def get_random_states():
+    """
+    :return: States of the random number generators seeded by seed_episode
+    """
+    return random.getstate(), np.random.get_state()
+
+
+def set_random_states(states):
+    random.setstate(states[0])
+    np.random.set_state(states[1])
+
+
+class AgentRandomState(object):
+    """
+    Random number generators of the agent, kept apart from the ones of the environment
+    Within the context, the agent draws from its own streams (python random and the global numpy generator), so the
+    random numbers used by the environment in an episode do not depend on the ones drawn by the agent, and the replay of
+    the recorded actions without the agent (see rescore) reproduces the episode. Generators of other libraries (e.g.
+    torch) are not used by iGibson and are not isolated
+    """
+
+    def __init__(self, seed):
+        """
+        Constructor
+        :param seed: Seed of the random number generators of the agent
+        """
+        outer_states = get_random_states()
+        seed_episode(seed)
+        self.states = get_random_states()
+        set_random_states(outer_states)
+        self.outer_states = None
+
+    def __enter__(self):
+        self.outer_states = get_random_states()
+        set_random_states(self.states)
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.states = get_random_states()
+        set_random_states(self.outer_states)
+
+
+def get_trajectory_file(directory, task, scene_id, instance_id, episode_id):
+    return os.path.join(directory, "{}_{}_{}_{}.hdf5".format(task, scene_id, instance_id, episode_id))
+
+
+def _write_trajectories(commands):
+    """
+    Main loop of the writer thread of a TrajectoryRecorder
+    :param commands: Queue of commands ("open", path, attributes), ("actions", array) and ("close", attributes)
+    """
+    f, path, dataset = None, None, None
+    while True:
+        command = commands.get()
+        try:
+            if command is None:
+                break
+            if command[0] == "open":
+                path = command[1]
+                # Written under a temporary name so that an interrupted episode does not leave a valid trajectory
+                f = h5py.File(path + ".tmp", "w")
+                for key, value in command[2].items():
+                    f.attrs[key] = value
+                dataset = None
+            elif command[0] == "actions":
+                actions = command[1]
+                if dataset is None:
+                    dataset = f.create_dataset(
+                        "actions",
+                        data=actions,
+                        maxshape=(None,) + actions.shape[1:],
+                        chunks=(CHUNK_SIZE,) + actions.shape[1:],
+                        compression="lzf",
+                    )
+                else:
+                    dataset.resize(dataset.shape[0] + actions.shape[0], axis=0)
+                    dataset[-actions.shape[0] :] = actions
+            elif command[0] == "close":
+                for key, value in command[1].items():
+                    f.attrs[key] = value
+                f.close()
+                os.replace(path + ".tmp", path)
+                f, path, dataset = None, None, None
+        except Exception:
+            log.exception("Failed to write the trajectory {}".format(path))
+        finally:
+            commands.task_done()
+
+
+class TrajectoryRecorder(object):
+    """
+    Records the actions of the episodes evaluated by a process in one HDF5 file per episode, together with the seed and
+    the identifiers and environment configuration needed to replay them
+    Actions are buffered in chunks of CHUNK_SIZE steps that a background thread compresses and writes while the
+    episode continues. The trajectory of an episode is complete on disk when end_episode returns.
+    """
+
+    def __init__(self, directory):
+        """
+        Constructor
+        :param directory: Directory to save the trajectory files in
+        """
+        self.directory = directory
+        self.owner_pid = None
+        self.commands = None
+        self.thread = None
+        self.buffer = None
+        self.num_buffered = 0
+        self.num_steps = 0
+
+    def _ensure_started(self):
+        # Threads do not survive a fork: each worker process starts its own writer thread
+        if self.owner_pid != os.getpid():
+            os.makedirs(self.directory, exist_ok=True)
+            self.commands = queue.Queue()
+            self.thread = threading.Thread(target=_write_trajectories, args=(self.commands,), daemon=True)
+            self.thread.start()
+            self.owner_pid = os.getpid()
+
+    def start_episode(self, task, scene_id, instance_id, episode_id, attributes):
+        """
+        Start the trajectory of an episode
+        :param attributes: Dictionary of attributes of the episode to save in the file (seed, configuration...)
+        """
+        self._ensure_started()
+        self.buffer = None
+        self.num_buffered = 0
+        self.num_steps = 0
+        path = get_trajectory_file(self.directory, task, scene_id, instance_id, episode_id)
+        self.commands.put(("open", path, attributes))
+
+    def record(self, action):
+        """
+        Record the action of a step
+        """
+        action = np.asarray(action)
+        if self.buffer is None:
+            self.buffer = np.empty((CHUNK_SIZE,) + action.shape, dtype=action.dtype)
+        self.buffer[self.num_buffered] = action
+        self.num_buffered += 1
+        self.num_steps += 1
+        if self.num_buffered == CHUNK_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if self.num_buffered > 0:
+            self.commands.put(("actions", self.buffer[: self.num_buffered].copy()))
+        self.num_buffered = 0
+
+    def end_episode(self, attributes):
+        """
+        Finish the trajectory of the episode and wait until it is written
+        :param attributes: Dictionary of attributes known at the end of the episode
+        """
+        self._flush()
+        attributes = dict(attributes)
+        attributes["num_steps"] = self.num_steps
+        self.commands.put(("close", attributes))
+        self.commands.join()
+
+
+def load_trajectory(path):
+    """
+    :return: Tuple of (dictionary of attributes, array of actions) of a trajectory file
+    """
+    with h5py.File(path, "r") as f:
+        attributes = dict(f.attrs.items())
+        actions = f["actions"][()] if "actions" in f else np.zeros((0,))
+    attributes["env_config"] = json.loads(attributes["env_config"])
+    return attributes, actions
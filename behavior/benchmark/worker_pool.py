@@ -0,0 +1,234 @@
+"""
+Pool of long-lived worker processes used by BehaviorBenchmark to evaluate episodes in parallel
+"""
+import logging
+import multiprocessing
+import time
+import traceback
+from multiprocessing.connection import wait
+
+log = logging.getLogger(__name__)
+
+# Seconds given to a recycled worker to close its environments and exit before killing it
+RECYCLE_TIMEOUT = 60.0
+
+
+def _worker_loop(benchmark, conn):
+    """
+    Main loop of a worker process: receives episodes, evaluates them and sends back their metrics
+    Each worker owns a copy of the benchmark (and therefore of the agent) and creates its own simulators and pybullet
+    clients, which may be kept loaded between episodes if the benchmark uses an environment cache
+    The worker exits after an episode if the benchmark asks to recycle it (see BehaviorBenchmark.should_recycle_worker)
+    and the pool replaces it with a new process
+    :param benchmark: BehaviorBenchmark object inherited from the parent process
+    :param conn: End of the pipe connecting the worker with the pool
+    """
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        episode, episode_args = message
+        try:
+            metrics = benchmark.evaluate_episode(*episode_args)
+        except Exception:
+            conn.send((episode, None, traceback.format_exc(), False))
+            continue
+        recycle = benchmark.should_recycle_worker()
+        conn.send((episode, metrics, None, recycle))
+        if recycle:
+            break
+    benchmark.close_environments()
+    conn.close()
+
+
+class EpisodeWorkerPool(object):
+    """
+    Pool of worker processes that evaluate episodes of the benchmark
+    The workers are forked from the main process so that they inherit a copy of the agent without requiring it to be
+    picklable. No simulator should be created in the main process before the pool is started.
+    The pool supervises the workers: a worker that dies, or exceeds the wall-clock budget of an episode, is killed and
+    replaced by a new one, and its episode is reported as failed. Workers that ask to be recycled (e.g. because their
+    memory grew) exit after their episode and are replaced as well. The replaced workers are reaped in the background
+    of the dispatch loop, so that the other workers keep receiving episodes while they exit.
+    """
+
+    def __init__(self, benchmark, num_workers, episode_timeout=None):
+        """
+        Constructor
+        :param benchmark: BehaviorBenchmark object whose evaluate_episode is called by the workers
+        :param num_workers: Number of worker processes
+        :param episode_timeout: Wall-clock budget of an episode in seconds. If None, episodes can run indefinitely
+        """
+        assert num_workers > 0, "The worker pool needs at least one worker"
+        self.benchmark = benchmark
+        self.num_workers = num_workers
+        self.episode_timeout = episode_timeout
+        self.context = multiprocessing.get_context("fork")
+        self.workers = []
+        self.connections = []
+        # Replaced workers that have not been reaped yet: sentinel to (process, time after which it is killed or None,
+        # index of the episode that was running when the worker died or None)
+        self.retiring = {}
+
+    def _start_worker(self, worker_id):
+        """
+        Fork a worker process
+        :return: Tuple of (process, end of the pipe connecting the pool with the worker)
+        """
+        parent_conn, child_conn = self.context.Pipe()
+        worker = self.context.Process(
+            target=_worker_loop, args=(self.benchmark, child_conn), name="behavior_worker_{}".format(worker_id)
+        )
+        worker.daemon = True
+        worker.start()
+        child_conn.close()
+        return worker, parent_conn
+
+    def start(self):
+        for worker_id in range(self.num_workers):
+            worker, conn = self._start_worker(worker_id)
+            self.workers.append(worker)
+            self.connections.append(conn)
+        log.info("Started {} benchmark workers".format(self.num_workers))
+
+    def _replace_worker(self, conn, exit_timeout=0.0, episode=None):
+        """
+        Start a new worker in place of the one connected through the given pipe (e.g. hung in the simulator), without
+        waiting for the replaced one: it is killed now, or after the exit timeout, and reaped by _reap_worker
+        :param exit_timeout: Time in seconds given to the worker to exit by itself before killing it
+        :param episode: Index of the episode that was running when the worker died, reported as failed once the worker
+            is reaped (with its exit code)
+        :return: End of the pipe connecting the pool with the new worker
+        """
+        worker_id = self.connections.index(conn)
+        worker = self.workers[worker_id]
+        conn.close()
+        kill_time = time.time() + exit_timeout
+        if exit_timeout <= 0.0:
+            worker.kill()
+            kill_time = None
+        self.retiring[worker.sentinel] = (worker, kill_time, episode)
+        self.workers[worker_id], self.connections[worker_id] = self._start_worker(worker_id)
+        log.info("Replacing benchmark worker {}".format(worker_id))
+        return self.connections[worker_id]
+
+    def _reap_worker(self, sentinel):
+        """
+        Join a replaced worker that exited
+        :return: Tuple of (index of the episode that was running when the worker died or None, exit code of the worker)
+        """
+        worker, _, episode = self.retiring.pop(sentinel)
+        worker.join()
+        log.log(
+            logging.INFO if worker.exitcode == 0 else logging.WARNING,
+            "Replaced benchmark worker {} exited (exit code {})".format(worker.name, worker.exitcode),
+        )
+        return episode, worker.exitcode
+
+    def _kill_overdue_workers(self):
+        """
+        Kill the replaced workers that did not exit within their exit timeout
+        """
+        for sentinel, (worker, kill_time, episode) in list(self.retiring.items()):
+            if kill_time is not None and time.time() >= kill_time:
+                worker.kill()
+                self.retiring[sentinel] = (worker, None, episode)
+
+    def close(self):
+        for conn in self.connections:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, EOFError, OSError):
+                pass
+        for worker in self.workers:
+            worker.join()
+        for worker, kill_time, _ in self.retiring.values():
+            worker.join(None if kill_time is None else max(kill_time - time.time(), 0.0))
+            if worker.is_alive():
+                worker.kill()
+            worker.join()
+        self.retiring = {}
+        for conn in self.connections:
+            conn.close()
+        self.workers = []
+        self.connections = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type is not None:
+            # Do not wait for episodes in flight if something went wrong
+            for worker in self.workers + [worker for worker, _, _ in self.retiring.values()]:
+                worker.terminate()
+        self.close()
+
+    @staticmethod
+    def _next_episode(pending, last_instance):
+        """
+        Pick the next episode for a worker, preferring the activity instance the worker evaluated last so that it can
+        reuse its loaded environment
+        :param pending: List of pending episodes in evaluation order
+        :param last_instance: (task, scene_id, instance_id) of the last episode of the worker, or None
+        :return: Index in pending of the next episode
+        """
+        if last_instance is not None:
+            for idx, (_, episode_args) in enumerate(pending):
+                if tuple(episode_args[:3]) == last_instance:
+                    return idx
+        return 0
+
+    def run(self, episodes):
+        """
+        Evaluates the given episodes in the workers, assigning a new episode to a worker as soon as it is idle
+        An episode fails if it raises an exception, or if its worker dies or exceeds the wall-clock budget; the worker
+        is then replaced
+        :param episodes: List of pairs (episode index, arguments of BehaviorBenchmark.evaluate_episode)
+        :return: Generator of tuples (episode index, metrics summary, reason of the failure or None) in order of
+            completion. The metrics summary of a failed episode is None
+        """
+        pending = list(episodes)
+        busy = {}
+        idle = list(self.connections)
+        last_instance = {}
+        while pending or busy or any(episode is not None for _, _, episode in self.retiring.values()):
+            while pending and idle:
+                conn = idle.pop()
+                episode, episode_args = pending.pop(self._next_episode(pending, last_instance.get(conn)))
+                conn.send((episode, episode_args))
+                last_instance[conn] = tuple(episode_args[:3])
+                busy[conn] = (episode, time.time())
+            deadlines = [kill_time for _, kill_time, _ in self.retiring.values() if kill_time is not None]
+            if self.episode_timeout is not None:
+                deadlines += [start_time + self.episode_timeout for _, start_time in busy.values()]
+            timeout = max(min(deadlines) - time.time(), 0.0) if len(deadlines) > 0 else None
+            for ready in wait(list(busy.keys()) + list(self.retiring.keys()), timeout):
+                if ready in self.retiring:
+                    episode, exitcode = self._reap_worker(ready)
+                    if episode is not None:
+                        yield episode, None, "the worker died (exit code {})".format(exitcode)
+                    continue
+                conn = ready
+                try:
+                    episode, metrics, error, recycle = conn.recv()
+                except EOFError:
+                    episode = busy.pop(conn)[0]
+                    idle.append(self._replace_worker(conn, episode=episode))
+                    continue
+                del busy[conn]
+                if recycle:
+                    # The worker closes its environments and exits
+                    conn = self._replace_worker(conn, exit_timeout=RECYCLE_TIMEOUT)
+                idle.append(conn)
+                if error is not None:
+                    yield episode, None, "raised an exception:\n{}".format(error)
+                    continue
+                yield episode, metrics, None
+            self._kill_overdue_workers()
+            if self.episode_timeout is not None:
+                for conn, (episode, start_time) in list(busy.items()):
+                    if time.time() - start_time > self.episode_timeout:
+                        del busy[conn]
+                        idle.append(self._replace_worker(conn))
+                        yield episode, None, "exceeded the wall-clock budget of {}s".format(self.episode_timeout)
@@ -21,8 +21,58 @@ from igibson.utils.utils import parse_config
 
 import behavior
 
+# Storage of each observation in the processed episode files, as (dtype, scale). A value v is stored as round(v * scale)
+# in the integer types and cast to the float types. The scale is recorded in the "scale" attribute of the datasets with
+# an integer type, and the readers divide by it: rgb, highlight and depth in [0, 1] are stored in 8 or 16 bits, and the
+# class and instance ids of seg and ins_seg in 16 bits (they can exceed 255)
+STORAGE_SCHEMA = {
+    "action": (np.float64, None),
+    "rgb": (np.uint8, 255.0),
+    "highlight": (np.uint8, 255.0),
+    "depth": (np.uint16, 65535.0),
+    "seg": (np.uint16, 1.0),
+    "ins_seg": (np.uint16, 1.0),
+    "proprioception": (np.float32, None),
+    "task_obs": (np.float32, None),
+}
+# Storage of the observations that are not in the schema
+DEFAULT_STORAGE = (np.float32, None)
+# Previous storage, with every observation but the action in float32
+FLOAT32_SCHEMA = {"action": (np.float64, None)}
+
+
+def get_storage_schema(depth_dtype="uint16"):
+    """
+    :param depth_dtype: Type of the stored depth, uint16 (quantized) or float16
+    :return: Storage schema of the processed episode files
+    """
+    schema = dict(STORAGE_SCHEMA)
+    if depth_dtype == "float16":
+        schema["depth"] = (np.float16, None)
+    else:
+        assert depth_dtype == "uint16", "Unknown type of the depth: {}".format(depth_dtype)
+    return schema
 
-def save_episode(demo_file, dataset_metric):
+
+def save_datasets(hf, results, schema=STORAGE_SCHEMA):
+    """
+    Store the observations and actions of an episode in an HDF5 file
+    :param hf: HDF5 file open for writing
+    :param results: Dictionary of key to list (or array) of the values of each frame
+    :param schema: Storage schema, dictionary of key to (dtype, scale) (see STORAGE_SCHEMA)
+    """
+    for key, value in results.items():
+        dtype, scale = schema.get(key, DEFAULT_STORAGE)
+        data = np.stack(value)
+        if scale is not None:
+            info = np.iinfo(dtype)
+            data = np.clip(np.round(data * scale), info.min, info.max)
+        dataset = hf.create_dataset(key, data=data, dtype=dtype, compression="lzf")
+        if scale is not None:
+            dataset.attrs["scale"] = scale
+
+
+def save_episode(demo_file, dataset_metric, schema=STORAGE_SCHEMA):
     episode_identifier = "_".join(os.path.splitext(demo_file)[0].split("_")[-2:])
     episode_out_log_path = "processed_hdf5s/{}_{}_{}_{}_{}_episode.hdf5".format(
         activity, activity_id, scene, instance_id, episode_identifier
@@ -33,12 +83,7 @@ def save_episode(demo_file, dataset_metric):
     for attr in IGLogReader.get_all_metadata_attrs(demo_file):
         hf.attrs[attr] = IGLogReader.read_metadata_attr(demo_file, attr)
 
-    for key, value in dataset_metric.gather_results().items():
-        if key == "action":
-            dtype = np.float64
-        else:
-            dtype = np.float32
-        hf.create_dataset(key, data=np.stack(value), dtype=dtype, compression="lzf")
+    save_datasets(hf, dataset_metric.gather_results(), schema=schema)
 
     hf.close()
 
@@ -51,6 +96,7 @@ def generate_il_dataset(
     skip_existing=True,
     save_frames=False,
     deactivate_logger=True,
+    schema=STORAGE_SCHEMA,
 ):
     """
     Extract pairs of (observation,action) for imitation learning from a batch of BEHAVIOR demos.
@@ -62,6 +108,7 @@ def generate_il_dataset(
     @param skip_existing: Whether demos with existing output logs should be skipped.
     @param save_frames: Whether the demo's frames should be saved alongside statistics.
     @param deactivate_logger: If we deactivate the logger
+    @param schema: Storage schema of the observations (see STORAGE_SCHEMA)
     """
 
     if deactivate_logger:
@@ -113,7 +160,7 @@ def generate_il_dataset(
             )
             demo_information["failed"] = False
             demo_information["filename"] = Path(demo).name
-            save_episode(demo_file, dataset)
+            save_episode(demo_file, dataset, schema=schema)
 
         except Exception as e:
             logging.error("Demo failed withe error: {}".format(e))
@@ -130,6 +177,7 @@ def parse_args(defaults=False):
     args_dict["log_manifest"] = os.path.join(igibson.ig_dataset_path, "tests", "test_manifest.txt")
     args_dict["out_dir"] = os.path.join(behavior.examples_path, "data")
     args_dict["config"] = os.path.join(behavior.configs_path, "behavior_vr.yaml")
+    args_dict["depth_dtype"] = "uint16"
     if not defaults:
         parser = argparse.ArgumentParser(
             description="Extract pairs of (observation,action) for imitation learning from a batch of BEHAVIOR demos."
@@ -142,12 +190,19 @@ def parse_args(defaults=False):
             help="which config file to use [default: use yaml files in examples/configs]",
             default=args_dict["config"],
         )
+        parser.add_argument(
+            "--depth_dtype",
+            choices=["uint16", "float16"],
+            help="type of the stored depth maps",
+            default=args_dict["depth_dtype"],
+        )
 
         args = parser.parse_args()
         args_dict["demo_dir"] = args.demo_dir
         args_dict["log_manifest"] = args.log_manifest
         args_dict["out_dir"] = args.out_dir
         args_dict["config"] = args.config
+        args_dict["depth_dtype"] = args.depth_dtype
 
     return args_dict
 
@@ -162,7 +217,13 @@ def main(selection="user", headless=False, short_exec=False):
     defaults = selection == "random" and headless and short_exec
     args_dict = parse_args(defaults=defaults)
 
-    generate_il_dataset(args_dict["demo_dir"], args_dict["log_manifest"], args_dict["out_dir"], args_dict["config"])
+    generate_il_dataset(
+        args_dict["demo_dir"],
+        args_dict["log_manifest"],
+        args_dict["out_dir"],
+        args_dict["config"],
+        schema=get_storage_schema(args_dict["depth_dtype"]),
+    )
 
 
 RUN_AS_TEST = False  # Change to True to run this example in test mode
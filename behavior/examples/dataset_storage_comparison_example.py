@@ -0,0 +1,165 @@
+"""
+Script to compare the size and read throughput of the processed imitation learning dataset files written with the
+compact storage schema (quantized images) and with float32 observations
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+from collections import OrderedDict
+
+import h5py
+import igibson
+import numpy as np
+from igibson.examples.learning.demo_replaying_example import replay_demo
+from igibson.metrics.dataset import DatasetMetric
+
+import behavior
+from behavior.examples.dataset_generation_il_example import FLOAT32_SCHEMA, get_storage_schema, save_datasets
+
+
+def read_episode(episode_file):
+    """
+    :return: Dictionary of key to array of the observations and actions of a processed episode file, in float
+    """
+    results = {}
+    with h5py.File(episode_file, "r") as hf:
+        for key in hf.keys():
+            results[key] = np.asarray(hf[key], dtype=np.float64 if key == "action" else np.float32)
+            if "scale" in hf[key].attrs:
+                results[key] /= hf[key].attrs["scale"]
+    return results
+
+
+def replay_sample_demo(config_file):
+    """
+    :return: Dictionary of key to list of the observations and actions of the frames of the sample demo
+    """
+    dataset = DatasetMetric()
+    replay_demo(
+        in_log_path=os.path.join(igibson.ig_dataset_path, "tests", "cleaning_windows_example.hdf5"),
+        mode="headless",
+        config_file=config_file,
+        verbose=False,
+        image_size=(128, 128),
+        start_callbacks=[dataset.start_callback],
+        step_callbacks=[dataset.step_callback],
+        end_callbacks=[dataset.end_callback],
+    )
+    return dataset.gather_results()
+
+
+def compare_storage(results, schemas, repetitions=3):
+    """
+    Write an episode with each storage schema and measure the size of the file, the time to write it and the time to
+    read and normalise all its observations
+    :param results: Dictionary of key to list (or array) of the values of each frame
+    :param schemas: Ordered dictionary of name to storage schema
+    :param repetitions: Number of reads of each file. The fastest is reported
+    :return: Ordered dictionary of schema name to dictionary of measurements
+    """
+    num_frames = len(results["action"])
+    comparison = OrderedDict()
+    with tempfile.TemporaryDirectory() as directory:
+        for name, schema in schemas.items():
+            path = os.path.join(directory, "episode.hdf5")
+            start_time = time.time()
+            with h5py.File(path, "w") as hf:
+                save_datasets(hf, results, schema=schema)
+            write_time = time.time() - start_time
+            read_times = []
+            for _ in range(repetitions):
+                start_time = time.time()
+                stored = read_episode(path)
+                read_times.append(time.time() - start_time)
+            comparison[name] = {
+                "size_mb": os.path.getsize(path) / 1024.0**2,
+                "write_time": write_time,
+                "frames_per_second": num_frames / min(read_times),
+                "max_error": {
+                    key: float(np.max(np.abs(stored[key] - np.stack(value)))) if num_frames > 0 else 0.0
+                    for key, value in results.items()
+                },
+            }
+            os.remove(path)
+
+    reference = list(comparison.values())[0]
+    for name, measurements in comparison.items():
+        print(
+            "{}: {:.1f} MB ({:.2f}x), written in {:.2f}s, read at {:.0f} frames/s ({:.2f}x)".format(
+                name,
+                measurements["size_mb"],
+                measurements["size_mb"] / reference["size_mb"],
+                measurements["write_time"],
+                measurements["frames_per_second"],
+                measurements["frames_per_second"] / reference["frames_per_second"],
+            )
+        )
+        print(
+            "    max error: {}".format(
+                ", ".join("{} {:.2e}".format(key, error) for key, error in measurements["max_error"].items())
+            )
+        )
+    return comparison
+
+
+def parse_args(defaults=False):
+    args_dict = dict()
+    args_dict["episode"] = None
+    args_dict["config"] = os.path.join(behavior.configs_path, "behavior_vr.yaml")
+    if not defaults:
+        parser = argparse.ArgumentParser(
+            description="Compare the size and read throughput of processed imitation learning dataset files."
+        )
+        parser.add_argument(
+            "--episode",
+            type=str,
+            help="processed episode file to compare the storage of [default: replay the sample demo]",
+        )
+        parser.add_argument(
+            "--config",
+            help="which config file to use to replay the sample demo [default: use yaml files in examples/configs]",
+            default=args_dict["config"],
+        )
+
+        args = parser.parse_args()
+        args_dict["episode"] = args.episode
+        args_dict["config"] = args.config
+
+    return args_dict
+
+
+def main(selection="user", headless=False, short_exec=False):
+    """
+    Compare the size and read throughput of the processed imitation learning dataset files written with the compact
+    storage schema (uint8 images, 16-bit depth and segmentation) and with float32 observations.
+    """
+
+    print("*" * 80 + "\nDescription:" + main.__doc__ + "\n" + "*" * 80)
+
+    defaults = selection == "random" and headless and short_exec
+    args_dict = parse_args(defaults=defaults)
+
+    if args_dict["episode"] is not None:
+        results = read_episode(args_dict["episode"])
+    else:
+        results = replay_sample_demo(args_dict["config"])
+
+    schemas = OrderedDict(
+        [
+            ("float32", FLOAT32_SCHEMA),
+            ("compact", get_storage_schema("uint16")),
+            ("compact, float16 depth", get_storage_schema("float16")),
+        ]
+    )
+    compare_storage(results, schemas)
+
+
+RUN_AS_TEST = False  # Change to True to run this example in test mode
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if RUN_AS_TEST:
+        main(selection="random", headless=True, short_exec=True)
+    else:
+        main()
@@ -6,6 +6,7 @@ import igibson
 from igibson.envs.igibson_env import iGibsonEnv
 
 import behavior
+from behavior.benchmark.action_repeat import ActionRepeat
 
 try:
     import gym
@@ -107,10 +108,13 @@ def main(selection="user", headless=False, short_exec=False):
     config_file = "behavior_onboard_sensing.yaml"
     tensorboard_log_dir = "log_dir"
     num_environments = 8 if not short_exec else 1
+    # Number of steps of 1/30 s each action of the policy is repeated for. The observations are only computed (and
+    # rendered) in the last one
+    action_repeat = 1
 
     # Function callback to create environments
     def make_env(rank: int, seed: int = 0) -> Callable:
-        def _init() -> iGibsonEnv:
+        def _init() -> gym.Env:
             env = iGibsonEnv(
                 config_file=os.path.join(behavior.configs_path, config_file),
                 mode="headless",
@@ -118,7 +122,7 @@ def main(selection="user", headless=False, short_exec=False):
                 physics_timestep=1.0 / 120.0,
             )
             env.seed(seed + rank)
-            return env
+            return ActionRepeat(env, action_repeat)
 
         set_random_seed(seed)
         return _init
@@ -134,6 +138,7 @@ def main(selection="user", headless=False, short_exec=False):
         action_timestep=1.0 / 30.0,
         physics_timestep=1.0 / 120.0,
     )
+    eval_env = ActionRepeat(eval_env, action_repeat)
 
     # Obtain the arguments/parameters for the policy and create the PPO model
     policy_kwargs = dict(
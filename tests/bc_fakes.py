@@ -0,0 +1,54 @@
+"""
+Synthetic processed episode files, to test the data loading and the training of the behavioral cloning baseline
+without a recorded dataset
+"""
+import os
+import sys
+
+import h5py
+import numpy as np
+
+BC_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "behavior", "baselines", "behavioral_cloning"
+)
+# The modules of the baseline import each other as top-level modules
+if BC_DIR not in sys.path:
+    sys.path.insert(0, BC_DIR)
+
+import base_input_utils as BIU  # noqa: E402
+
+
+def write_episode_files(directory, lengths, chunk_length=4, quantize_rgb=True, seed=0):
+    """
+    Write synthetic processed episode files. The first value of the action of each frame is its global index in the
+    concatenation of the files
+    :param lengths: Number of frames of each file
+    :param chunk_length: Number of frames of the HDF5 chunks of the datasets
+    :param quantize_rgb: Whether to store rgb in uint8 with a scale of 255, as dataset_generation_il_example.py does
+    :return: Path of the spec file listing the files, and list of the files
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    files = []
+    offset = 0
+    for idx, length in enumerate(lengths):
+        path = os.path.join(directory, "synthetic_{}_episode.hdf5".format(idx))
+        with h5py.File(path, "w") as hf:
+            for key, shape in BIU.DATASET_SHAPES.items():
+                data = rng.uniform(size=(length,) + shape).astype(np.float32)
+                if key == "action":
+                    data[:, 0] = np.arange(offset, offset + length)
+                chunks = (min(chunk_length, length),) + shape if length > 0 else None
+                if key == "rgb" and quantize_rgb:
+                    dataset = hf.create_dataset(key, data=np.round(data * 255).astype(np.uint8), chunks=chunks)
+                    dataset.attrs["scale"] = 255.0
+                else:
+                    hf.create_dataset(key, data=data, chunks=chunks)
+        files.append(path)
+        offset += length
+    spec_file = os.path.join(directory, "spec.txt")
+    with open(spec_file, "w") as f:
+        f.write("DIR {}/\n".format(directory))
+        for idx in range(len(lengths)):
+            f.write("synthetic_{}\n".format(idx))
+    return spec_file, files
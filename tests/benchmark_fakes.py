@@ -0,0 +1,102 @@
+"""
+Benchmark evaluating synthetic episodes, to test the planning, sharding, worker processes and aggregation of the
+benchmark without the simulator
+"""
+import hashlib
+import os
+import time
+
+from behavior.benchmark.behavior_benchmark import BehaviorBenchmark
+from behavior.benchmark.evaluation_plan import PLAN_VERSION, get_content_hash, save_plan
+
+ACTIVITIES = {
+    "assembling_gift_baskets": {"scene_instance_ids": {"Beechwood_0_int": [0, 10, 20]}, "max_step": 10},
+    "cleaning_oven": {
+        "scene_instance_ids": {"Ihlen_1_int": [0, 1, 10, 20], "Rs_int": [0, 1, 10, 11, 20]},
+        "max_step": 5,
+    },
+    "sorting_books": {
+        "scene_instance_ids": {"Pomaria_1_int": [0, 1, 2, 10, 11, 12, 20, 21, 22]},
+        "max_step": 20,
+    },
+}
+ENV_CONFIG = {"output": ["proprioception", "rgb", "depth", "task_obs"], "task": "cleaning_oven"}
+
+
+def write_plan(directory):
+    """
+    :return: Path of a compiled evaluation plan with three activities and 21 activity instances
+    """
+    path = os.path.join(directory, "plan.json")
+    save_plan({"version": PLAN_VERSION, "content_hash": get_content_hash(ACTIVITIES), "activities": ACTIVITIES}, path)
+    return path
+
+
+def get_episode_keys():
+    """
+    :return: Keys of the episodes of the plan of write_plan, with one episode per instance
+    """
+    return [
+        (task, scene_id, instance_id, 0)
+        for task in sorted(ACTIVITIES.keys())
+        for scene_id, instance_ids in ACTIVITIES[task]["scene_instance_ids"].items()
+        for instance_id in instance_ids
+    ]
+
+
+def get_fake_metrics(task, scene_id, instance_id, episode_id, score=None):
+    """
+    :return: Metrics summary of a synthetic episode, deterministic for each episode
+    """
+    digest = hashlib.sha256("{} {} {} {}".format(task, scene_id, instance_id, episode_id).encode("utf-8")).digest()
+    values = [byte / 255.0 for byte in digest[:6]]
+    return {
+        "q_score": {"final": values[0] if score is None else score},
+        "time": {"simulator_time": 10.0 * values[1]},
+        "kinematic_disarrangement": {"relative": values[2]},
+        "logical_disarrangement": {"relative": values[3]},
+        "agent_distance": {"timestep": {"body": [values[4], values[5]]}},
+        "grasp_distance": {"timestep": {"left_hand": [values[4]], "right_hand": [values[5]]}},
+        "task": task,
+    }
+
+
+class FakeBenchmark(BehaviorBenchmark):
+    """
+    Benchmark whose episodes return synthetic metrics instead of running the simulator
+    """
+
+    def __init__(
+        self, agent=None, scores=None, fail_episodes=(), hang_episodes=(), crash_episodes=(), close_delay=0.0, **kwargs
+    ):
+        """
+        :param scores: Dictionary of task to success score of all its episodes. The scores are synthetic if None
+        :param fail_episodes: Episode keys (task, scene_id, instance_id, episode_id) that raise an exception
+        :param hang_episodes: Episode keys that never finish
+        :param crash_episodes: Episode keys that kill their process
+        :param close_delay: Time in seconds taken to close the environments
+        """
+        kwargs.setdefault("env_config_file", "fake.yaml")
+        super(FakeBenchmark, self).__init__(agent, **kwargs)
+        self.env_config = dict(ENV_CONFIG)
+        self.scores = scores if scores is not None else {}
+        self.fail_episodes = set(fail_episodes)
+        self.hang_episodes = set(hang_episodes)
+        self.crash_episodes = set(crash_episodes)
+        self.close_delay = close_delay
+        self.evaluated_configs = []
+
+    def evaluate_episode(self, task, scene_id, instance_id, episode_id, env_config):
+        episode_key = (task, scene_id, instance_id, episode_id)
+        if episode_key in self.fail_episodes:
+            raise ValueError("Synthetic failure of episode {}".format(episode_key))
+        if episode_key in self.hang_episodes:
+            time.sleep(3600)
+        if episode_key in self.crash_episodes:
+            os._exit(3)
+        self.evaluated_configs.append(env_config)
+        self.update_process_usage({"rss_mb": 0.0})
+        return get_fake_metrics(task, scene_id, instance_id, episode_id, score=self.scores.get(task))
+
+    def close_environments(self):
+        time.sleep(self.close_delay)
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from bc_fakes import BIU, write_episode_files
+
+LENGTHS = [5, 17, 9, 1, 12]
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+@pytest.mark.parametrize("block_length", [1, 3, 8])
+def test_epoch_covers_every_frame_once(tmp_path, num_workers, block_length):
+    spec_file, _ = write_episode_files(str(tmp_path), LENGTHS)
+    dataset = BIU.LazyBHDataset(spec_file)
+    batches = BIU.BatchPrefetcher(dataset, 4, block_length=block_length, num_workers=num_workers, seed=1)
+    try:
+        for _ in range(2):
+            indices = []
+            num_batches = 0
+            for batch in batches:
+                assert 0 < len(batch["action"]) <= 4
+                # The observations of each frame are the ones of its action
+                for idx, action in enumerate(batch["action"]):
+                    frame = dataset[int(action[0])]
+                    for key, array in zip(BIU.DATASETS, frame):
+                        np.testing.assert_array_equal(batch[key][idx], array)
+                indices.extend(int(index) for index in batch["action"][:, 0])
+                num_batches += 1
+            assert num_batches == len(batches)
+            assert sorted(indices) == list(range(sum(LENGTHS)))
+    finally:
+        batches.close()
+        dataset.close()
+
+
+def test_stopped_epoch_does_not_overwrite_next(tmp_path):
+    spec_file, _ = write_episode_files(str(tmp_path), LENGTHS)
+    dataset = BIU.LazyBHDataset(spec_file)
+    batches = BIU.BatchPrefetcher(dataset, 4, num_workers=2, seed=1)
+    try:
+        for _ in batches:
+            break
+        indices = [int(index) for batch in batches for index in batch["action"][:, 0]]
+        assert sorted(indices) == list(range(sum(LENGTHS)))
+    finally:
+        batches.close()
+        dataset.close()
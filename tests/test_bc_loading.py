@@ -0,0 +1,53 @@
+import h5py
+import numpy as np
+import pytest
+from bc_fakes import BIU, write_episode_files
+
+LENGTHS = [5, 17, 0, 9, 1, 12]
+
+
+def read_serially(files):
+    """
+    :return: Arrays of the datasets of the files read one after the other, as stored
+    """
+    arrays = []
+    for key in BIU.DATASETS:
+        frames = []
+        for f in files:
+            with h5py.File(f, "r") as hf:
+                frames.append(hf[key][()])
+        arrays.append(np.concatenate(frames))
+    return arrays
+
+
+@pytest.mark.parametrize("num_workers", [None, 1, 3])
+def test_parallel_load_equals_serial_load(tmp_path, num_workers):
+    _, files = write_episode_files(str(tmp_path), LENGTHS)
+    serial_arrays, serial_scales = BIU.read_proc_parallel(files, num_workers=0)
+    arrays, scales = BIU.read_proc_parallel(files, num_workers=num_workers)
+    assert scales == serial_scales
+    for key, array, serial_array, expected in zip(BIU.DATASETS, arrays, serial_arrays, read_serially(files)):
+        assert array.dtype == serial_array.dtype == expected.dtype, key
+        np.testing.assert_array_equal(array, serial_array)
+        np.testing.assert_array_equal(array, expected)
+
+
+def test_parallel_load_of_files_with_different_scales(tmp_path):
+    # Files written before and after the quantization of the images are loaded in float32, normalised
+    _, quantized_files = write_episode_files(str(tmp_path / "quantized"), LENGTHS[:3], quantize_rgb=True)
+    _, float_files = write_episode_files(str(tmp_path / "float"), LENGTHS[3:], quantize_rgb=False, seed=1)
+    files = quantized_files + float_files
+    serial_arrays, serial_scales = BIU.read_proc_parallel(files, num_workers=0)
+    arrays, scales = BIU.read_proc_parallel(files, num_workers=2)
+    assert scales == serial_scales
+    assert scales["rgb"] == 1.0
+    rgbs = arrays[BIU.DATASETS.index("rgb")]
+    assert rgbs.dtype == np.float32
+    np.testing.assert_array_equal(rgbs, serial_arrays[BIU.DATASETS.index("rgb")])
+    expected = np.concatenate(
+        [
+            read_serially(quantized_files)[BIU.DATASETS.index("rgb")] / np.float32(255.0),
+            read_serially(float_files)[BIU.DATASETS.index("rgb")],
+        ]
+    )
+    np.testing.assert_allclose(rgbs, expected, rtol=1e-6)
@@ -0,0 +1,59 @@
+"""
+Tests of the confidence intervals of the success score and of the sequential evaluation reaching a target width
+"""
+import json
+import os
+
+import numpy as np
+import pytest
+from benchmark_fakes import ACTIVITIES, FakeBenchmark, write_plan
+
+from behavior.benchmark.aggregation import get_confidence_interval
+from behavior.benchmark.run_options import RunOptions
+
+
+@pytest.mark.parametrize("score", [0.0, 1.0, 0.4])
+def test_equal_scores_do_not_collapse_the_interval(score):
+    for num_values in [1, 2, 5, 10]:
+        low, high = get_confidence_interval([score] * num_values)
+        assert 0.0 <= low <= score <= high <= 1.0
+        assert high - low > 0.1
+
+
+def test_interval_narrows_with_more_values():
+    widths = []
+    for num_values in [2, 10, 100, 1000]:
+        values = np.random.RandomState(0).uniform(size=num_values)
+        low, high = get_confidence_interval(values)
+        assert low <= np.mean(values) <= high
+        widths.append(high - low)
+    assert widths == sorted(widths, reverse=True)
+    assert widths[-1] < 0.1
+    assert get_confidence_interval([]) == (0.0, 1.0)
+
+
+def test_always_solved_instances_reach_the_maximum_episodes(tmp_path):
+    max_episodes = 6
+    benchmark = FakeBenchmark(
+        output_dir=str(tmp_path),
+        split="dev",
+        scores={"cleaning_oven": 1.0, "sorting_books": 0.0},
+        episodes_per_instance=2,
+        options=RunOptions(
+            plan_file=write_plan(str(tmp_path)), target_ci_width=0.2, max_episodes_per_instance=max_episodes
+        ),
+    )
+    benchmark.evaluate_agent()
+    num_instances = sum(
+        len(instance_ids)
+        for activity in ACTIVITIES.values()
+        for instance_ids in activity["scene_instance_ids"].values()
+    )
+    assert len(benchmark.run_metrics) == num_instances * max_episodes
+
+    with open(os.path.join(str(tmp_path), "aggregated_metrics.json")) as f:
+        intervals = json.load(f)["Success Score 95% CI per Activity"]
+    low, high = intervals["cleaning_oven"]
+    assert low < 1.0 and high == 1.0
+    low, high = intervals["sorting_books"]
+    assert low == 0.0 and high > 0.0
@@ -0,0 +1,59 @@
+import argparse
+import os
+import socket
+import time
+
+import pytest
+
+torch = pytest.importorskip("torch")
+if not torch.distributed.is_available() or not torch.distributed.is_gloo_available():
+    pytest.skip("torch.distributed with the gloo backend is not available", allow_module_level=True)
+
+from bc_fakes import BIU, write_episode_files  # noqa: E402
+
+# Seconds allowed for the training, after which the processes are stopped (e.g. a rank waiting for the others forever)
+TIMEOUT = 120.0
+
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_uneven_shards(tmp_path):
+    import simple_bc_agent
+
+    # With 2 processes, the shards have 40 and 8 frames: the second rank runs out of batches first and joins the
+    # gradient averaging of the first one
+    spec_file, files = write_episode_files(str(tmp_path), [40, 4, 4])
+    lengths, _, _ = BIU.read_dataset_info(files)
+    assert sorted(len(shard) for shard in BIU.shard_files(files, lengths, 2)) == [1, 2]
+    args = argparse.Namespace(
+        spec=spec_file,
+        net="taskObs",
+        epochs=2,
+        batch_size=4,
+        block_length=2,
+        num_workers=1,
+        num_processes=2,
+        master_port=get_free_port(),
+        output=os.path.join(str(tmp_path), "trained_models", "model.pth"),
+    )
+    context = torch.multiprocessing.spawn(simple_bc_agent.train_distributed, args=(args,), nprocs=2, join=False)
+    deadline = time.time() + TIMEOUT
+    try:
+        # Raises if a rank fails
+        while not context.join(timeout=1.0):
+            assert time.time() < deadline, "The data-parallel training did not finish"
+    finally:
+        for process in context.processes:
+            if process.is_alive():
+                process.kill()
+                process.join()
+    assert [process.exitcode for process in context.processes] == [0, 0]
+
+    bc_agent = torch.load(args.output, weights_only=False)
+    assert isinstance(bc_agent, simple_bc_agent.BCNet_taskObs)
+    output = bc_agent(torch.zeros((1, BIU.TASK_OBS_DIM)), torch.zeros((1, BIU.PROPRIOCEPTION_DIM)))
+    assert output.shape == (1, BIU.ACT_DIM)
@@ -0,0 +1,45 @@
+"""
+Test of the change-driven kinematic disarrangement against the original metric on the trajectory of a recorded demo
+The change-driven metric only skips objects whose displacement is exactly zero, so the benchmark values must match
+within METRIC_TOLERANCE (relative and absolute error of 1e-6)
+"""
+import os
+
+import numpy as np
+import pytest
+
+igibson = pytest.importorskip("igibson")
+
+import behavior
+from behavior.benchmark.metric_scheduling import METRIC_TOLERANCE
+
+
+def test_incremental_kinematic_disarrangement_matches_reference():
+    from igibson.examples.learning.demo_replaying_example import replay_demo
+    from igibson.metrics.disarrangement import KinematicDisarrangement
+
+    from behavior.benchmark.metric_classes import IncrementalKinematicDisarrangement
+
+    demo_file = os.path.join(igibson.ig_dataset_path, "tests", "cleaning_windows_example.hdf5")
+    if not os.path.exists(demo_file):
+        pytest.skip("The sample demo of the iGibson dataset is not available")
+
+    reference = KinematicDisarrangement()
+    incremental = IncrementalKinematicDisarrangement()
+    replay_demo(
+        in_log_path=demo_file,
+        mode="headless",
+        config_file=os.path.join(behavior.configs_path, "behavior_vr.yaml"),
+        verbose=False,
+        image_size=(128, 128),
+        start_callbacks=[reference.start_callback, incremental.start_callback],
+        step_callbacks=[reference.step_callback, incremental.step_callback],
+        end_callbacks=[reference.end_callback, incremental.end_callback],
+    )
+
+    reference_results = reference.gather_results()["kinematic_disarrangement"]
+    incremental_results = incremental.gather_results()["kinematic_disarrangement"]
+    assert len(incremental_results["timestep"]) == len(reference_results["timestep"])
+    assert np.allclose(incremental_results["timestep"], reference_results["timestep"], **METRIC_TOLERANCE)
+    for key in ["relative", "integrated"]:
+        assert np.isclose(incremental_results[key], reference_results[key], **METRIC_TOLERANCE)
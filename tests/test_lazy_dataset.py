@@ -0,0 +1,79 @@
+import pickle
+
+import numpy as np
+import pytest
+from bc_fakes import BIU, write_episode_files
+
+LENGTHS = [5, 17, 0, 9, 1, 12]
+SLICES = [
+    slice(None),
+    slice(0, 5),
+    slice(3, 30),
+    slice(4, 6),
+    slice(22, 23),
+    slice(7, 7),
+    slice(-10, None),
+    slice(40, 50),
+]
+
+
+def get_eager_frames(data, idx):
+    """
+    :return: Tuple of the frames of an eagerly loaded BHDataset, converted as LazyBHDataset converts them
+    """
+    arrays = [data.actions, data.proprioceptions, data.rgbs, data.task_obss]
+    return tuple(
+        BIU.convert_frames(key, array[idx], scale=data.scales[key]) for key, array in zip(BIU.DATASETS, arrays)
+    )
+
+
+@pytest.fixture
+def datasets(tmp_path):
+    spec_file, _ = write_episode_files(str(tmp_path), LENGTHS)
+    # A cache of one chunk and two open files, so that the chunks and the files are evicted while indexing
+    lazy_data = BIU.LazyBHDataset(spec_file, cache_size=1, max_open_files=2)
+    yield lazy_data, BIU.BHDataset(spec_file, num_workers=0)
+    lazy_data.close()
+
+
+def test_lazy_indexing_equals_eager_indexing(datasets):
+    lazy_data, data = datasets
+    assert len(lazy_data) == data.size == sum(LENGTHS)
+    for idx in list(range(data.size)) + [-1, -data.size]:
+        frames = lazy_data[idx]
+        expected = get_eager_frames(data, slice(idx, idx + 1 if idx != -1 else None))
+        for key, frame, expected_frame in zip(BIU.DATASETS, frames, expected):
+            assert frame.dtype == np.float32, key
+            np.testing.assert_array_equal(frame, expected_frame[0])
+    for idx in [data.size, -data.size - 1]:
+        with pytest.raises(IndexError):
+            lazy_data[idx]
+
+
+@pytest.mark.parametrize("frames", SLICES)
+def test_lazy_slicing_equals_eager_indexing(datasets, frames):
+    lazy_data, data = datasets
+    for key, array, expected in zip(BIU.DATASETS, lazy_data[frames], get_eager_frames(data, frames)):
+        assert array.dtype == np.float32, key
+        assert array.shape == expected.shape, key
+        np.testing.assert_array_equal(array, expected)
+
+
+def test_pickled_lazy_dataset_equals_eager_indexing(datasets):
+    # The dataset is sent to the loading processes of a DataLoader without its open files and cache
+    lazy_data, data = datasets
+    lazy_data[0]
+    copy = pickle.loads(pickle.dumps(lazy_data))
+    for key, array, expected in zip(BIU.DATASETS, copy[:], get_eager_frames(data, slice(None))):
+        np.testing.assert_array_equal(array, expected)
+    copy.close()
+
+
+def test_lazy_frames_equal_eager_frames_on_device(datasets):
+    torch = pytest.importorskip("torch")
+    lazy_data, data = datasets
+    data.to_device()
+    tensors = [data.actions, data.proprioceptions, data.rgbs, data.task_obss]
+    for idx in [0, 13, data.size - 1]:
+        for key, frame, tensor in zip(BIU.DATASETS, lazy_data[idx], tensors):
+            assert torch.equal(torch.from_numpy(frame), tensor[idx].cpu()), key
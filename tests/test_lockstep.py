@@ -0,0 +1,88 @@
+"""
+Tests of the evaluation of episodes in lockstep environments with batched agent queries
+The environments are synthetic: an episode lasts a number of steps given by its instance id
+"""
+import time
+
+from benchmark_fakes import FakeBenchmark, get_fake_metrics
+
+from behavior.benchmark.agents.agent import Agent
+from behavior.benchmark.lockstep import LockstepEnvironments
+
+# Seconds taken by a step of the environments, much longer than starting an episode, as in the simulator
+STEP_TIME = 0.01
+
+
+class LockstepBenchmark(FakeBenchmark):
+    """
+    Benchmark whose environments return the episode and the step of the episode as observation, and check that they
+    receive the actions computed for their own observations
+    """
+
+    def start_episode(self, task, scene_id, instance_id, episode_id, env_config, seed=None):
+        self.current_episode = {"key": (task, scene_id, instance_id, episode_id), "step": 0, "wrong_actions": 0}
+        return {"key": self.current_episode["key"], "step": 0}
+
+    def step_episode(self, action, agent_time=None):
+        episode = self.current_episode
+        if action != (episode["key"], episode["step"]):
+            episode["wrong_actions"] += 1
+        episode["step"] += 1
+        time.sleep(STEP_TIME)
+        return {"key": episode["key"], "step": episode["step"]}, episode["step"] >= episode["key"][2]
+
+    def end_episode(self):
+        metrics = get_fake_metrics(*self.current_episode["key"])
+        metrics["num_steps"] = self.current_episode["step"]
+        metrics["wrong_actions"] = self.current_episode["wrong_actions"]
+        self.current_episode = None
+        return metrics
+
+
+class SlotAgent(Agent):
+    """
+    Agent that keeps the episode of each slot since its last reset and acts with the observation it receives
+    """
+
+    def __init__(self):
+        self.slot_episodes = {}
+        self.num_queries = 0
+        self.num_resets = 0
+        self.inconsistent_slots = 0
+
+    def reset(self):
+        raise AssertionError("The lockstep evaluation only resets slots")
+
+    def reset_slot(self, slot_id):
+        self.slot_episodes[slot_id] = None
+        self.num_resets += 1
+
+    def act_slots(self, obs_batch, slot_ids):
+        self.num_queries += 1
+        for obs, slot_id in zip(obs_batch, slot_ids):
+            if self.slot_episodes[slot_id] is None:
+                self.slot_episodes[slot_id] = obs["key"]
+            elif self.slot_episodes[slot_id] != obs["key"]:
+                self.inconsistent_slots += 1
+        return [(obs["key"], obs["step"]) for obs in obs_batch]
+
+
+def test_slots_are_refilled_as_soon_as_their_episode_ends(tmp_path):
+    agent = SlotAgent()
+    benchmark = LockstepBenchmark(agent, output_dir=str(tmp_path), split="dev")
+    # One long episode and several short ones: in waves, the short ones would wait for the long one
+    lengths = [40, 1, 2, 3, 1, 2, 1]
+    episodes = [(episode, ("cleaning_oven", "Rs_int", length, episode, {})) for episode, length in enumerate(lengths)]
+    with LockstepEnvironments(benchmark, 2) as environments:
+        completed = list(environments.run(episodes))
+    results = dict(completed)
+
+    assert sorted(results.keys()) == list(range(len(lengths)))
+    for episode, length in enumerate(lengths):
+        assert results[episode]["num_steps"] == length
+        assert results[episode]["wrong_actions"] == 0
+    assert agent.inconsistent_slots == 0
+    assert agent.num_resets == len(lengths)
+    # The short episodes run in the second slot while the long one runs in the first, instead of waiting for it
+    assert completed[-1][0] == 0
+    assert agent.num_queries < lengths[0] + sum(lengths[2:])
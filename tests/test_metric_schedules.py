@@ -0,0 +1,14 @@
+import pytest
+
+from behavior.benchmark.metric_scheduling import EVERY_STEP, METRIC_NAMES, ON_CHANGE, get_metric_schedules
+
+
+def test_every_metric_is_evaluated_every_step_by_default():
+    assert dict(get_metric_schedules()) == {name: EVERY_STEP for name in METRIC_NAMES}
+
+
+def test_on_change_is_opt_in():
+    schedules = get_metric_schedules({"KinematicDisarrangement": ON_CHANGE})
+    assert schedules["KinematicDisarrangement"] == ON_CHANGE
+    with pytest.raises(AssertionError):
+        get_metric_schedules({"TaskMetric": ON_CHANGE})
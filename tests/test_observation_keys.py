@@ -0,0 +1,63 @@
+"""
+Tests of the restriction of the observations computed by the environment to the ones used by the agent
+"""
+import numpy as np
+import pytest
+from benchmark_fakes import ENV_CONFIG, FakeBenchmark, write_plan
+
+from behavior.benchmark.agents.agent import Agent
+from behavior.benchmark.agents.remote_agent import RemoteAgent
+from behavior.benchmark.run_options import RunOptions
+
+
+class VisionAgent(Agent):
+    def get_observation_keys(self):
+        return ["rgb", "proprioception"]
+
+    def act(self, obs):
+        return np.zeros(28)
+
+
+def evaluate_outputs(tmp_path, agent, restrict_outputs=True):
+    """
+    :return: Set of output lists of the environment configs of the evaluated episodes
+    """
+    benchmark = FakeBenchmark(
+        agent,
+        output_dir=str(tmp_path),
+        split="dev",
+        options=RunOptions(plan_file=write_plan(str(tmp_path)), restrict_outputs=restrict_outputs),
+    )
+    benchmark.evaluate_agent()
+    assert len(benchmark.evaluated_configs) == benchmark.num_planned_episodes
+    return set(tuple(env_config["output"]) for env_config in benchmark.evaluated_configs)
+
+
+@pytest.mark.parametrize("remote", [False, True])
+def test_outputs_are_restricted_to_the_agent_observations(tmp_path, remote):
+    agent = RemoteAgent(VisionAgent) if remote else VisionAgent()
+    try:
+        # In the order of the environment config
+        assert evaluate_outputs(tmp_path, agent) == {("proprioception", "rgb")}
+    finally:
+        if remote:
+            agent.close()
+
+
+def test_all_outputs(tmp_path):
+    assert evaluate_outputs(tmp_path, VisionAgent(), restrict_outputs=False) == {tuple(ENV_CONFIG["output"])}
+
+
+def test_remote_agent_queries_the_keys_once():
+    agent = RemoteAgent(VisionAgent)
+    try:
+        assert agent.get_observation_keys() == ["rgb", "proprioception"]
+        process = agent.process
+        assert agent.get_observation_keys() == ["rgb", "proprioception"]
+        # The agent process that answered the query is the one that acts
+        obs = {"rgb": np.zeros((8, 8, 3), dtype=np.uint8), "proprioception": np.zeros(20, dtype=np.float32)}
+        agent.reset()
+        assert np.array_equal(agent.act(obs), np.zeros(28))
+        assert agent.process is process
+    finally:
+        agent.close()
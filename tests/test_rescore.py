@@ -0,0 +1,123 @@
+"""
+Test that replaying the recorded actions of benchmark episodes without the agent reproduces their metrics
+The environment and the metrics are synthetic: the environment draws noise from the global numpy generator at every
+step and the agent draws its actions from it as well
+"""
+import glob
+
+import numpy as np
+import pytest
+
+gym = pytest.importorskip("gym")
+
+import behavior.benchmark.behavior_benchmark as behavior_benchmark
+from behavior.benchmark.agents.agent import Agent
+from behavior.benchmark.rescore import rescore
+from behavior.benchmark.run_options import RunOptions
+from behavior.benchmark.trajectory import TRAJECTORY_DIR, load_trajectory
+
+
+class NoisyEnv(gym.Env):
+    """
+    Environment whose state integrates the actions and some noise
+    """
+
+    def __init__(self, env_config):
+        self.config = env_config
+        self.output = env_config["output"]
+        self.max_step = env_config["max_step"]
+        self.position = np.zeros(3)
+        self.num_steps = 0
+
+    def reload_model(self, scene_id):
+        self.max_step = self.config["max_step"]
+
+    def get_state(self):
+        return {"proprioception": self.position.copy()}
+
+    def reset(self):
+        self.position = np.random.uniform(size=3)
+        self.num_steps = 0
+        return self.get_state()
+
+    def step(self, action):
+        self.position = self.position + np.asarray(action) + np.random.normal(scale=0.1, size=3)
+        self.num_steps += 1
+        return self.get_state(), 0.0, self.num_steps >= self.max_step, {}
+
+    def close(self):
+        pass
+
+
+class PositionMetric(object):
+    """
+    Metric summarizing the states of the environment in the format of the benchmark metrics
+    """
+
+    def __init__(self):
+        self.positions = []
+
+    def start_callback(self, env, _):
+        pass
+
+    def step_callback(self, env, _, final_step=False):
+        self.positions.append(env.position.copy())
+
+    def end_callback(self, env, _):
+        pass
+
+    def gather_results(self):
+        positions = np.array(self.positions)
+        return {
+            "q_score": {"final": float(np.mean(positions > 0))},
+            "time": {"simulator_time": float(len(positions))},
+            "kinematic_disarrangement": {"relative": float(np.linalg.norm(positions[-1] - positions[0]))},
+            "logical_disarrangement": {"relative": 0.0},
+            "agent_distance": {"timestep": {"body": np.linalg.norm(np.diff(positions, axis=0), axis=1).tolist()}},
+            "grasp_distance": {"timestep": {"left_hand": [0.0], "right_hand": [0.0]}},
+            "positions": positions.tolist(),
+        }
+
+
+def get_metrics_callbacks(metric_schedules=None):
+    metric = PositionMetric()
+    return [metric.start_callback], [metric.step_callback], [metric.end_callback], [metric.gather_results]
+
+
+class NoisyAgent(Agent):
+    def act(self, obs):
+        return np.random.uniform(low=-1.0, high=1.0, size=3)
+
+
+def test_rescore_reproduces_the_recorded_metrics(tmp_path, monkeypatch):
+    monkeypatch.setattr(behavior_benchmark, "create_headless_env", NoisyEnv)
+    monkeypatch.setattr(behavior_benchmark, "get_metrics_callbacks", get_metrics_callbacks)
+    run_dir = str(tmp_path / "run")
+    benchmark = behavior_benchmark.BehaviorBenchmark(
+        NoisyAgent(),
+        env_config_file=None,
+        output_dir=run_dir,
+        split="rescore",
+        options=RunOptions(record_trajectories=True, seed=3),
+    )
+    benchmark.start_run()
+    env_config = {
+        "output": ["proprioception"],
+        "scene_id": "Rs_int",
+        "robot": {"name": "BehaviorRobot"},
+        "task": "cleaning_oven",
+        "max_step": 20,
+    }
+    episodes = [
+        (episode, ("cleaning_oven", "Rs_int", instance_id, episode_id, env_config))
+        for episode, (instance_id, episode_id) in enumerate([(0, 0), (0, 1), (10, 0)])
+    ]
+    recorded_metrics = benchmark.evaluate_episodes(episodes)
+
+    for path in glob.glob(str(tmp_path / "run" / TRAJECTORY_DIR / "*.hdf5")):
+        assert load_trajectory(path)[0]["env_cache_size"] == 0
+    rescored_metrics = rescore([str(tmp_path / "run" / TRAJECTORY_DIR)], str(tmp_path / "rescored"))
+    assert sorted(rescored_metrics.keys()) == sorted(recorded_metrics.keys())
+    for episode, metrics in recorded_metrics.items():
+        for key in ["positions", "q_score", "kinematic_disarrangement", "agent_distance", "seed"]:
+            assert rescored_metrics[episode][key] == metrics[key]
@@ -0,0 +1,118 @@
+"""
+Tests of the evaluation of the benchmark in shards and the merge of their results
+"""
+import json
+import multiprocessing
+import os
+
+import pytest
+from benchmark_fakes import FakeBenchmark, get_episode_keys, write_plan
+
+from behavior.benchmark.aggregation import FAILED_EPISODES_FILE
+from behavior.benchmark.merge_results import SHARD_INFO_FILE, merge_results
+from behavior.benchmark.run_options import RunOptions
+
+RESULT_FILES = ["per_episode_metrics.json", "aggregated_metrics.json", FAILED_EPISODES_FILE]
+
+
+def evaluate_shard(plan_file, output_dir, shard_index, num_shards, fail_episodes=()):
+    """
+    :param fail_episodes: Episode keys that raise an exception. If any, the episodes are evaluated in a worker process
+        so that the failures are recorded
+    """
+    benchmark = FakeBenchmark(
+        output_dir=output_dir,
+        split="dev",
+        options=RunOptions(
+            plan_file=plan_file,
+            shard_index=shard_index,
+            num_shards=num_shards,
+            num_workers=1 if len(fail_episodes) > 0 else 0,
+        ),
+        fail_episodes=fail_episodes,
+    )
+    benchmark.evaluate_agent()
+
+
+def read_results(directory):
+    results = {}
+    for name in RESULT_FILES:
+        with open(os.path.join(directory, name), "rb") as f:
+            results[name] = f.read()
+    return results
+
+
+@pytest.mark.parametrize("num_shards", [2, 5, 25])
+def test_merged_shards_match_single_node(tmp_path, num_shards):
+    plan_file = write_plan(str(tmp_path))
+    single_dir = str(tmp_path / "single")
+    evaluate_shard(plan_file, single_dir, 0, 1)
+
+    # Each shard is evaluated in its own process, as on separate nodes. With 25 shards some of them have no episodes
+    shard_dirs = [str(tmp_path / "shard_{}".format(shard_index)) for shard_index in range(num_shards)]
+    context = multiprocessing.get_context("fork")
+    processes = [
+        context.Process(target=evaluate_shard, args=(plan_file, shard_dir, shard_index, num_shards))
+        for shard_index, shard_dir in enumerate(shard_dirs)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    for shard_dir in shard_dirs:
+        assert os.path.exists(os.path.join(shard_dir, "per_episode_metrics.json"))
+        assert os.path.exists(os.path.join(shard_dir, SHARD_INFO_FILE))
+
+    merged_dir = str(tmp_path / "merged")
+    merge_results(shard_dirs, merged_dir)
+    assert read_results(merged_dir) == read_results(single_dir)
+
+
+def test_merged_shards_with_failed_episodes_match_single_node(tmp_path):
+    plan_file = write_plan(str(tmp_path))
+    fail_episodes = get_episode_keys()[::3]
+    single_dir = str(tmp_path / "single")
+    evaluate_shard(plan_file, single_dir, 0, 1, fail_episodes=fail_episodes)
+    failed_episodes = json.loads(read_results(single_dir)[FAILED_EPISODES_FILE])
+    assert len(failed_episodes) == len(fail_episodes)
+
+    # One episode per shard: the shards of the failed episodes have no successful episodes
+    num_shards = len(get_episode_keys())
+    shard_dirs = [str(tmp_path / "shard_{}".format(shard_index)) for shard_index in range(num_shards)]
+    for shard_index, shard_dir in enumerate(shard_dirs):
+        evaluate_shard(plan_file, shard_dir, shard_index, num_shards, fail_episodes=fail_episodes)
+    merged_dir = str(tmp_path / "merged")
+    merge_results(shard_dirs, merged_dir)
+    assert read_results(merged_dir) == read_results(single_dir)
+
+
+def test_merge_of_shards_where_all_episodes_failed(tmp_path):
+    plan_file = write_plan(str(tmp_path))
+    fail_episodes = get_episode_keys()
+    shard_dirs = [str(tmp_path / "shard_{}".format(shard_index)) for shard_index in range(3)]
+    for shard_index, shard_dir in enumerate(shard_dirs):
+        evaluate_shard(plan_file, shard_dir, shard_index, 3, fail_episodes=fail_episodes)
+    merged_dir = str(tmp_path / "merged")
+    merge_results(shard_dirs, merged_dir)
+
+    results = {name: json.loads(content) for name, content in read_results(merged_dir).items()}
+    assert results["per_episode_metrics.json"] == {}
+    assert results["aggregated_metrics.json"] == {}
+    failed_episodes = results[FAILED_EPISODES_FILE]
+    assert [int(episode) for episode in failed_episodes.keys()] == list(range(len(fail_episodes)))
+    assert sorted(
+        (failure["task"], failure["scene_id"], failure["instance_id"], failure["episode_id"])
+        for failure in failed_episodes.values()
+    ) == sorted(fail_episodes)
+    assert all(failure["failure"].startswith("raised an exception") for failure in failed_episodes.values())
+
+
+def test_merge_requires_the_per_episode_metrics_of_every_shard(tmp_path):
+    plan_file = write_plan(str(tmp_path))
+    shard_dirs = [str(tmp_path / "shard_{}".format(shard_index)) for shard_index in range(2)]
+    for shard_index, shard_dir in enumerate(shard_dirs):
+        evaluate_shard(plan_file, shard_dir, shard_index, 2)
+    os.remove(os.path.join(shard_dirs[1], "per_episode_metrics.json"))
+    with pytest.raises(ValueError):
+        merge_results(shard_dirs, str(tmp_path / "merged"))
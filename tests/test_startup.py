@@ -0,0 +1,44 @@
+"""
+The benchmark entry point must start fast: importing it and running its command line help must not import the
+simulator, the dataset definitions or the learning frameworks of the agents
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that are only imported when an episode is executed or an agent is created
+HEAVY_MODULES = ["igibson", "bddl", "pybullet", "stable_baselines3", "torch"]
+
+# Code run before printing the heavy modules imported in the fresh interpreter
+STARTUP_CODE = {
+    "import": "import behavior.benchmark.behavior_benchmark",
+    "help": (
+        "import runpy\n"
+        "sys.argv = ['behavior_benchmark', '--help']\n"
+        "try:\n"
+        "    runpy.run_module('behavior.benchmark.behavior_benchmark', run_name='__main__')\n"
+        "except SystemExit:\n"
+        "    pass"
+    ),
+}
+
+
+def get_imported_heavy_modules(startup_code):
+    """
+    :return: List of the heavy modules imported by the startup code, in a fresh interpreter
+    """
+    code = "import json, sys\n{}\nprint(json.dumps([name for name in {} if name in sys.modules]))".format(
+        startup_code, HEAVY_MODULES
+    )
+    output = subprocess.run([sys.executable, "-c", code], check=True, stdout=subprocess.PIPE, cwd=REPO_ROOT).stdout
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize("command", sorted(STARTUP_CODE.keys()))
+def test_startup_does_not_import_heavy_modules(command):
+    assert get_imported_heavy_modules(STARTUP_CODE[command]) == []
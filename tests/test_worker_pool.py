@@ -0,0 +1,79 @@
+"""
+Tests of the supervision of the worker processes evaluating the episodes of the benchmark
+"""
+import json
+import os
+import time
+
+from benchmark_fakes import FakeBenchmark, get_episode_keys, write_plan
+
+from behavior.benchmark.aggregation import FAILED_EPISODES_FILE
+from behavior.benchmark.run_options import RunOptions
+from behavior.benchmark.worker_pool import EpisodeWorkerPool
+
+FAILED_EPISODE = ("cleaning_oven", "Rs_int", 10, 0)
+HUNG_EPISODE = ("sorting_books", "Pomaria_1_int", 2, 0)
+CRASHED_EPISODE = ("assembling_gift_baskets", "Beechwood_0_int", 20, 0)
+
+
+def read_json(directory, name):
+    with open(os.path.join(directory, name)) as f:
+        return json.load(f)
+
+
+def test_failed_episodes_do_not_stop_the_evaluation(tmp_path):
+    benchmark = FakeBenchmark(
+        output_dir=str(tmp_path),
+        split="dev",
+        options=RunOptions(plan_file=write_plan(str(tmp_path)), num_workers=2, episode_timeout=2.0),
+        fail_episodes=[FAILED_EPISODE],
+        hang_episodes=[HUNG_EPISODE],
+        crash_episodes=[CRASHED_EPISODE],
+    )
+    benchmark.evaluate_agent()
+
+    failures = {
+        tuple(failure[key] for key in ["task", "scene_id", "instance_id", "episode_id"]): failure["failure"]
+        for failure in read_json(str(tmp_path), FAILED_EPISODES_FILE).values()
+    }
+    assert sorted(failures.keys()) == sorted([FAILED_EPISODE, HUNG_EPISODE, CRASHED_EPISODE])
+    assert failures[FAILED_EPISODE].startswith("raised an exception")
+    assert "Synthetic failure" in failures[FAILED_EPISODE]
+    assert failures[HUNG_EPISODE] == "exceeded the wall-clock budget of 2.0s"
+    assert failures[CRASHED_EPISODE] == "the worker died (exit code 3)"
+    assert len(read_json(str(tmp_path), "per_episode_metrics.json")) == benchmark.num_planned_episodes - 3
+
+
+def test_failed_run_replaces_the_results_of_a_previous_run(tmp_path):
+    plan_file = write_plan(str(tmp_path))
+    FakeBenchmark(output_dir=str(tmp_path), split="dev", options=RunOptions(plan_file=plan_file)).evaluate_agent()
+    assert len(read_json(str(tmp_path), "aggregated_metrics.json")) > 0
+
+    benchmark = FakeBenchmark(
+        output_dir=str(tmp_path),
+        split="dev",
+        options=RunOptions(plan_file=plan_file, num_workers=1),
+        fail_episodes=get_episode_keys(),
+    )
+    benchmark.evaluate_agent()
+    assert len(read_json(str(tmp_path), FAILED_EPISODES_FILE)) == benchmark.num_planned_episodes
+    assert read_json(str(tmp_path), "per_episode_metrics.json") == {}
+    assert read_json(str(tmp_path), "aggregated_metrics.json") == {}
+
+
+def test_recycled_workers_do_not_block_the_others(tmp_path):
+    close_delay = 3.0
+    benchmark = FakeBenchmark(
+        output_dir=str(tmp_path),
+        split="dev",
+        options=RunOptions(recycle_worker_episodes=1),
+        close_delay=close_delay,
+    )
+    episodes = [(episode, ("cleaning_oven", "Rs_int", 0, episode, {})) for episode in range(8)]
+    with EpisodeWorkerPool(benchmark, 2) as pool:
+        start_time = time.time()
+        results = list(pool.run(episodes))
+        # Each worker is recycled after every episode and takes close_delay seconds to exit
+        assert time.time() - start_time < close_delay
+    assert sorted(episode for episode, _, _ in results) == list(range(8))
+    assert all(metrics is not None and failure is None for _, metrics, failure in results)